@@ -0,0 +1,241 @@
+"""Admission control for /receive_data: bounded concurrent work with a queue-time deadline.
+
+A batch first takes a slot of its key (the key's ``max_concurrent``, else
+``per_key``; 0 for no cap) and one of the server's (``max_batches``); each of its
+entries then takes one unit of ``max_sends`` per recipient before it is
+sent and gives it back once that send finished, so reading the body pauses
+while the server has too many sends waiting. A merged batch is planned
+whole, so each of its planned sends takes one unit instead; a queued batch
+takes none. Each wait ends at the batch's deadline, ``timeout`` seconds
+after it arrived: a batch refused a slot is answered 429 (its key) or 503
+(the server) with Retry-After, and entries refused units fail with
+``retry_after`` and are not sent. Whatever a batch still holds is returned
+when its response is finished.
+"""
+import asyncio
+import math
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterable, AsyncIterator, Deque, Dict, Optional, Tuple
+
+from auth import Device
+from delivery import RejectedEntry
+from recipients import parse_ids
+
+
+class Overloaded(Exception):
+    """A batch wasn't admitted before its deadline; ``status_code`` is 429 (its key) or 503 (the server)."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Capacity:
+    """A counting semaphore whose waiters take ``units`` (at most ``limit``) each, in arrival order."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _dispatch(self) -> None:
+        while self._waiters:
+            units, future = self._waiters[0]
+            if future.done():  # timed out or cancelled
+                self._waiters.popleft()
+                continue
+            if self.used + units > self.limit:
+                return
+            self._waiters.popleft()
+            self.used += units
+            future.set_result(None)
+
+    async def acquire(self, units: int = 1, timeout: Optional[float] = None) -> bool:
+        """Take ``units``; False if that didn't happen within ``timeout`` seconds."""
+        if not self._waiters and self.used + units <= self.limit:
+            self.used += units
+            return True
+        if timeout is not None and timeout <= 0:
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((units, future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return True
+            future.cancel()
+            # A smaller request behind this one may fit now
+            self._dispatch()
+            return False
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled: hand the units on
+                self.release(units)
+            else:
+                future.cancel()
+                self._dispatch()
+            raise
+
+    def release(self, units: int = 1) -> None:
+        self.used -= units
+        self._dispatch()
+
+
+class AdmissionControl:
+    """Caps the batches in progress, globally and per key, and the sends they hold.
+
+    ``rejected`` counts refusals by reason: "key" and "busy" batches,
+    "sends" entries.
+    """
+
+    def __init__(
+        self,
+        max_batches: int = 64,
+        per_key: int = 0,
+        max_sends: int = 1000,
+        timeout: float = 10.0,
+        metrics=None,
+    ):
+        self.batches = Capacity(max_batches)
+        self.sends = Capacity(max_sends)
+        self.per_key = per_key
+        self.timeout = timeout
+        # Retry-After of refusals: the queue didn't move for a whole deadline
+        self.retry_after = max(1, math.ceil(timeout))
+        self.rejected: Dict[str, int] = {"key": 0, "busy": 0, "sends": 0}
+        self._keys: Dict[str, Capacity] = {}
+        self.metrics = metrics
+
+    def _reject(self, reason: str) -> None:
+        self.rejected[reason] += 1
+        if self.metrics:
+            self.metrics.admission_rejected.inc(reason)
+
+    def _key_capacity(self, device: Device) -> Optional[Capacity]:
+        limit = device.max_concurrent or self.per_key
+        if limit <= 0:
+            return None
+        capacity = self._keys.get(device.name)
+        if capacity is None or (capacity.limit != limit and not capacity.used):
+            capacity = self._keys[device.name] = Capacity(limit)
+        return capacity
+
+    async def admit(self, device: Device) -> "Ticket":
+        """Wait for a slot of ``device``'s key and one of the server's. Raises Overloaded."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        key = self._key_capacity(device)
+        if key is not None and not await key.acquire(1, self.timeout):
+            self._reject("key")
+            raise Overloaded("Too many batches in progress for this key", 429, self.retry_after)
+        try:
+            admitted = await self.batches.acquire(1, deadline - loop.time())
+        except BaseException:
+            self._release_key(device.name, key)
+            raise
+        if not admitted:
+            self._release_key(device.name, key)
+            self._reject("busy")
+            raise Overloaded("Server busy, too many batches in progress", 503, self.retry_after)
+        return Ticket(self, device.name, key, deadline)
+
+    def _release_key(self, name: str, key: Optional[Capacity]) -> None:
+        if key is None:
+            return
+        key.release()
+        # Keys without batches in progress aren't kept
+        if not key.used and not key.waiting and self._keys.get(name) is key:
+            del self._keys[name]
+
+
+class Ticket:
+    """One admitted batch: the slots it holds and the send units its entries took."""
+
+    def __init__(self, control: AdmissionControl, name: str, key: Optional[Capacity], deadline: float):
+        self.control = control
+        self.name = name
+        self.key = key
+        self.deadline = deadline
+        # Send units held by each entry, by index in the batch
+        self.held: Dict[int, int] = {}
+        # Entries (or merged sends) refused send units
+        self.rejected = 0
+        self._released = False
+
+    @property
+    def sends(self) -> int:
+        """Send units the batch holds."""
+        return sum(self.held.values())
+
+    async def entries(self, entries: AsyncIterable[Any]) -> AsyncIterator[Any]:
+        """Pass ``entries`` on once each holds a send unit per recipient; refused ones are rejected."""
+        control = self.control
+        loop = asyncio.get_running_loop()
+        index = 0
+        async for entry in entries:
+            units = 1
+            if isinstance(entry, dict) and isinstance(entry.get("ids"), str):
+                units = max(1, len(parse_ids(entry["ids"])))
+            # An entry with more recipients than the cap takes all of it
+            units = min(units, control.sends.limit)
+            if await control.sends.acquire(units, self.deadline - loop.time()):
+                self.held[index] = units
+            else:
+                self.rejected += 1
+                control._reject("sends")
+                entry = RejectedEntry("Server busy, too many sends in progress", control.retry_after)
+            index += 1
+            yield entry
+
+    def done(self, index: int, whole: bool = False) -> None:
+        """An outcome of entry ``index`` is known: give back one of its send units.
+
+        ``whole`` gives back all of them, for an entry that failed before
+        any send (validation). Entries that hold none give back nothing.
+        """
+        held = self.held.get(index, 0)
+        units = held if whole else min(held, 1)
+        if not units:
+            return
+        if units == held:
+            del self.held[index]
+        else:
+            self.held[index] = held - units
+        self.control.sends.release(units)
+
+    @asynccontextmanager
+    async def send_unit(self) -> AsyncIterator[Optional[RejectedEntry]]:
+        """Hold one send unit for a send planned from the whole batch (merged entries).
+
+        Yields None once it is held, or the RejectedEntry to fail the send
+        with if it wasn't before the deadline.
+        """
+        control = self.control
+        if not await control.sends.acquire(1, self.deadline - asyncio.get_running_loop().time()):
+            self.rejected += 1
+            control._reject("sends")
+            yield RejectedEntry("Server busy, too many sends in progress", control.retry_after)
+            return
+        try:
+            yield None
+        finally:
+            control.sends.release()
+
+    def release(self) -> None:
+        """Give back everything the batch holds; later calls do nothing."""
+        if self._released:
+            return
+        self._released = True
+        control = self.control
+        control.sends.release(self.sends)
+        self.held.clear()
+        control.batches.release()
+        control._release_key(self.name, self.key)
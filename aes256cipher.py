@@ -1,15 +1,101 @@
 import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import os
 
+SALT_SIZE = 16
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+
+class KeyCache:
+    """Thread-safe LRU of PBKDF2-derived keys with TTL expiry.
+
+    Keys are held in bytearrays so evicted entries can be overwritten with zeros.
+    """
+
+    def __init__(self, maxsize=256, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _cache_key(secret, salt):
+        return hashlib.sha256(secret).digest(), bytes(salt)
+
+    @staticmethod
+    def _zeroize(key):
+        key[:] = bytes(len(key))
+
+    def get(self, secret, salt):
+        cache_key = self._cache_key(secret, salt)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            key, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[cache_key]
+                self._zeroize(key)
+                return None
+            self._entries.move_to_end(cache_key)
+            return bytes(key)
+
+    def put(self, secret, salt, key):
+        cache_key = self._cache_key(secret, salt)
+        with self._lock:
+            old = self._entries.pop(cache_key, None)
+            if old is not None:
+                self._zeroize(old[0])
+            self._entries[cache_key] = (bytearray(key), time.monotonic() + self.ttl)
+            while len(self._entries) > self.maxsize:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._zeroize(evicted)
+
+    def discard(self, secret, salt):
+        with self._lock:
+            entry = self._entries.pop(self._cache_key(secret, salt), None)
+            if entry is not None:
+                self._zeroize(entry[0])
+
+    def clear(self):
+        with self._lock:
+            for key, _ in self._entries.values():
+                self._zeroize(key)
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared by every AES256Cipher that isn't given its own cache
+default_key_cache = KeyCache()
+
+
 class AES256Cipher:
-    def __init__(self, secret_phrase):
+    def __init__(self, secret_phrase, key_cache=default_key_cache, session_ttl=None):
+        """``session_ttl`` (seconds) makes encrypt() reuse one salt, and so one derived
+        key, for that long; every message still gets a fresh nonce."""
         self.secret_phrase = secret_phrase.encode()
+        self.key_cache = key_cache
+        self.session_ttl = session_ttl
+        self._session_lock = threading.Lock()
+        self._session_salt = None
+        self._session_expires = 0.0
 
     def _derive_key(self, salt):
+        if self.key_cache is not None:
+            key = self.key_cache.get(self.secret_phrase, salt)
+            if key is not None:
+                return key
         kdf = PBKDF2HMAC(
             algorithm=hashes.SHA256(),
             length=32,
@@ -17,10 +103,30 @@ class AES256Cipher:
             iterations=65536,  # Match Kotlin's iteration count
             backend=default_backend()
         )
-        return kdf.derive(self.secret_phrase)
+        key = kdf.derive(self.secret_phrase)
+        if self.key_cache is not None:
+            self.key_cache.put(self.secret_phrase, salt, key)
+        return key
+
+    def _next_salt(self):
+        if not self.session_ttl:
+            return os.urandom(16)
+        with self._session_lock:
+            now = time.monotonic()
+            if self._session_salt is None or now >= self._session_expires:
+                self._session_salt = os.urandom(16)
+                self._session_expires = now + self.session_ttl
+            return self._session_salt
+
+    def end_session(self):
+        """Forget the session salt and zeroize its cached key."""
+        with self._session_lock:
+            if self._session_salt is not None and self.key_cache is not None:
+                self.key_cache.discard(self.secret_phrase, self._session_salt)
+            self._session_salt = None
 
     def encrypt(self, plaintext):
-        salt = os.urandom(16)
+        salt = self._next_salt()
         key = self._derive_key(salt)
         nonce = os.urandom(12)  # GCM typically uses a 12-byte nonce
         cipher = Cipher(algorithms.AES(key), modes.GCM(nonce), backend=default_backend())
@@ -38,3 +144,75 @@ class AES256Cipher:
         cipher = Cipher(algorithms.AES(key), modes.GCM(nonce, tag), backend=default_backend())
         decryptor = cipher.decryptor()
         return (decryptor.update(ciphertext) + decryptor.finalize()).decode('utf-8')
+
+    def _context(self, contexts, salt):
+        """AESGCM for ``salt``, shared by the items of one encrypt_many/decrypt_many call."""
+        context = contexts.get(salt)
+        if context is None:
+            if len(contexts) >= 64:
+                contexts.clear()
+            context = contexts[salt] = AESGCM(self._derive_key(salt))
+        return context
+
+    def _encrypt_one(self, contexts, salt, plaintext):
+        nonce = os.urandom(NONCE_SIZE)
+        sealed = self._context(contexts, salt).encrypt(nonce, plaintext.encode(), None)
+        # AESGCM appends the tag, which is the wire layout: salt | nonce | ciphertext | tag
+        return base64.b64encode(b"".join((salt, nonce, sealed))).decode("ascii")
+
+    def _decrypt_one(self, contexts, token):
+        data = memoryview(base64.b64decode(token))
+        if len(data) < SALT_SIZE + NONCE_SIZE + TAG_SIZE:
+            raise ValueError("Ciphertext is too short")
+        salt = bytes(data[:SALT_SIZE])
+        nonce = data[SALT_SIZE:SALT_SIZE + NONCE_SIZE]
+        plaintext = self._context(contexts, salt).decrypt(nonce, data[SALT_SIZE + NONCE_SIZE:], None)
+        return str(plaintext, "utf-8")
+
+    def encrypt_many(self, plaintexts, executor=None, prefetch=64):
+        """Yield encrypt(p) for each of ``plaintexts``, in order.
+
+        Without a session the whole call uses one salt (so one PBKDF2 run),
+        as session_ttl would; each message still gets a fresh nonce.
+        """
+        salt = self._next_salt() if self.session_ttl else os.urandom(SALT_SIZE)
+        contexts = {}
+        return _map(lambda p: self._encrypt_one(contexts, salt, p), plaintexts, executor, prefetch)
+
+    def decrypt_many(self, tokens, executor=None, prefetch=64, return_exceptions=False):
+        """Yield decrypt(t) for each of ``tokens``, in order, deriving each salt's key once.
+
+        With ``executor`` (a thread pool: cryptography releases the GIL) up to
+        ``prefetch`` items are in flight. ``return_exceptions`` yields a
+        token's exception in its place instead of raising it.
+        """
+        contexts = {}
+
+        def decrypt(token):
+            try:
+                return self._decrypt_one(contexts, token)
+            except Exception as e:
+                if return_exceptions:
+                    return e
+                raise
+
+        return _map(decrypt, tokens, executor, prefetch)
+
+
+def _map(fn, items, executor, prefetch):
+    """Lazy, ordered map; on ``executor`` keeps at most ``prefetch`` calls in flight."""
+    if executor is None:
+        for item in items:
+            yield fn(item)
+        return
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,294 @@
+"""Append-only log of delivery outcomes in fixed-size binary records.
+
+Records go to segment files ``audit-<first ms>-<pid>.seg`` in one directory,
+so worker processes can share it; a new segment starts when the current one reaches ``segment_bytes`` and the
+oldest are deleted beyond ``keep_segments``. Next to each segment, a
+``.idx`` file holds (timestamp, record number) every INDEX_EVERY records,
+so a time-range query bisects a few KB and reads the segment through mmap
+from there instead of loading it. Records hold no message text: a send is
+identified by the chat, the time and a hash of the text Telegram got.
+"""
+import asyncio
+import bisect
+import hashlib
+import heapq
+import itertools
+import logging
+import mmap
+import os
+import struct
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"OTPAUD01"
+# time (unix seconds), chat, message_id, latency (µs), entry hash, error code, status, flags
+RECORD = struct.Struct("<dqII8sHBB")
+INDEX = struct.Struct("<dI")
+INDEX_EVERY = 256
+
+STATUSES = ("sent", "failed", "duplicate")
+# Set when ``chat`` holds a hash rather than the numeric chat ID: of an
+# @username, or of a number that doesn't fit the record's 64 bits
+HASHED = 1
+
+
+def entry_hash(text: str) -> bytes:
+    """First 8 bytes of the SHA-256 of a sent text, stored instead of the text."""
+    return hashlib.sha256(text.encode()).digest()[:8]
+
+
+def chat_key(chat_id: str) -> Tuple[int, int]:
+    """(chat, flags) as stored for ``chat_id``; @usernames and out-of-range numbers are stored hashed."""
+    chat_id = chat_id.strip()
+    try:
+        chat = int(chat_id)
+        if -2 ** 63 <= chat < 2 ** 63:
+            return chat, 0
+    except ValueError:
+        pass
+    digest = hashlib.sha256(chat_id.lower().encode()).digest()
+    return int.from_bytes(digest[:8], "little", signed=True), HASHED
+
+
+@dataclass
+class AuditRecord:
+    time: float
+    chat: int
+    message_id: int
+    latency: float
+    entry_hash: bytes
+    error_code: int
+    status: str
+    flags: int = 0
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "time": self.time,
+            "chat_id": f"@{self.chat & (2 ** 64 - 1):016x}" if self.flags & HASHED else str(self.chat),
+            "status": self.status,
+            "message_id": self.message_id or None,
+            "latency_ms": round(self.latency * 1000, 3),
+            "entry_hash": self.entry_hash.hex(),
+            "error_code": self.error_code or None,
+        }
+
+
+def segment_start(name: str) -> Tuple[float, int]:
+    """(first time, pid) from a segment name; the time is rounded down to the millisecond."""
+    ms, pid = name[len("audit-"):].split("-")
+    return int(ms) / 1000, int(pid)
+
+
+def pack(record: AuditRecord) -> bytes:
+    return RECORD.pack(
+        record.time, record.chat, record.message_id, min(int(record.latency * 1e6), 2 ** 32 - 1),
+        record.entry_hash, record.error_code, STATUSES.index(record.status), record.flags,
+    )
+
+
+def unpack(data, offset: int = 0) -> AuditRecord:
+    ts, chat, message_id, latency, digest, error_code, status, flags = RECORD.unpack_from(data, offset)
+    return AuditRecord(ts, chat, message_id, latency / 1e6, digest, error_code, STATUSES[status], flags)
+
+
+class AuditLog:
+    """Buffers outcomes in memory and appends them to disk in batches from a background task.
+
+    record() never blocks the caller: past ``max_pending`` buffered records
+    new ones are dropped and counted in ``dropped``. Writes are flushed to
+    the OS after each batch but not fsynced.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 16 * 1024 * 1024,
+        keep_segments: int = 64,
+        flush_interval: float = 0.5,
+        batch_size: int = 512,
+        max_pending: int = 100000,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.keep_segments = keep_segments
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.dropped = 0
+        self.written = 0
+        self._pending: List[AuditRecord] = []
+        self._wake = asyncio.Event()
+        self._flushing = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._file = None
+        self._index = None
+        self._count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def record(
+        self,
+        chat_id: str,
+        status: str,
+        text: str,
+        latency: float = 0.0,
+        message_id: int = 0,
+        error_code: int = 0,
+    ) -> None:
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        chat, flags = chat_key(chat_id)
+        self._pending.append(AuditRecord(
+            time.time(), chat, message_id, latency, entry_hash(text), error_code, status, flags
+        ))
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write what is buffered; one batch at a time so records stay in order."""
+        async with self._flushing:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except OSError as e:
+                self.dropped += len(batch)
+                logger.warning("Failed to write audit records", extra={"error": str(e), "records": len(batch)})
+            except Exception:
+                # Whatever went wrong, the writer task has to live on for later batches
+                self.dropped += len(batch)
+                logger.exception("Failed to write audit records", extra={"records": len(batch)})
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+        if self._file:
+            self._file.close()
+            self._index.close()
+            self._file = self._index = None
+
+    # Writer thread
+
+    def _segments(self) -> List[str]:
+        """Segment names without extension, oldest first."""
+        names = [name[:-4] for name in os.listdir(self.directory) if name.endswith(".seg")]
+        return sorted(names, key=segment_start)
+
+    def _rotate(self, first: float) -> None:
+        if self._file:
+            self._file.close()
+            self._index.close()
+        name = f"audit-{int(first * 1000)}-{os.getpid()}"
+        self._file = open(os.path.join(self.directory, name + ".seg"), "ab")
+        self._file.write(MAGIC)
+        self._index = open(os.path.join(self.directory, name + ".idx"), "ab")
+        self._count = 0
+        if not self.keep_segments:
+            return
+        for old in self._segments()[:-self.keep_segments]:
+            for ext in (".seg", ".idx"):
+                try:
+                    os.remove(os.path.join(self.directory, old + ext))
+                except FileNotFoundError:
+                    pass
+
+    def _write(self, batch: List[AuditRecord]) -> None:
+        chunk, index = bytearray(), bytearray()
+        for record in batch:
+            if self._file is None or len(MAGIC) + (self._count + 1) * RECORD.size > self.segment_bytes:
+                self._append(chunk, index)
+                chunk, index = bytearray(), bytearray()
+                self._rotate(record.time)
+            if self._count % INDEX_EVERY == 0:
+                index += INDEX.pack(record.time, self._count)
+            chunk += pack(record)
+            self._count += 1
+        self._append(chunk, index)
+        self.written += len(batch)
+
+    def _append(self, chunk: bytearray, index: bytearray) -> None:
+        if chunk:
+            self._file.write(chunk)
+            self._file.flush()
+        if index:
+            self._index.write(index)
+            self._index.flush()
+
+    # Readers (any thread or process)
+
+    def query(
+        self,
+        since: float = 0.0,
+        until: float = float("inf"),
+        chat_id: Optional[str] = None,
+        limit: int = 1000,
+    ) -> Tuple[List[AuditRecord], bool]:
+        """Records with ``since <= time < until`` (and for ``chat_id``), oldest first.
+
+        Returns (records, truncated), truncated when more than ``limit`` matched.
+        """
+        key = chat_key(chat_id) if chat_id is not None else None
+        # Segments of different workers overlap in time: merge their (each
+        # time-ordered) matches lazily; each segment's index skips to ``since``
+        scans = [
+            self._scan(name, since, until, key)
+            for name in self._segments() if segment_start(name)[0] < until
+        ]
+        found = list(itertools.islice(heapq.merge(*scans, key=lambda record: record.time), limit + 1))
+        return found[:limit], len(found) > limit
+
+    def _scan(self, name: str, since: float, until: float, key) -> Iterator[AuditRecord]:
+        path = os.path.join(self.directory, name)
+        first = self._first_record(path + ".idx", since)
+        try:
+            f = open(path + ".seg", "rb")
+        except FileNotFoundError:  # removed by rotation meanwhile
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            count = (size - len(MAGIC)) // RECORD.size if size > len(MAGIC) else 0
+            if count <= first:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for n in range(first, count):
+                    offset = len(MAGIC) + n * RECORD.size
+                    ts = struct.unpack_from("<d", data, offset)[0]
+                    if ts >= until:
+                        return
+                    if ts < since:
+                        continue
+                    if key is not None and struct.unpack_from("<q", data, offset + 8)[0] != key[0]:
+                        continue
+                    record = unpack(data, offset)
+                    if key is None or record.flags == key[1]:
+                        yield record
+
+    @staticmethod
+    def _first_record(index_path: str, since: float) -> int:
+        """Number of the first record whose index block may hold times >= ``since``."""
+        try:
+            with open(index_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        entries = [INDEX.unpack_from(data, n) for n in range(0, len(data) - len(data) % INDEX.size, INDEX.size)]
+        position = bisect.bisect_left([ts for ts, _ in entries], since)
+        return entries[position - 1][1] if position > 0 else 0
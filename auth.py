@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, AsyncIterator, Dict, FrozenSet, Optional
+
+from batch_plan import normalize_chat_id
+from delivery import RejectedEntry
+from recipients import parse_ids
+from state_backend import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+def hash_key(key: str) -> str:
+    """Hex SHA-256 of an API key, as stored under ``key_sha256`` in the keys file."""
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class Device:
+    """What one API key may do: send to ``chats`` (None: any chat) within its quotas."""
+
+    name: str
+    chats: Optional[FrozenSet[str]] = None
+    # Batches per second and burst; 0 means no limit
+    rate: float = 0.0
+    burst: float = 0.0
+    # Most entries in one batch; 0 leaves the server-wide limit
+    max_batch: int = 0
+    # Most of its batches in progress at once; 0 leaves the server-wide limit
+    max_concurrent: int = 0
+
+    def allows(self, chat_id: str) -> bool:
+        return self.chats is None or normalize_chat_id(chat_id) in self.chats
+
+
+def _limit(entry: Dict[str, Any], field: str, n: int, cast, default):
+    """``entry[field]`` as a number (``cast``), ``default`` if absent."""
+    value = entry.get(field, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"key {n}: '{field}' must be a number")
+    return cast(value)
+
+
+def parse_devices(data: Any) -> Dict[bytes, Device]:
+    """Index the keys file by SHA-256 digest. Raises ValueError if it is malformed."""
+    entries = data.get("keys") if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        raise ValueError("expected a list of keys")
+    index: Dict[bytes, Device] = {}
+    names = set()
+    for n, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise ValueError(f"key {n}: expected an object")
+        if entry.get("key"):
+            digest = hashlib.sha256(str(entry["key"]).encode()).digest()
+        elif isinstance(entry.get("key_sha256"), str) and entry["key_sha256"]:
+            digest = bytes.fromhex(entry["key_sha256"])
+        else:
+            raise ValueError(f"key {n}: 'key' or 'key_sha256' is required")
+        chats = entry.get("chats")
+        if chats is not None and not isinstance(chats, list):
+            raise ValueError(f"key {n}: 'chats' must be a list")
+        # Admission capacity and quotas are kept per name
+        name = str(entry.get("name") or n)
+        if name in names:
+            raise ValueError(f"key {n}: name {name!r} is used by another key")
+        names.add(name)
+        rate = _limit(entry, "rate", n, float, 0)
+        index[digest] = Device(
+            name=name,
+            chats=frozenset(normalize_chat_id(str(c)) for c in chats) if chats is not None else None,
+            rate=rate,
+            burst=_limit(entry, "burst", n, float, rate),
+            max_batch=_limit(entry, "max_batch", n, int, 0),
+            max_concurrent=_limit(entry, "max_concurrent", n, int, 0),
+        )
+    return index
+
+
+class KeyStore:
+    """In-memory index of per-device API keys, reloaded when the keys file changes.
+
+    Keys are looked up by their SHA-256 digest, so neither the dict lookup nor
+    the final ``hmac.compare_digest`` reveals anything about the key through
+    timing. ``fallback_key`` (the single AUTH_KEY) maps to an unrestricted
+    device named "default".
+    """
+
+    def __init__(self, path: Optional[str] = None, fallback_key: Optional[str] = None):
+        self.path = path
+        self._fallback = hashlib.sha256(fallback_key.encode()).digest() if fallback_key else None
+        self._index: Dict[bytes, Device] = {}
+        self._mtime: Optional[float] = None
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def load(self) -> bool:
+        """Read the keys file if it changed since the last load; returns whether it did.
+
+        A file that can't be read or parsed leaves the current keys in place.
+        """
+        if not self.path:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return False
+            with open(self.path, encoding="utf-8") as f:
+                index = parse_devices(json.load(f))
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Failed to load API keys", extra={"path": self.path, "error": str(e)})
+            return False
+        self._mtime = mtime
+        self._index = index
+        # Keep the quota state of devices whose limits didn't change
+        limits = {d.name: (d.rate, max(d.burst, 1.0)) for d in index.values()}
+        self._buckets = {
+            name: bucket for name, bucket in self._buckets.items()
+            if limits.get(name) == (bucket.rate, bucket.capacity)
+        }
+        logger.info("Loaded API keys", extra={"path": self.path, "count": len(index)})
+        return True
+
+    async def watch(self, interval: float = 5.0) -> None:
+        """Poll the keys file's modification time and reload it when it changes."""
+        while True:
+            await asyncio.sleep(interval)
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._index) + (self._fallback is not None)
+
+    def authenticate(self, key: Optional[str]) -> Optional[Device]:
+        """The device ``key`` belongs to, or None."""
+        if not key:
+            return None
+        digest = hashlib.sha256(key.encode()).digest()
+        device = self._index.get(digest)
+        if device is not None:
+            return device
+        if self._fallback is not None and hmac.compare_digest(digest, self._fallback):
+            return Device("default")
+        return None
+
+    def admit(self, device: Device, now: Optional[float] = None) -> float:
+        """Count a batch against the device's rate; returns seconds to wait if over it (0: go)."""
+        if device.rate <= 0:
+            return 0.0
+        bucket = self._buckets.get(device.name)
+        if bucket is None:
+            bucket = self._buckets[device.name] = TokenBucket(device.rate, max(device.burst, 1.0), now)
+        # Refused batches don't use up the quota
+        return bucket.reserve(now if now is not None else time.monotonic(), max_wait=0)
+
+
+async def restrict_chats(entries: AsyncIterable[Any], device: Device) -> AsyncIterator[Any]:
+    """Reject entries addressed to a chat ``device`` may not send to."""
+    async for entry in entries:
+        if device.chats is not None and isinstance(entry, dict) and isinstance(entry.get("ids"), str):
+            denied = [c for c in parse_ids(entry["ids"]) if not device.allows(c)]
+            if denied:
+                entry = RejectedEntry(f"Chat {denied[0]} is not allowed for this key")
+        yield entry
@@ -0,0 +1,97 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# Telegram rejects sendMessage texts longer than this
+MAX_MESSAGE_LENGTH = 4096
+MERGE_SEPARATOR = "\n\n"
+
+_NUMERIC_ID = re.compile(r"-?\d+")
+
+
+def normalize_chat_id(user_id: str) -> str:
+    """Canonical form of a chat ID so "052504904" and "52504904" share one send."""
+    user_id = user_id.strip()
+    if _NUMERIC_ID.fullmatch(user_id):
+        return str(int(user_id))
+    return user_id
+
+
+@dataclass
+class Origin:
+    """One (entry, recipient) pair of the batch, reported separately."""
+
+    slot: int
+    index: int
+    user_id: str
+    fingerprint: Optional[str] = None
+
+
+@dataclass
+class PlannedSend:
+    chat_id: str
+    text: str
+    origins: List[Origin] = field(default_factory=list)
+    # Delivery lane (lanes.LANES); None leaves it to the sender
+    lane: Optional[str] = None
+    # Number the entries came from, when they share one; keys edit-in-place delivery
+    source: Optional[str] = None
+    # With merging, the (text, origins) joined into ``text``, so it can be rebuilt from some of them
+    parts: List[Tuple[str, List[Origin]]] = field(default_factory=list)
+
+    def text_of(self, origins: List[Origin]) -> str:
+        """``text`` with only the parts of a merged message that ``origins`` asked for."""
+        if not self.parts:
+            return self.text
+        slots = {o.slot for o in origins}
+        return MERGE_SEPARATOR.join(
+            text for text, part in self.parts if any(o.slot in slots for o in part)
+        )
+
+
+def plan_batch(
+    entries: List[Tuple[int, List[str], str, Optional[str]]],
+    merge: bool = False,
+    limit: int = MAX_MESSAGE_LENGTH,
+    first_slot: int = 0,
+) -> List[PlannedSend]:
+    """Group (index, user_ids, text, fingerprint) entries into the sends to make.
+
+    Each distinct (chat, text) pair is sent once however many entries or
+    repeated ids ask for it. With ``merge``, the distinct texts for one chat
+    are joined into as few messages as fit in ``limit`` characters. Origins
+    are numbered by ``slot`` in batch order (from ``first_slot``) so results
+    can be put back in place.
+    """
+    sends: Dict[Tuple[str, str], PlannedSend] = {}
+    slot = first_slot
+    for index, user_ids, text, fingerprint in entries:
+        for user_id in user_ids:
+            chat_id = normalize_chat_id(user_id)
+            planned = sends.get((chat_id, text))
+            if planned is None:
+                planned = sends[(chat_id, text)] = PlannedSend(chat_id, text)
+            planned.origins.append(Origin(slot, index, user_id, fingerprint))
+            slot += 1
+
+    if not merge:
+        return list(sends.values())
+
+    by_chat: Dict[str, List[PlannedSend]] = {}
+    for planned in sends.values():
+        by_chat.setdefault(planned.chat_id, []).append(planned)
+
+    merged = []
+    for chat_id, planned_sends in by_chat.items():
+        current: Optional[PlannedSend] = None
+        for planned in planned_sends:
+            if current is not None and len(current.text) + len(MERGE_SEPARATOR) + len(planned.text) <= limit:
+                current.text += MERGE_SEPARATOR + planned.text
+                current.origins.extend(planned.origins)
+                current.parts.append((planned.text, planned.origins))
+                continue
+            current = PlannedSend(
+                chat_id, planned.text, list(planned.origins), parts=[(planned.text, planned.origins)]
+            )
+            merged.append(current)
+    return merged
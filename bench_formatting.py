@@ -0,0 +1,68 @@
+"""Compare formatting.MessageFormatter with the format_message it replaced.
+
+    uv run bench_formatting.py [iterations]
+"""
+import re
+import sys
+import timeit
+
+from formatting import MessageFormatter
+
+SAMPLES = [
+    {"sms": "Your verification code is 827364. Do not share."},
+    {"sms": "First code: 1234, second code: 567890"},
+    {"sms": "验证码是828627，5分钟内有效。如非本人操作，请忽略本短信。"},
+    {"sms": "Hi! Your order #A-1932 ships today. Track it at https://example.com/t/abc_def?x=1"},
+    {"call": True, "from": "+861234567890", "to": "SIM 1"},
+]
+
+
+# format_message as it was before formatting.py (Markdown v1, no escaping)
+def legacy_extract_otp_codes(text):
+    otp_pattern = r'\b(\d{4,8})\b'
+
+    def replace_otp(match):
+        return f"`{match.group(1)}`"
+
+    return re.sub(otp_pattern, replace_otp, text)
+
+
+def legacy_extract_last_digits(phone, digits=6):
+    digits_only = re.sub(r'\D', '', phone)
+    return digits_only[-digits:] if len(digits_only) >= digits else digits_only
+
+
+def legacy_format_message(data):
+    lines = []
+    has_call = bool(data.get("call") and data.get("call", True))
+    has_sms = bool(data.get("sms"))
+    if has_sms:
+        lines.append(legacy_extract_otp_codes(data["sms"]))
+    elif has_call:
+        from_phone = data.get('from', 'Unknown')
+        to_location = data.get('to', 'Unknown')
+        last_digits = legacy_extract_last_digits(from_phone, 6)
+        lines.append(f"📞 {from_phone} (`{last_digits}`), {to_location}")
+    return "\n".join(lines)
+
+
+def bench(name, fn, iterations):
+    def run():
+        for sample in SAMPLES:
+            fn(sample)
+
+    best = min(timeit.repeat(run, number=iterations, repeat=5))
+    per_message = best / (iterations * len(SAMPLES)) * 1e6
+    print(f"{name:<24} {per_message:6.2f} µs/message")
+    return per_message
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    legacy = bench("legacy format_message", legacy_format_message, iterations)
+    current = bench("MessageFormatter", MessageFormatter().format_message, iterations)
+    print(f"speedup: {legacy / current:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Cold start: importing main and serving until /readyz answers 200.
+
+    uv run bench_startup.py [runs]
+
+Every run is a fresh interpreter, as after a container restart. "eager
+imports" loads what main used to import up front (telebot, cryptography,
+uvicorn) to show what lazy initialization saves. The server runs over plain
+HTTP with BOT_MODE=off so nothing talks to Telegram.
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ENV = {
+    **os.environ,
+    "BOT_TOKEN": os.environ.get("BOT_TOKEN", "123:BENCH"),
+    "AUTH_KEY": os.environ.get("AUTH_KEY", "bench"),
+    "BOT_MODE": "off",
+    "LOG_LEVEL": "WARNING",
+}
+
+IMPORTS = [
+    ("import main", "import main"),
+    ("import main + eager imports", "import main, telebot, aes256cipher, serving"),
+]
+
+
+def time_import(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=HERE, env=ENV, check=True)
+    return time.perf_counter() - start
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_ready(timeout=30.0):
+    port = free_port()
+    env = {**ENV, "QUEUE_PATH": ""}
+    code = f"import serving; serving.serve('main:create_app', host='127.0.0.1', port={port}, certfile='')"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", code], cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError("server did not become ready")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"{runs} runs, fresh interpreter each\n")
+    print("| Step | Median ms | Min ms |")
+    print("| --- | --- | --- |")
+    rows = [(label, lambda code=code: time_import(code)) for label, code in IMPORTS]
+    rows.append(("start until /readyz is 200", time_ready))
+    for label, measure in rows:
+        samples = [measure() * 1000 for _ in range(runs)]
+        print(f"| {label} | {statistics.median(samples):.0f} | {min(samples):.0f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Handshakes and latency for a client that pauses between requests, like a phone.
+
+    uv run bench_tls.py [requests] [pause seconds]
+
+Each configuration starts serving.serve() over TLS with a throwaway
+self-signed certificate. The client sends one request per pause, reusing
+its connection while the server keeps it open and offering its last TLS
+session when it has to reconnect (as OkHttp and NSURLSession do). Pauses
+are shorter than a phone's, so the "short keep-alive" rows use 1 s to
+stand in for the 5 s default against real-world gaps.
+"""
+import datetime
+import os
+import select
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+CONFIGS = [
+    # (label, keep-alive seconds, session tickets)
+    ("keep-alive 1 s, no tickets", 1, 0),
+    ("keep-alive 1 s, 2 tickets", 1, 2),
+    ("keep-alive 75 s, 2 tickets", 75, 2),
+]
+
+
+def create_bench_app():
+    from fastapi import FastAPI
+
+    app = FastAPI()
+
+    @app.get("/")
+    async def root():
+        return {"ok": True}
+
+    return app
+
+
+def write_certificate(directory):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    certfile, keyfile = os.path.join(directory, "cert.crt"), os.path.join(directory, "private.key")
+    with open(certfile, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ))
+    return certfile, keyfile
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, certfile, keyfile, keep_alive, tickets):
+    code = (
+        "import logging, serving; logging.disable(logging.CRITICAL); "
+        f"serving.serve('bench_tls:create_bench_app', host='127.0.0.1', port={port}, "
+        f"certfile={certfile!r}, keyfile={keyfile!r}, keep_alive={keep_alive}, session_tickets={tickets})"
+    )
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("server did not start")
+
+
+def read_response(conn):
+    data = b""
+    while b"\r\n\r\n" not in data:
+        data += conn.recv(4096)
+    head, _, body = data.partition(b"\r\n\r\n")
+    length = next(
+        int(line.split(b":")[1]) for line in head.split(b"\r\n") if line.lower().startswith(b"content-length")
+    )
+    while len(body) < length:
+        body += conn.recv(4096)
+
+
+def closed_by_server(conn):
+    readable, _, _ = select.select([conn], [], [], 0)
+    return bool(readable)
+
+
+def run_client(port, requests, pause):
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    conn, session = None, None
+    latencies, handshakes = [], []
+    connections = resumed = 0
+    request = b"GET / HTTP/1.1\r\nHost: localhost\r\nConnection: keep-alive\r\n\r\n"
+
+    for i in range(requests):
+        if i:
+            time.sleep(pause)
+        start = time.perf_counter()
+        if conn is not None and closed_by_server(conn):
+            conn.close()
+            conn = None
+        if conn is None:
+            raw = socket.create_connection(("127.0.0.1", port))
+            conn = context.wrap_socket(raw, server_hostname="localhost", session=session)
+            handshakes.append(time.perf_counter() - start)
+            connections += 1
+            resumed += conn.session_reused
+        conn.sendall(request)
+        read_response(conn)
+        latencies.append(time.perf_counter() - start)
+        # TLS 1.3 tickets arrive after the handshake; keep the newest
+        session = conn.session
+    conn.close()
+    return {
+        "connections": connections,
+        "full": connections - resumed,
+        "resumed": resumed,
+        "handshake_ms": statistics.fmean(handshakes) * 1000,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    pause = float(sys.argv[2]) if len(sys.argv) > 2 else 1.5
+    print(f"{requests} requests, {pause} s apart\n")
+    print("| Server | Connections | Full handshakes | Resumed | Handshake ms | p50 request ms | Max request ms |")
+    print("| --- | --- | --- | --- | --- | --- | --- |")
+    with tempfile.TemporaryDirectory() as tmp:
+        certfile, keyfile = write_certificate(tmp)
+        for label, keep_alive, tickets in CONFIGS:
+            port = free_port()
+            server = start_server(port, certfile, keyfile, keep_alive, tickets)
+            try:
+                result = run_client(port, requests, pause)
+            finally:
+                server.terminate()
+                server.wait()
+            print(
+                f"| {label} | {result['connections']} | {result['full']} | {result['resumed']} | "
+                f"{result['handshake_ms']:.2f} | {result['p50_ms']:.2f} | {result['max_ms']:.2f} |"
+            )
+
+
+if __name__ == "__main__":
+    main()
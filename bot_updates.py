@@ -0,0 +1,71 @@
+import asyncio
+import hashlib
+import logging
+from typing import Any, Dict, Optional, Set
+
+WEBHOOK_PATH = "/telegram/webhook"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+logger = logging.getLogger(__name__)
+
+
+def webhook_secret(bot_token: str) -> str:
+    """Stable secret token derived from the bot token, identical in every worker."""
+    return hashlib.sha256(f"webhook:{bot_token}".encode()).hexdigest()
+
+
+def echo_text(user_id: Any) -> str:
+    return f"Your Telegram ID is: {user_id}"
+
+
+async def handle_update(sender, update: Dict[str, Any], registry=None) -> None:
+    """Async counterpart of the polling bot's echo_id handler."""
+    message = update.get("message")
+    if not message or "from" not in message:
+        return
+    if registry is not None:
+        registry.record(message["chat"]["id"])
+    await sender.call(
+        "sendMessage",
+        chat_id=message["chat"]["id"],
+        text=echo_text(message["from"]["id"]),
+        reply_to_message_id=message["message_id"],
+    )
+
+
+async def register_webhook(sender, url: str, secret: str, certificate: Optional[str] = None) -> None:
+    params = {"url": url, "secret_token": secret, "allowed_updates": ["message"]}
+    if certificate:
+        with open(certificate, "rb") as f:
+            files = {"certificate": ("certificate.pem", f.read())}
+        await sender.call("setWebhook", files=files, **params)
+    else:
+        await sender.call("setWebhook", **params)
+
+
+async def unregister_webhook(sender) -> None:
+    await sender.call("deleteWebhook")
+
+
+class UpdateDispatcher:
+    """Runs webhook updates as background tasks so Telegram gets its 200 right away."""
+
+    def __init__(self, sender, registry=None):
+        self.sender = sender
+        self.registry = registry
+        self._tasks: Set[asyncio.Task] = set()
+
+    def dispatch(self, update: Dict[str, Any]) -> None:
+        task = asyncio.create_task(self._handle(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, update: Dict[str, Any]) -> None:
+        try:
+            await handle_update(self.sender, update, self.registry)
+        except Exception as e:
+            logger.warning("Failed to handle update", extra={"update_id": update.get("update_id"), "error": str(e)})
+
+    async def drain(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,120 @@
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, List
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Buckets of the rolling window; older calls leave the window a bucket at a time
+_WINDOW_BUCKETS = 10
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Telegram while the circuit is open."""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__("Telegram is unavailable (circuit open)")
+
+
+class CircuitBreaker:
+    """Stops calling Telegram while it is failing and lets a few probes find out when it is back.
+
+    Closed: calls go through; once ``min_calls`` calls in the last ``window``
+    seconds include ``failure_rate`` or more failures (5xx, timeouts,
+    connection errors), the circuit opens. Open: calls fail at once with
+    CircuitOpenError for ``open_seconds``. Half-open: up to ``probes`` calls
+    go through; a successful one closes the circuit, a failed one opens it
+    again. Answers like 400 or 429 mean Telegram is up and count as successes.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        min_calls: int = 10,
+        window: float = 30.0,
+        open_seconds: float = 15.0,
+        probes: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.clock = clock
+        self._opened_at = None
+        self._probing = 0
+        # [bucket start, calls, failures]
+        self._buckets: Deque[List[float]] = deque()
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return CLOSED
+        if self.clock() - self._opened_at < self.open_seconds:
+            return OPEN
+        return HALF_OPEN
+
+    def retry_after(self) -> float:
+        """Seconds until the circuit lets probes through; 0 unless open."""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self._opened_at + self.open_seconds - self.clock())
+
+    def acquire(self) -> bool:
+        """Ask to make a call; returns whether it is a probe. Raises CircuitOpenError."""
+        state = self.state
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and self._probing < self.probes:
+            self._probing += 1
+            return True
+        self.rejected += 1
+        # While probes are out, their answer is usually only a request away
+        raise CircuitOpenError(self.retry_after() or 1.0)
+
+    def record(self, ok, probe: bool = False) -> None:
+        """Report how an acquired call went: True, False, or None if it never finished."""
+        if probe:
+            self._probing -= 1
+        if ok is None:
+            return
+        if self._opened_at is not None:
+            # Calls started before the circuit opened don't decide anything
+            if probe and ok:
+                self._close()
+            elif probe:
+                self._open()
+            return
+
+        now = self.clock()
+        if not self._buckets or now - self._buckets[-1][0] >= self.window / _WINDOW_BUCKETS:
+            self._buckets.append([now, 0, 0])
+        bucket = self._buckets[-1]
+        bucket[1] += 1
+        if not ok:
+            bucket[2] += 1
+        while now - self._buckets[0][0] >= self.window:
+            self._buckets.popleft()
+
+        if not ok:
+            calls = sum(b[1] for b in self._buckets)
+            failures = sum(b[2] for b in self._buckets)
+            if calls >= self.min_calls and failures >= self.failure_rate * calls:
+                self._open()
+
+    def _open(self) -> None:
+        if self._opened_at is None:
+            logger.warning("Telegram circuit opened", extra={"open_seconds": self.open_seconds})
+        self._opened_at = self.clock()
+        self._buckets.clear()
+
+    def _close(self) -> None:
+        logger.info("Telegram circuit closed")
+        self._opened_at = None
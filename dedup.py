@@ -0,0 +1,51 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+
+def entry_fingerprint(entry: Dict[str, Any], user_ids: List[str]) -> str:
+    """Stable identity of an entry: a hash of its content (sms/call, from, to) with
+    its client ``id`` if given, else with its ids, so resends and second forwarding
+    devices match. Client ids are phone-local (often a row number), so the same
+    ``id`` with other content is another entry."""
+    content = [entry.get("sms") or "", bool(entry.get("call")), entry.get("from") or "", entry.get("to") or ""]
+    if entry.get("id") not in (None, ""):
+        basis = ["id", str(entry["id"]), *content]
+    else:
+        basis = [sorted(set(user_ids)), *content]
+    encoded = json.dumps(basis, ensure_ascii=False, separators=(",", ":")).encode()
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+class DedupIndex:
+    """Time-bounded record of (entry, recipient) pairs already delivered.
+
+    A send first claims its key for ``claim_ttl`` seconds so concurrent copies of
+    the same entry don't both go out; a delivered send keeps it for ``window``.
+    Entries without a client ``id`` are only matched by content if ``by_content``.
+    """
+
+    def __init__(self, backend, window: float = 600.0, claim_ttl: float = 60.0, by_content: bool = True):
+        self.backend = backend
+        self.window = window
+        self.claim_ttl = claim_ttl
+        self.by_content = by_content
+
+    def fingerprint(self, entry: Dict[str, Any], user_ids: List[str]) -> Optional[str]:
+        if not self.by_content and entry.get("id") in (None, ""):
+            return None
+        return entry_fingerprint(entry, user_ids)
+
+    @staticmethod
+    def _key(fingerprint: str, user_id: str) -> str:
+        return f"dedup:{fingerprint}:{user_id}"
+
+    async def claim(self, fingerprint: str, user_id: str) -> bool:
+        """False if this entry was already delivered (or is being sent) to ``user_id``."""
+        return await self.backend.add(self._key(fingerprint, user_id), self.claim_ttl)
+
+    async def confirm(self, fingerprint: str, user_id: str) -> None:
+        await self.backend.set(self._key(fingerprint, user_id), self.window)
+
+    async def release(self, fingerprint: str, user_id: str) -> None:
+        await self.backend.discard(self._key(fingerprint, user_id))
@@ -0,0 +1,371 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncContextManager, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+from batch_plan import Origin, PlannedSend, plan_batch
+from lanes import lane_priority
+from recipients import is_recipient_error, parse_ids
+from telegram_sender import TelegramAPIError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DeliveryReport:
+    """Per-index/per-user outcome of one /receive_data batch."""
+
+    successful: List[Dict[str, Any]] = field(default_factory=list)
+    failed: List[Dict[str, Any]] = field(default_factory=list)
+    duplicate: List[Dict[str, Any]] = field(default_factory=list)
+    telegram_available: bool = False
+
+
+@dataclass
+class RejectedEntry:
+    """Placeholder for an entry that failed before validation (e.g. decryption)."""
+
+    error: str
+    # Seconds after which resending the entry may succeed (e.g. the server was busy)
+    retry_after: Optional[float] = None
+
+
+# Held around a send; yields None, or the RejectedEntry the send fails with instead
+Admit = Callable[[], AsyncContextManager[Optional[RejectedEntry]]]
+
+
+def validate_entry(idx: int, message_data: Any) -> Tuple[List[str], Optional[Dict[str, Any]]]:
+    """Return the entry's user IDs, or a failure record if it can't be sent."""
+    if isinstance(message_data, RejectedEntry):
+        if message_data.retry_after is not None:
+            return [], {"index": idx, "error": message_data.error, "retry_after": message_data.retry_after}
+        return [], {"index": idx, "error": message_data.error}
+
+    if not isinstance(message_data, dict):
+        return [], {"index": idx, "error": "Invalid message format: expected object"}
+
+    # Extract user IDs from the "ids" field
+    ids_str = message_data.get("ids", "")
+    if not ids_str:
+        return [], {"index": idx, "error": "Missing 'ids' field"}
+
+    if not isinstance(ids_str, str):
+        return [], {"index": idx, "error": "Invalid 'ids' field: expected a string"}
+    user_ids = list(parse_ids(ids_str))
+    if not user_ids:
+        return [], {"index": idx, "error": "No valid user IDs found"}
+
+    # Check that at least SMS or Call is present
+    if not message_data.get("sms") and not message_data.get("call"):
+        return [], {"index": idx, "error": "Either 'sms' or 'call' field is required"}
+
+    return user_ids, None
+
+
+class DeliveryEngine:
+    """Fans a batch out to Telegram concurrently.
+
+    ``sender`` is normally a DeliveryScheduler, which caps concurrency and
+    applies rate limits and retries process-wide. With a DedupIndex, sends
+    already delivered within its window are skipped and reported as duplicate.
+    With ``merge``, short messages for the same chat are joined into one.
+    With a RecipientRegistry, chats Telegram recently refused fail without a
+    request. With an AuditLog, every send and skipped duplicate is recorded.
+    With ``lanes``, ``formatter`` returns (text, lane) in one call, the lane
+    (lanes.LANES) being passed on to the sender so urgent messages go first;
+    a merged message takes the most urgent lane of its parts. With LiveMessages, a message whose entries
+    share a ``source`` number edits that source's live message in the chat
+    instead of sending a new one.
+    """
+
+    def __init__(
+        self,
+        sender,
+        formatter: Callable[[Dict[str, Any]], Any],
+        parse_mode: str = "MarkdownV2",
+        dedup=None,
+        merge: bool = False,
+        registry=None,
+        audit=None,
+        lanes: bool = False,
+        live=None,
+        source: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None,
+    ):
+        self.sender = sender
+        self.formatter = formatter
+        self.parse_mode = parse_mode
+        self.dedup = dedup
+        self.merge = merge
+        self.registry = registry
+        self.audit = audit
+        self.lanes = lanes
+        self.live = live
+        self.source = source
+
+    def format(self, message_data: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        """(text, lane) of a valid entry; the lane is None without ``lanes``."""
+        if self.lanes:
+            return self.formatter(message_data)
+        return self.formatter(message_data), None
+
+    async def send(
+        self, user_id: str, text: str, lane: Optional[str] = None, source: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Send one formatted message, or add it to the live message of ``source`` in this chat."""
+        if self.live is None or not source or not self.live.enabled(user_id):
+            return await self._request(user_id, text, lane)
+        key = (user_id, source)
+        async with self.live.hold(key):
+            message = self.live.get(key)
+            edited = self.live.compose(message, text) if message else None
+            if edited is not None:
+                try:
+                    result = await self._request(user_id, edited, lane, message.message_id)
+                except TelegramAPIError as e:
+                    if "message is not modified" in e.description:
+                        return {"message_id": message.message_id}
+                    if e.error_code != 400 or is_recipient_error(e):
+                        raise
+                    # Deleted by the user or no longer editable: send a new one
+                    self.live.forget(key)
+                else:
+                    message.text = edited
+                    self.live.edits += 1
+                    return result
+            result = await self._request(user_id, text, lane)
+            if isinstance(result, dict) and result.get("message_id"):
+                self.live.remember(key, result["message_id"], text)
+            return result
+
+    async def _request(
+        self, user_id: str, text: str, lane: Optional[str], message_id: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """sendMessage, or editMessageText of ``message_id``."""
+        # Senders without lanes (e.g. a bare TelegramSender) don't take the argument
+        options = {"lane": lane} if lane else {}
+        if self.registry is not None:
+            self.registry.check(user_id)
+        try:
+            if message_id is None:
+                return await self.sender.send_message(user_id, text, parse_mode=self.parse_mode, **options)
+            return await self.sender.edit_message_text(
+                user_id, message_id, text, parse_mode=self.parse_mode, **options
+            )
+        except TelegramAPIError as e:
+            if self.registry is not None and is_recipient_error(e):
+                self.registry.refuse(user_id, e)
+            raise
+
+    async def _claim(self, planned: PlannedSend) -> Tuple[List[Origin], List[Origin], List[str]]:
+        """Split origins into (to send, duplicate); returns the fingerprints claimed."""
+        if not self.dedup:
+            return planned.origins, [], []
+        claimed, refused = [], set()
+        for fingerprint in dict.fromkeys(o.fingerprint for o in planned.origins if o.fingerprint):
+            if await self.dedup.claim(fingerprint, planned.chat_id):
+                claimed.append(fingerprint)
+            else:
+                refused.add(fingerprint)
+        live = [o for o in planned.origins if o.fingerprint not in refused]
+        duplicate = [o for o in planned.origins if o.fingerprint in refused]
+        return live, duplicate, claimed
+
+    async def _send(
+        self, planned: PlannedSend, leader: Optional["asyncio.Task"] = None
+    ) -> List[Tuple[Origin, str, Dict[str, Any]]]:
+        """Send ``planned`` once for all its origins.
+
+        ``leader`` is an earlier send of the same chat and text in this batch;
+        its outcome is reused instead of sending again.
+        """
+        outcome = None
+        if leader is not None:
+            outcome = next(
+                ((status, record) for _, status, record in await leader if status != "duplicate"), None
+            )
+        live, duplicate, claimed = await self._claim(planned)
+        results = [(o, "duplicate", {"index": o.index, "user_id": o.user_id}) for o in duplicate]
+        if duplicate and self.audit:
+            self.audit.record(planned.chat_id, "duplicate", planned.text_of(duplicate))
+        if not live:
+            return results
+        # A merged message carries only the entries that weren't duplicates
+        text = planned.text_of(live) if duplicate else planned.text
+
+        error: Dict[str, Any] = {}
+        if outcome is None:
+            started = time.perf_counter()
+            try:
+                result = await self.send(planned.chat_id, text, planned.lane, planned.source)
+            except Exception as e:
+                logger.warning("Failed to send message", extra={"chat_id": planned.chat_id, "error": str(e)})
+                error["error"] = str(e)
+                if isinstance(e, TelegramAPIError) and e.retry_after is not None:
+                    error["retry_after"] = e.retry_after
+                if self.audit:
+                    self.audit.record(
+                        planned.chat_id, "failed", text, time.perf_counter() - started,
+                        error_code=e.error_code if isinstance(e, TelegramAPIError) else 0,
+                    )
+            else:
+                if self.audit:
+                    self.audit.record(
+                        planned.chat_id, "sent", text, time.perf_counter() - started,
+                        message_id=result.get("message_id", 0) if isinstance(result, dict) else 0,
+                    )
+        elif outcome[0] == "failed":
+            error = {k: v for k, v in outcome[1].items() if k in ("error", "retry_after")}
+
+        if error:
+            for fingerprint in claimed:
+                await self.dedup.release(fingerprint, planned.chat_id)
+            results.extend((o, "failed", {"index": o.index, "user_id": o.user_id, **error}) for o in live)
+            return results
+        for fingerprint in claimed:
+            await self.dedup.confirm(fingerprint, planned.chat_id)
+        results.extend((o, "sent", {"index": o.index, "user_id": o.user_id}) for o in live)
+        return results
+
+    async def _admitted(self, planned: PlannedSend, admit: Optional[Admit]) -> List[Tuple[Origin, str, Dict[str, Any]]]:
+        if admit is None:
+            return await self._send(planned)
+        async with admit() as rejected:
+            if rejected is None:
+                return await self._send(planned)
+        error = {"error": rejected.error, "retry_after": rejected.retry_after}
+        return [(o, "failed", {"index": o.index, "user_id": o.user_id, **error}) for o in planned.origins]
+
+    def plan(self, body: List[Any]) -> Tuple[List[PlannedSend], List[Dict[str, Any]]]:
+        """Validate and format ``body``; returns (sends to make, per-index failures)."""
+        entries, failed, lanes, sources = [], [], {}, {}
+        for idx, message_data in enumerate(body):
+            user_ids, error = validate_entry(idx, message_data)
+            if error:
+                failed.append(error)
+                continue
+            fingerprint = self.dedup.fingerprint(message_data, user_ids) if self.dedup else None
+            text, lanes[idx] = self.format(message_data)
+            entries.append((idx, user_ids, text, fingerprint))
+            if self.source:
+                sources[idx] = self.source(message_data)
+        sends = plan_batch(entries, merge=self.merge)
+        for planned in sends:
+            if self.lanes:
+                planned.lane = min((lanes[o.index] for o in planned.origins), key=lane_priority)
+            if self.source:
+                shared = {sources[o.index] for o in planned.origins}
+                planned.source = shared.pop() if len(shared) == 1 else None
+        return sends, failed
+
+    @staticmethod
+    def _report(outcomes: Iterable[Tuple[Optional[Origin], str, Dict[str, Any]]]) -> DeliveryReport:
+        # Validation failures (no origin) sort before the sends of their entry
+        slots = sorted(
+            outcomes, key=lambda outcome: (outcome[2]["index"], outcome[0].slot if outcome[0] else -1)
+        )
+        report = DeliveryReport()
+        for _, status, record in slots:
+            if status == "sent":
+                report.telegram_available = True
+                report.successful.append(record)
+            elif status == "duplicate":
+                report.duplicate.append(record)
+            else:
+                report.failed.append(record)
+        return report
+
+    async def deliver(self, body: List[Any], admit: Optional[Admit] = None) -> DeliveryReport:
+        """Send every entry of ``body``; results keep the batch's index order.
+
+        Each distinct (chat, text) is sent once and its outcome reported for
+        every entry and recipient that asked for it. ``admit()`` is held
+        around each send; a send it yields a RejectedEntry for fails with
+        that error instead.
+        """
+        sends, failed = self.plan(body)
+        outcomes = await asyncio.gather(*(self._admitted(planned, admit) for planned in sends))
+        return self._report(
+            [outcome for results in outcomes for outcome in results]
+            + [(None, "failed", record) for record in failed]
+        )
+
+    async def outcomes(
+        self, entries: AsyncIterable[Any]
+    ) -> AsyncIterator[Tuple[Optional[Origin], str, Dict[str, Any]]]:
+        """Yield (origin, status, record) per (index, user_id) as each send completes.
+
+        Entries are validated and sent as soon as ``entries`` produces them;
+        a later entry with the same chat and text as an earlier one waits for
+        that send instead of making its own. Merging (``merge``) needs the
+        whole batch and is not applied here.
+        """
+        finished: "asyncio.Queue[Any]" = asyncio.Queue()
+        leaders: Dict[Tuple[str, str], asyncio.Task] = {}
+        tasks = set()
+
+        async def dispatch() -> None:
+            slot = 0
+            idx = 0
+            try:
+                async for message_data in entries:
+                    user_ids, error = validate_entry(idx, message_data)
+                    if error:
+                        finished.put_nowait([(None, "failed", error)])
+                    else:
+                        fingerprint = self.dedup.fingerprint(message_data, user_ids) if self.dedup else None
+                        text, lane = self.format(message_data)
+                        source = self.source(message_data) if self.source else None
+                        for planned in plan_batch([(idx, user_ids, text, fingerprint)], first_slot=slot):
+                            planned.lane = lane
+                            planned.source = source
+                            key = (planned.chat_id, planned.text)
+                            task = asyncio.create_task(self._send(planned, leaders.get(key)))
+                            leaders.setdefault(key, task)
+                            tasks.add(task)
+                            task.add_done_callback(finished.put_nowait)
+                        slot += len(user_ids)
+                    idx += 1
+            finally:
+                finished.put_nowait(None)
+
+        producer = asyncio.create_task(dispatch())
+        producing = True
+        try:
+            while producing or tasks:
+                item = await finished.get()
+                if item is None:
+                    producing = False
+                    continue
+                if isinstance(item, asyncio.Task):
+                    tasks.discard(item)
+                    item = item.result()
+                for outcome in item:
+                    yield outcome
+            await producer
+        finally:
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+
+    async def deliver_stream(
+        self,
+        entries: AsyncIterable[Any],
+        finished: Optional[Callable[[int, bool], None]] = None,
+        admit: Optional[Admit] = None,
+    ) -> DeliveryReport:
+        """Like deliver(), but starts sending each entry as soon as it arrives.
+
+        ``finished(index, whole)`` is called per outcome as it is known:
+        once per (index, user_id), or once with ``whole`` for an entry that
+        failed validation. With ``merge`` the batch is sent whole, through
+        deliver() with ``admit``, and ``finished`` isn't called.
+        """
+        if self.merge:
+            return await self.deliver([entry async for entry in entries], admit)
+        outcomes = []
+        async for outcome in self.outcomes(entries):
+            outcomes.append(outcome)
+            if finished:
+                finished(outcome[2]["index"], outcome[0] is None)
+        return self._report(outcomes)
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from batch_plan import normalize_chat_id
+from circuit_breaker import CircuitOpenError
+from delivery import DeliveryEngine, validate_entry
+from lanes import LANES
+from telegram_sender import TelegramAPIError
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT NOT NULL,
+    entry_index INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    next_attempt_at REAL NOT NULL,
+    lease_until REAL,
+    lane TEXT,
+    fingerprint TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deliveries_pending ON deliveries (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS deliveries_message ON deliveries (message_id);
+"""
+
+# Claim order: most urgent lane first (rows without one count as the most urgent), then oldest
+LANE_ORDER = "CASE lane " + " ".join(f"WHEN '{lane}' THEN {n}" for n, lane in enumerate(LANES)) + " ELSE 0 END"
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Throttling, Telegram-side and network errors are worth another attempt."""
+    if isinstance(exc, TelegramAPIError):
+        return exc.error_code == 429 or exc.error_code >= 500
+    return True
+
+
+class DeliveryQueue:
+    """Durable SQLite (WAL) store of pending Telegram sends, one row per (message, user).
+
+    Several worker processes may share one file. A claimed row is leased for
+    ``lease`` seconds; if its worker dies mid-send, the row becomes claimable
+    again once the lease runs out.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 5, retry_delay: float = 5.0, lease: float = 120.0):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(deliveries)")}
+        if "lease_until" not in columns:
+            self._conn.execute("ALTER TABLE deliveries ADD COLUMN lease_until REAL")
+        if "lane" not in columns:
+            self._conn.execute("ALTER TABLE deliveries ADD COLUMN lane TEXT")
+        if "fingerprint" not in columns:
+            self._conn.execute("ALTER TABLE deliveries ADD COLUMN fingerprint TEXT")
+
+    def enqueue(self, messages: List[Tuple[Any, ...]]) -> None:
+        """Store ``(message_id, entry_index, user_ids, text[, lane[, fingerprint]])`` in one transaction.
+
+        ``fingerprint`` is the entry's DedupIndex fingerprint, handed back by
+        mark_delivered() and mark_failed() once the row is settled.
+        """
+        now = time.time()
+        rows = []
+        for message_id, idx, user_ids, text, *rest in messages:
+            lane, fingerprint = (*rest, None, None)[:2]
+            rows.extend(
+                (message_id, idx, user_id, text, lane, fingerprint, now, now, now) for user_id in user_ids
+            )
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO deliveries (message_id, entry_index, user_id, text, lane, fingerprint, "
+                "next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def claim(self) -> Optional[Tuple[int, str, str, int, Optional[str]]]:
+        """Lease the most urgent due row and return ``(seq, user_id, text, attempts, lane)``."""
+        now = time.time()
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE deliveries SET status = 'sending', attempts = attempts + 1, "
+                "lease_until = ?, updated_at = ? "
+                "WHERE seq = (SELECT seq FROM deliveries WHERE "
+                "(status = 'pending' AND next_attempt_at <= ?) OR "
+                "(status = 'sending' AND COALESCE(lease_until, 0) <= ?) "
+                f"ORDER BY {LANE_ORDER}, seq LIMIT 1) "
+                "RETURNING seq, user_id, text, attempts, lane",
+                (now + self.lease, now, now, now),
+            ).fetchone()
+
+    def mark_delivered(self, seq: int) -> Optional[str]:
+        """Settle the row as delivered; returns its fingerprint."""
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE deliveries SET status = 'delivered', error = NULL, updated_at = ? WHERE seq = ? "
+                "RETURNING fingerprint",
+                (time.time(), seq),
+            ).fetchone()
+        return row[0] if row else None
+
+    def mark_failed(self, seq: int, error: str, attempts: int, retry: bool) -> Optional[str]:
+        """Schedule another attempt, or settle the row as failed and return its fingerprint."""
+        now = time.time()
+        if retry and attempts < self.max_attempts:
+            status, next_attempt_at = "pending", now + self.retry_delay * 2 ** (attempts - 1)
+        else:
+            status, next_attempt_at = "failed", now
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE deliveries SET status = ?, error = ?, next_attempt_at = ?, updated_at = ? "
+                "WHERE seq = ? RETURNING fingerprint",
+                (status, error, next_attempt_at, now, seq),
+            ).fetchone()
+        return row[0] if row and status == "failed" else None
+
+    def release(self, seq: int, delay: float) -> None:
+        """Put a claimed row back for ``delay`` seconds without using up an attempt."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE deliveries SET status = 'pending', attempts = attempts - 1, "
+                "next_attempt_at = ?, updated_at = ? WHERE seq = ?",
+                (now + delay, now, seq),
+            )
+
+    def status(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Delivery state of every recipient of ``message_id``, or None if unknown."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, status, attempts, error FROM deliveries "
+                "WHERE message_id = ? ORDER BY seq",
+                (message_id,),
+            ).fetchall()
+        if not rows:
+            return None
+
+        states = {row[1] for row in rows}
+        if states <= {"delivered"}:
+            overall = "delivered"
+        elif states <= {"failed"}:
+            overall = "failed"
+        elif states & {"pending", "sending"}:
+            overall = "pending"
+        else:
+            overall = "partial"
+        return {
+            "id": message_id,
+            "status": overall,
+            "deliveries": [
+                {"user_id": user_id, "status": state, "attempts": attempts, "error": error}
+                for user_id, state, attempts, error in rows
+            ],
+        }
+
+    def depth(self) -> int:
+        """Number of sends still waiting for delivery."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM deliveries WHERE status IN ('pending', 'sending')"
+            ).fetchone()[0]
+
+    def purge(self, older_than: float) -> int:
+        """Drop finished rows last updated before ``older_than`` (unix time)."""
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM deliveries WHERE status IN ('delivered', 'failed') AND updated_at < ?",
+                (older_than,),
+            ).rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class QueueWorkers:
+    """Background tasks that drain a DeliveryQueue through a DeliveryEngine."""
+
+    def __init__(
+        self,
+        queue: DeliveryQueue,
+        engine: DeliveryEngine,
+        workers: int = 4,
+        poll_interval: float = 1.0,
+        retention: float = 86400.0,
+        breaker=None,
+    ):
+        self.queue = queue
+        self.engine = engine
+        # While this CircuitBreaker is open the workers wait instead of claiming rows
+        self.breaker = breaker
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def submit(
+        self, body: List[Any]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Validate and persist a batch; returns (accepted, failed, duplicate) per-index records.
+
+        Recipients the engine's DedupIndex has already seen for an entry are
+        left out of the queue; an entry with no recipients left gets no id.
+        The others hold a claim until their row is settled: delivered keeps
+        the key for the dedup window, failed gives it up so a resend goes out.
+        """
+        accepted, failed, duplicate, messages = [], [], [], []
+        dedup = self.engine.dedup
+        for idx, message_data in enumerate(body):
+            user_ids, error = validate_entry(idx, message_data)
+            if error:
+                failed.append(error)
+                continue
+            text, lane = self.engine.format(message_data)
+            fingerprint = dedup.fingerprint(message_data, user_ids) if dedup else None
+            if fingerprint:
+                fresh = []
+                for user_id in user_ids:
+                    chat_id = normalize_chat_id(user_id)
+                    if user_id in fresh or await dedup.claim(fingerprint, chat_id):
+                        fresh.append(user_id)
+                    else:
+                        duplicate.append({"index": idx, "user_id": user_id})
+                        if self.engine.audit:
+                            self.engine.audit.record(chat_id, "duplicate", text)
+                user_ids = fresh
+                if not user_ids:
+                    continue
+            message_id = uuid.uuid4().hex
+            messages.append((message_id, idx, user_ids, text, lane, fingerprint))
+            accepted.append({"index": idx, "id": message_id})
+
+        if messages:
+            await asyncio.to_thread(self.queue.enqueue, messages)
+            self._wakeup.set()
+        return accepted, failed, duplicate
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self) -> None:
+        while True:
+            if self.breaker and self.breaker.retry_after() > 0:
+                await asyncio.sleep(self.breaker.retry_after())
+                continue
+            job = await asyncio.to_thread(self.queue.claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            seq, user_id, text, attempts, lane = job
+            audit = self.engine.audit
+            started = time.perf_counter()
+            try:
+                result = await self.engine.send(user_id, text, lane)
+            except CircuitOpenError as e:
+                # Not this row's fault: try it again once the circuit lets sends through
+                await asyncio.to_thread(self.queue.release, seq, e.retry_after)
+            except Exception as e:
+                logger.warning("Failed to send queued message", extra={"chat_id": user_id, "error": str(e)})
+                if audit:
+                    audit.record(
+                        user_id, "failed", text, time.perf_counter() - started,
+                        error_code=e.error_code if isinstance(e, TelegramAPIError) else 0,
+                    )
+                fingerprint = await asyncio.to_thread(
+                    self.queue.mark_failed, seq, str(e), attempts, is_retryable(e)
+                )
+                if fingerprint and self.engine.dedup:
+                    # Given up: a resend of the entry has to go out again
+                    await self.engine.dedup.release(fingerprint, normalize_chat_id(user_id))
+            else:
+                if audit:
+                    audit.record(
+                        user_id, "sent", text, time.perf_counter() - started,
+                        message_id=result.get("message_id", 0) if isinstance(result, dict) else 0,
+                    )
+                fingerprint = await asyncio.to_thread(self.queue.mark_delivered, seq)
+                if fingerprint and self.engine.dedup:
+                    await self.engine.dedup.confirm(fingerprint, normalize_chat_id(user_id))
+
+    async def _purge(self) -> None:
+        while True:
+            await asyncio.to_thread(self.queue.purge, time.time() - self.retention)
+            await asyncio.sleep(min(self.retention, 3600.0))
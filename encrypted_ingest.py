@@ -0,0 +1,114 @@
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any, AsyncIterable, AsyncIterator, List, Optional, Tuple
+
+from delivery import RejectedEntry
+
+if TYPE_CHECKING:
+    from aes256cipher import AES256Cipher
+
+# Set in each pool process by _init_worker
+_cipher: Optional["AES256Cipher"] = None
+
+
+def _init_worker(secret: str) -> None:
+    # Imported here: only the pool processes need cryptography, not the server's startup
+    from aes256cipher import AES256Cipher
+
+    global _cipher
+    _cipher = AES256Cipher(secret)
+
+
+def _decrypt_chunk(tokens: List[str]) -> List[Tuple[bool, str]]:
+    return [
+        (False, "Failed to decrypt message") if isinstance(result, Exception) else (True, result)
+        for result in _cipher.decrypt_many(tokens, return_exceptions=True)
+    ]
+
+
+def merge_plaintext(entry: dict, plaintext: str) -> dict:
+    """A decrypted JSON object overrides the envelope's fields; anything else is the SMS text."""
+    merged = {key: value for key, value in entry.items() if key != "encrypted"}
+    try:
+        payload = json.loads(plaintext)
+    except ValueError:
+        payload = None
+    if isinstance(payload, dict):
+        merged.update(payload)
+    else:
+        merged["sms"] = plaintext
+    return merged
+
+
+class Decryptor:
+    """Decrypts AES256Cipher payloads on a process pool so PBKDF2/GCM never runs on the event loop."""
+
+    def __init__(self, secret: str, workers: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        # spawn, not fork: the server process runs threads that fork() could deadlock
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(secret,),
+        )
+
+    async def decrypt_many(self, tokens: List[str]) -> List[Tuple[bool, str]]:
+        """Return ``(ok, plaintext_or_error)`` per token, split across every worker."""
+        if not tokens:
+            return []
+        loop = asyncio.get_running_loop()
+        size = -(-len(tokens) // self.workers)
+        chunks = [tokens[i:i + size] for i in range(0, len(tokens), size)]
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._pool, _decrypt_chunk, chunk) for chunk in chunks)
+        )
+        return [result for chunk in results for result in chunk]
+
+    async def decrypt_entries(self, body: List[Any]) -> List[Any]:
+        """Replace entries carrying an ``encrypted`` field with their decrypted form.
+
+        Entries that fail to decrypt become RejectedEntry so they are reported per index.
+        """
+        positions = [
+            idx for idx, entry in enumerate(body)
+            if isinstance(entry, dict) and isinstance(entry.get("encrypted"), str)
+        ]
+        results = await self.decrypt_many([body[idx]["encrypted"] for idx in positions])
+
+        body = list(body)
+        for idx, (ok, value) in zip(positions, results):
+            body[idx] = merge_plaintext(body[idx], value) if ok else RejectedEntry(value)
+        return body
+
+    async def decrypt_stream(self, entries: AsyncIterable[Any], batch_size: int = 64) -> AsyncIterator[Any]:
+        """decrypt_entries() for a batch that is still arriving.
+
+        Entries keep their order; encrypted ones are decrypted ``batch_size`` at
+        a time, plain ones pass straight through while nothing is pending.
+        """
+        pending: List[Any] = []
+        async for entry in entries:
+            if not pending and not (isinstance(entry, dict) and "encrypted" in entry):
+                yield entry
+                continue
+            pending.append(entry)
+            if len(pending) >= batch_size:
+                for decrypted in await self.decrypt_entries(pending):
+                    yield decrypted
+                pending = []
+        for decrypted in await self.decrypt_entries(pending):
+            yield decrypted
+
+    async def decrypt_body(self, token: str) -> Any:
+        """Decrypt a fully encrypted batch and parse it as JSON; raises ValueError on failure."""
+        ok, value = (await self.decrypt_many([token.strip()]))[0]
+        if not ok:
+            raise ValueError(value)
+        return json.loads(value)
+
+    def close(self) -> None:
+        self._pool.shutdown(cancel_futures=True)
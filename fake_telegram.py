@@ -0,0 +1,116 @@
+"""A stand-in Bot API server for load tests and local development.
+
+    uv run fake_telegram.py --port 8081 --latency 0.05 --error-rate 0.01 --flood-rate 0.01
+
+Point the service at it with TELEGRAM_API_URL=http://127.0.0.1:8081. Every
+method answers like Telegram would (sendMessage returns a message with an
+increasing message_id); ``latency``/``jitter`` delay each answer, and a share
+of calls fail with 5xx (``error_rate``) or 429 with ``retry_after``
+(``flood_rate``). Chat IDs that aren't numbers get 400 "chat not found".
+GET /stats reports the calls made so far, POST /stats/reset clears them.
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+@dataclass
+class FakeTelegramConfig:
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    flood_rate: float = 0.0
+    retry_after: int = 1
+    seed: Optional[int] = None
+
+
+def _error(code: int, description: str, **parameters: Any) -> JSONResponse:
+    content: Dict[str, Any] = {"ok": False, "error_code": code, "description": description}
+    if parameters:
+        content["parameters"] = parameters
+    return JSONResponse(status_code=code, content=content)
+
+
+def create_fake_telegram(config: Optional[FakeTelegramConfig] = None) -> FastAPI:
+    config = config or FakeTelegramConfig()
+    app = FastAPI()
+    app.state.config = config
+    app.state.calls = Counter()
+    # Last sent (chat_id, text) pairs, for tests
+    app.state.sent = deque(maxlen=10000)
+    rng = random.Random(config.seed)
+    message_ids = iter(range(1, 1 << 62))
+
+    @app.get("/stats")
+    async def stats():
+        return {"calls": sum(app.state.calls.values()), "by_outcome": dict(app.state.calls)}
+
+    @app.post("/stats/reset")
+    async def reset():
+        app.state.calls.clear()
+        app.state.sent.clear()
+        return {"ok": True}
+
+    @app.post("/bot{token}/{method}")
+    async def call(token: str, method: str, request: Request):
+        if config.latency or config.jitter:
+            await asyncio.sleep(max(0.0, config.latency + rng.uniform(-config.jitter, config.jitter)))
+
+        roll = rng.random()
+        if roll < config.error_rate:
+            app.state.calls[f"{method}:502"] += 1
+            return _error(502, "Bad Gateway")
+        if roll < config.error_rate + config.flood_rate:
+            app.state.calls[f"{method}:429"] += 1
+            return _error(
+                429, f"Too Many Requests: retry after {config.retry_after}", retry_after=config.retry_after
+            )
+
+        params = await request.json() if request.headers.get("content-type") == "application/json" else {}
+        if method == "getMe":
+            result: Any = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = str(params.get("chat_id", ""))
+            if not chat_id.lstrip("-").isdigit():
+                app.state.calls[f"{method}:400"] += 1
+                return _error(400, "Bad Request: chat not found")
+            message_id = params.get("message_id") or next(message_ids)
+            app.state.sent.append((chat_id, params.get("text")))
+            result = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"},
+                "text": params.get("text"),
+            }
+        else:
+            result = True
+        app.state.calls[f"{method}:200"] += 1
+        return {"ok": True, "result": result}
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of random extra latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered 502")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of calls answered 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after of the 429 answers")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    config = FakeTelegramConfig(
+        args.latency, args.jitter, args.error_rate, args.flood_rate, args.retry_after, args.seed
+    )
+    uvicorn.run(create_fake_telegram(config), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,193 @@
+import codecs
+import json
+import re
+import time
+from typing import Any, AsyncIterable, AsyncIterator, List, Optional
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Values that can't be cut short: anything else ("12" of "123") may continue in the next chunk
+_CLOSED = ("}", "]", '"')
+
+
+class StreamError(ValueError):
+    """The request body can't be (fully) read as a batch; ``status_code`` is the HTTP answer."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Body:
+    """Counts the bytes of a chunked body against ``max_bytes``."""
+
+    def __init__(self, chunks: AsyncIterable[bytes], max_bytes: Optional[int]):
+        self._chunks = chunks.__aiter__()
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    async def read(self) -> Optional[bytes]:
+        """Next non-empty chunk, or None at the end of the body."""
+        async for chunk in self._chunks:
+            if not chunk:
+                continue
+            self.size += len(chunk)
+            if self.max_bytes is not None and self.size > self.max_bytes:
+                raise StreamError(f"Request body too large (max {self.max_bytes} bytes)", 413)
+            return chunk
+        return None
+
+
+def _count(count: int, max_entries: Optional[int]) -> int:
+    count += 1
+    if max_entries is not None and count > max_entries:
+        raise StreamError(f"Too many entries in batch (max {max_entries})", 413)
+    return count
+
+
+async def iter_json_array(
+    chunks: AsyncIterable[bytes],
+    max_bytes: Optional[int] = None,
+    max_entries: Optional[int] = None,
+) -> AsyncIterator[Any]:
+    """Yield the elements of a JSON array body as soon as each one is complete.
+
+    Only the unparsed tail of the body is kept in memory. Raises StreamError
+    for a body that isn't an array, malformed JSON or a limit being exceeded.
+    """
+    body = _Body(chunks, max_bytes)
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf, pos = "", 0
+    eof = False
+    state = "start"  # start -> first -> (value -> separator)* -> end
+    count = 0
+
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+        value = end = None
+        if pos < len(buf):
+            char = buf[pos]
+            if state == "start":
+                if char != "[":
+                    raise StreamError(
+                        "Expected array of message objects" if char in '{"-0123456789' else "Invalid JSON format"
+                    )
+                pos, state = pos + 1, "first"
+                continue
+            if char == "]" and state in ("first", "separator"):
+                pos, state = pos + 1, "end"
+                continue
+            if state == "end" or (state == "separator" and char != ","):
+                raise StreamError("Invalid JSON format")
+            if state == "separator":
+                pos, state = pos + 1, "value"
+                continue
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise StreamError("Invalid JSON format")
+            if end is not None and (end < len(buf) or eof or buf[end - 1] in _CLOSED):
+                count = _count(count, max_entries)
+                pos, state = end, "separator"
+                yield value
+                continue
+        elif eof:
+            if state != "end":
+                raise StreamError("Invalid JSON format")
+            return
+
+        # Out of input, or the element so far is incomplete: read the next chunk
+        chunk = await body.read()
+        eof = chunk is None
+        try:
+            text = utf8.decode(chunk or b"", final=eof)
+        except UnicodeDecodeError:
+            raise StreamError("Invalid JSON format")
+        buf, pos = buf[pos:] + text, 0
+
+
+async def iter_ndjson(
+    chunks: AsyncIterable[bytes],
+    max_bytes: Optional[int] = None,
+    max_entries: Optional[int] = None,
+) -> AsyncIterator[Any]:
+    """Yield one value per non-empty line of a newline-delimited JSON body."""
+    body = _Body(chunks, max_bytes)
+    buf = b""
+    count = 0
+    while True:
+        chunk = await body.read()
+        if chunk is None:
+            lines, buf = [buf], b""
+        else:
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                value = json.loads(line)
+            except ValueError:
+                raise StreamError("Invalid JSON format")
+            count = _count(count, max_entries)
+            yield value
+        if chunk is None:
+            return
+
+
+async def read_body(chunks: AsyncIterable[bytes], max_bytes: Optional[int] = None) -> bytes:
+    """The whole body, still subject to ``max_bytes``."""
+    body = _Body(chunks, max_bytes)
+    parts = []
+    while (chunk := await body.read()) is not None:
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+class EntryStream:
+    """Entries of a request body, read lazily.
+
+    start() reads the first entry so a body that is malformed from the outset
+    raises StreamError before anything is sent. After that, an error ends the
+    iteration and is kept in ``error``; ``count`` is the number of entries read
+    and ``elapsed`` the seconds spent waiting for and parsing them.
+    """
+
+    def __init__(self, entries: AsyncIterable[Any]):
+        self._entries = entries.__aiter__()
+        self._head: List[Any] = []
+        self._exhausted = False
+        self.count = 0
+        self.elapsed = 0.0
+        self.error: Optional[StreamError] = None
+
+    async def _next(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return await self._entries.__anext__()
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    async def start(self) -> None:
+        try:
+            self._head.append(await self._next())
+        except StopAsyncIteration:
+            self._exhausted = True
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        while self._head:
+            self.count += 1
+            yield self._head.pop()
+        if self._exhausted:
+            return
+        while True:
+            try:
+                entry = await self._next()
+            except StopAsyncIteration:
+                return
+            except StreamError as e:
+                self.error = e
+                return
+            self.count += 1
+            yield entry
@@ -0,0 +1,89 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+
+# Highest priority first: SMS with a detected OTP code, other SMS, call notifications
+LANES = ("otp", "sms", "call")
+
+
+def lane_priority(lane: Optional[str]) -> int:
+    """0 for the most urgent lane; an unknown or missing lane counts as the most urgent."""
+    try:
+        return LANES.index(lane)
+    except ValueError:
+        return 0
+
+
+def parse_lane_limits(value: str) -> Dict[str, int]:
+    """``"sms=8,call=4"`` -> ``{"sms": 8, "call": 4}``. Raises ValueError for unknown lanes."""
+    limits = {}
+    for part in value.split(","):
+        if not part.strip():
+            continue
+        lane, _, limit = part.partition("=")
+        lane = lane.strip()
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane {lane!r}; lanes are {', '.join(LANES)}")
+        limits[lane] = int(limit)
+    return limits
+
+
+class PriorityGate:
+    """Concurrency limit whose free slots go to the most urgent waiting lane first.
+
+    Within a lane waiters are served in arrival order. ``lane_limits`` caps
+    the slots one lane may hold at once, so a flood of low-priority sends
+    can't take every connection when an OTP arrives.
+    """
+
+    def __init__(self, concurrency: int, lane_limits: Optional[Dict[str, int]] = None):
+        self.concurrency = concurrency
+        self.lane_limits = dict(lane_limits or {})
+        self.active: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self._used = 0
+
+    def waiting(self, lane: str) -> int:
+        return len(self._waiters[lane])
+
+    def _has_room(self, lane: str) -> bool:
+        return self._used < self.concurrency and self.active[lane] < self.lane_limits.get(lane, self.concurrency)
+
+    def _dispatch(self) -> None:
+        for lane in LANES:
+            waiters = self._waiters[lane]
+            while waiters and self._has_room(lane):
+                future = waiters.popleft()
+                if future.done():  # cancelled
+                    continue
+                self._used += 1
+                self.active[lane] += 1
+                future.set_result(None)
+
+    async def acquire(self, lane: str) -> None:
+        lane = LANES[lane_priority(lane)]
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(future)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled: hand the slot on
+                self.release(lane)
+            raise
+
+    def release(self, lane: str) -> None:
+        lane = LANES[lane_priority(lane)]
+        self._used -= 1
+        self.active[lane] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, lane: str) -> AsyncIterator[None]:
+        await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release(lane)
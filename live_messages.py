@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, Iterable, Optional, Tuple
+
+from batch_plan import MAX_MESSAGE_LENGTH, MERGE_SEPARATOR
+
+MODES = ("append", "replace")
+
+# (chat ID, source number)
+Key = Tuple[str, str]
+
+
+@dataclass
+class LiveMessage:
+    message_id: int
+    # time.monotonic() of the send that created the message
+    sent: float
+    text: str
+
+
+class LiveMessages:
+    """The last message per (chat, source number) that later sends edit instead of sending anew.
+
+    A message stays live for ``window`` seconds after it was sent; until then
+    a new text from the same source is appended to it (``mode="append"``,
+    while the result fits in ``limit`` characters) or replaces it
+    (``mode="replace"``). At most ``max_entries`` messages are remembered,
+    least recently used dropped first. ``chats`` limits the mode to those
+    chats; None applies it to all.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        mode: str = "append",
+        max_entries: int = 10000,
+        chats: Optional[Iterable[str]] = None,
+        limit: int = MAX_MESSAGE_LENGTH,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Unknown live message mode {mode!r}; modes are {', '.join(MODES)}")
+        self.window = window
+        self.mode = mode
+        self.max_entries = max_entries
+        self.chats = set(chats) if chats is not None else None
+        self.limit = limit
+        self.clock = clock
+        self.edits = 0
+        self._messages: "OrderedDict[Key, LiveMessage]" = OrderedDict()
+        # Lock and number of holders per key, dropped when the last one leaves
+        self._locks: Dict[Key, Tuple[asyncio.Lock, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def enabled(self, chat_id: str) -> bool:
+        return self.chats is None or chat_id in self.chats
+
+    @asynccontextmanager
+    async def hold(self, key: Key) -> AsyncIterator[None]:
+        """Serialize sends for ``key`` so two of them don't both send or edit the same message."""
+        lock, holders = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, holders + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, holders = self._locks[key]
+            if holders == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, holders - 1)
+
+    def get(self, key: Key) -> Optional[LiveMessage]:
+        message = self._messages.get(key)
+        if message is None:
+            return None
+        if self.clock() - message.sent >= self.window:
+            del self._messages[key]
+            return None
+        self._messages.move_to_end(key)
+        return message
+
+    def compose(self, message: LiveMessage, text: str) -> Optional[str]:
+        """The edited text of ``message`` with ``text`` added; None if it must be a new message."""
+        if self.mode == "replace":
+            return text
+        combined = message.text + MERGE_SEPARATOR + text
+        return combined if len(combined) <= self.limit else None
+
+    def remember(self, key: Key, message_id: int, text: str) -> None:
+        self._messages[key] = LiveMessage(message_id, self.clock(), text)
+        self._messages.move_to_end(key)
+        while len(self._messages) > self.max_entries:
+            self._messages.popitem(last=False)
+
+    def forget(self, key: Key) -> None:
+        self._messages.pop(key, None)
@@ -0,0 +1,244 @@
+"""Replay /receive_data batches at a fixed rate and report latency and Telegram calls.
+
+    uv run load_test.py --spawn --rps 20 --duration 30 --batch 5 --latency 0.02
+
+With --spawn, a fake Bot API (fake_telegram.py) and the service are started
+on free local ports; otherwise --url/--auth-key/--telegram-url name running
+ones. Requests go out on a fixed schedule whether or not earlier ones have
+finished, and latency is measured from the scheduled start, so a slow service
+can't hide its queueing. --markdown prints a table row for BENCHMARKS.md.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+SMS_TEMPLATES = [
+    "Your verification code is {code}. Do not share it with anyone.",
+    "{code} is your login code. It expires in 10 minutes.",
+    "Code: {half1}-{half2}",
+    "【拼多多】您正在登录拼多多，验证码是{code}。请于5分钟内完成验证，若非本人操作，请忽略本短信。",
+    "验证码是{code}，5分钟内有效。",
+    "Ваш код подтверждения: {code}. Никому его не сообщайте.",
+    "Hi! Your order #A-1932 ships today 🚚 Track it at https://example.com/t/abc_def?x=1",
+    "Balance: 1,024.50 USD. Card *4821 was charged 19.99 at COFFEE (ref {code}).",
+]
+
+
+def make_entry(rng: random.Random, chat_ids: List[str]) -> Dict[str, Any]:
+    """One realistic entry: mostly OTP SMS, some calls, 1-3 recipients."""
+    ids = ",".join(rng.sample(chat_ids, rng.choice((1, 1, 1, 2, 3))))
+    if rng.random() < 0.2:
+        return {"ids": ids, "call": True, "from": f"+86{rng.randrange(10**10, 10**11)}", "to": "SIM 1"}
+    code = f"{rng.randrange(10**5, 10**6)}"
+    text = rng.choice(SMS_TEMPLATES).format(code=code, half1=code[:3], half2=code[3:])
+    return {"ids": ids, "sms": text}
+
+
+def make_batch(rng: random.Random, size: int, chat_ids: List[str]) -> List[Dict[str, Any]]:
+    return [make_entry(rng, chat_ids) for _ in range(size)]
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_load(
+    url: str,
+    auth_key: str,
+    rps: float,
+    duration: float,
+    batch_size: int,
+    telegram_url: Optional[str] = None,
+    recipients: int = 50,
+    seed: int = 1,
+    timeout: float = 60.0,
+) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    chat_ids = [str(100000000 + i) for i in range(recipients)]
+    total = int(rps * duration)
+    batches = [make_batch(rng, batch_size, chat_ids) for _ in range(total)]
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=1000)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        if telegram_url:
+            await client.post(f"{telegram_url}/stats/reset")
+
+        async def fire(scheduled: float, batch: List[Dict[str, Any]]) -> None:
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            try:
+                response = await client.post(
+                    f"{url}/receive_data", headers={"X-Auth-Key": auth_key}, json=batch
+                )
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - scheduled)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(fire(start + i / rps, batch) for i, batch in enumerate(batches)))
+        elapsed = time.perf_counter() - start
+
+        telegram_calls = None
+        if telegram_url:
+            telegram_calls = (await client.get(f"{telegram_url}/stats")).json()
+
+    latencies.sort()
+    result = {
+        "requests": total,
+        "entries": total * batch_size,
+        "elapsed": round(elapsed, 2),
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else None,
+        "statuses": {str(k): v for k, v in sorted(statuses.items(), key=str)},
+    }
+    if telegram_calls is not None:
+        result["telegram_calls"] = telegram_calls["calls"]
+        result["telegram_calls_per_request"] = round(telegram_calls["calls"] / max(total, 1), 2)
+        result["telegram_outcomes"] = telegram_calls["by_outcome"]
+    return result
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start in {timeout}s")
+
+
+def spawn(args: argparse.Namespace) -> List[subprocess.Popen]:
+    """Start the fake Bot API and the service; fills in args.url/telegram_url/auth_key."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    telegram_port, service_port = _free_port(), _free_port()
+    fake = subprocess.Popen(
+        [
+            sys.executable, "fake_telegram.py", "--port", str(telegram_port),
+            "--latency", str(args.latency), "--jitter", str(args.jitter),
+            "--error-rate", str(args.error_rate), "--flood-rate", str(args.flood_rate),
+            "--retry-after", str(args.retry_after), "--seed", str(args.seed),
+        ],
+        cwd=here,
+    )
+    args.telegram_url = f"http://127.0.0.1:{telegram_port}"
+    args.auth_key = "load-test-key"
+    env = {
+        **os.environ,
+        "BOT_TOKEN": "123:LOADTEST",
+        "AUTH_KEY": args.auth_key,
+        "BOT_MODE": "off",
+        "TELEGRAM_API_URL": args.telegram_url,
+        "DEDUP_WINDOW": "0",
+        "LOG_LEVEL": "ERROR",
+        # Measure the service, not Telegram's published limits, unless asked to
+        "GLOBAL_RATE": "100000",
+        "CHAT_RATE": "100000",
+        "CHAT_BURST": "100000",
+    }
+    for setting in args.env:
+        key, _, value = setting.partition("=")
+        env[key] = value
+    service = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:create_app", "--factory",
+            "--port", str(service_port), "--log-level", "warning", "--no-access-log",
+        ],
+        cwd=here,
+        env=env,
+    )
+    args.url = f"http://127.0.0.1:{service_port}"
+    processes = [fake, service]
+    try:
+        _wait_ready(f"{args.telegram_url}/stats", fake)
+        _wait_ready(f"{args.url}/", service)
+    except Exception:
+        stop(processes)
+        raise
+    return processes
+
+
+def stop(processes: List[subprocess.Popen]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def markdown_row(args: argparse.Namespace, result: Dict[str, Any]) -> str:
+    faults = f"{args.latency * 1000:g} ms"
+    if args.error_rate or args.flood_rate:
+        faults += f", {args.error_rate:.0%} 5xx, {args.flood_rate:.0%} 429"
+    statuses = ", ".join(f"{k}: {v}" for k, v in result["statuses"].items())
+    return (
+        f"| {args.rps:g} | {args.batch} | {faults} | {result['throughput_rps']} | {result['p50_ms']} | "
+        f"{result['p95_ms']} | {result['p99_ms']} | {result.get('telegram_calls_per_request', '')} | {statuses} |"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:9374", help="service base URL")
+    parser.add_argument("--auth-key", default=os.getenv("AUTH_KEY"))
+    parser.add_argument("--telegram-url", help="fake Bot API base URL, for call counts")
+    parser.add_argument("--spawn", action="store_true", help="start the fake Bot API and the service")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE for the spawned service")
+    parser.add_argument("--rps", type=float, default=20)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--batch", type=int, default=5, help="entries per request")
+    parser.add_argument("--recipients", type=int, default=50, help="distinct chat IDs")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake Bot API latency (--spawn)")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--flood-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--markdown", action="store_true", help="print a BENCHMARKS.md table row")
+    args = parser.parse_args()
+
+    processes = spawn(args) if args.spawn else []
+    try:
+        result = asyncio.run(
+            run_load(
+                args.url, args.auth_key, args.rps, args.duration, args.batch,
+                args.telegram_url, args.recipients, args.seed,
+            )
+        )
+    finally:
+        stop(processes)
+    print(markdown_row(args, result) if args.markdown else json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,228 +1,881 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-import telebot
-from typing import List, Dict, Any, Optional
-import uvicorn
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List, Dict, Any, AsyncIterable, AsyncIterator, Optional
 from threading import Thread
 from dotenv import load_dotenv
 import os
+import hashlib
+import hmac
 import json
-from datetime import datetime
-import re
+import logging
+import math
+import time
+import tempfile
+from datetime import datetime, timezone
+
+from admission import AdmissionControl, Overloaded, Ticket
+from audit_log import AuditLog
+from batch_plan import normalize_chat_id
+from auth import KeyStore, restrict_chats
+from bot_updates import (
+    SECRET_HEADER,
+    WEBHOOK_PATH,
+    UpdateDispatcher,
+    echo_text,
+    register_webhook,
+    unregister_webhook,
+    webhook_secret,
+)
+from circuit_breaker import CircuitBreaker
+from delivery import DeliveryEngine
+from delivery_queue import DeliveryQueue, QueueWorkers
+from dedup import DedupIndex
+from encrypted_ingest import Decryptor
+from formatting import DEFAULT_OTP_PATTERNS, MessageFormatter
+from json_stream import EntryStream, StreamError, iter_json_array, iter_ndjson, read_body
+from lanes import parse_lane_limits
+from live_messages import LiveMessages
+from metrics import Metrics, MetricsMiddleware, timed
+from rate_limiter import DeliveryScheduler
+from recipients import RecipientRegistry, parse_ids
+from state_backend import OwnerLock, create_backend
+from structured_logging import CorrelationIdMiddleware, setup_logging
+from telegram_sender import TELEGRAM_API_BASE, TelegramSender
 
 # Load environment variables
 load_dotenv()
 
-# Initialize FastAPI app and Telegram bot
-app = FastAPI()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 AUTH_KEY = os.getenv("AUTH_KEY")
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN not found in .env file")
+# JSON list of per-device keys with their allowed chats and quotas; AUTH_KEY
+# still works next to it. The file is re-read within AUTH_KEYS_RELOAD seconds of a change.
+AUTH_KEYS_FILE = os.getenv("AUTH_KEYS_FILE")
+AUTH_KEYS_RELOAD = float(os.getenv("AUTH_KEYS_RELOAD", "5"))
+
+# Upper bound on concurrent Telegram requests across all in-flight batches
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "16"))
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", TELEGRAM_API_BASE)
+# Seconds before a Telegram request counts as timed out
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", "10"))
+
+# Telegram allows roughly 30 messages/s per bot and about 1 message/s per chat
+GLOBAL_RATE = float(os.getenv("GLOBAL_RATE", "30"))
+CHAT_RATE = float(os.getenv("CHAT_RATE", "1"))
+CHAT_BURST = float(os.getenv("CHAT_BURST", "3"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+SEND_MAX_DELAY = float(os.getenv("SEND_MAX_DELAY", "30"))
+
+# Priority lanes: SMS with an OTP code go first, then other SMS, then calls.
+# LANE_CONCURRENCY caps a lane's share of SEND_CONCURRENCY ("lane=n,...");
+# lower lanes yield rate-limit slots to urgent sends for up to LANE_MAX_DELAY seconds
+LANE_CONCURRENCY = parse_lane_limits(os.getenv("LANE_CONCURRENCY", "sms=8,call=4"))
+LANE_MAX_DELAY = float(os.getenv("LANE_MAX_DELAY", "10"))
+
+# Stop calling Telegram for BREAKER_OPEN_SECONDS once BREAKER_FAILURE_RATE of
+# at least BREAKER_MIN_CALLS sends in BREAKER_WINDOW seconds failed (rate 0
+# disables); BREAKER_BUFFER parks batches in the queue meanwhile instead of 503
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "30"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "15"))
+BREAKER_BUFFER = os.getenv("BREAKER_BUFFER", "").lower() in ("1", "true")
+
+# "sync" holds the request open until Telegram answers; "queue" persists the
+# batch and answers 202 right away. With QUEUE_PATH set, sync mode also lets
+# clients opt in per request with "Prefer: respond-async".
+INGEST_MODE = os.getenv("INGEST_MODE", "sync")
+QUEUE_PATH = os.getenv("QUEUE_PATH")
+QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", "4"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "5"))
+
+# Secret for AES256Cipher payloads; the mobile client uses the auth key
+ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY", AUTH_KEY)
+# Processes decrypting payloads (defaults to one per core)
+DECRYPT_WORKERS = int(os.getenv("DECRYPT_WORKERS", "0")) or None
+
+# "polling" runs telebot's infinity_polling in a thread next to uvicorn;
+# "webhook" has Telegram POST updates to WEBHOOK_PATH on this app instead;
+# "off" leaves updates to another deployment
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public base URL, e.g. https://example.com:8443
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or (webhook_secret(BOT_TOKEN) if BOT_TOKEN else "")
+WEBHOOK_CERT = os.getenv("WEBHOOK_CERT")  # upload a self-signed certificate to Telegram
+
+# Largest accepted /receive_data body and number of entries in one batch
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(10 * 1024 * 1024)))
+MAX_BATCH_ENTRIES = int(os.getenv("MAX_BATCH_ENTRIES", "10000"))
+
+# Admission control of /receive_data: batches in progress at once in total
+# and per key (0: no per-key cap; a key's "max_concurrent" overrides it),
+# (entry, recipient) sends admitted but not finished, and seconds a batch may
+# wait for those before it is answered 429/503 or its entries fail
+ADMISSION_MAX_BATCHES = int(os.getenv("ADMISSION_MAX_BATCHES", "64"))
+ADMISSION_PER_KEY = int(os.getenv("ADMISSION_PER_KEY", "0"))
+ADMISSION_MAX_SENDS = int(os.getenv("ADMISSION_MAX_SENDS", "1000"))
+ADMISSION_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT", "10"))
+
+# Seconds an entry's "id" is remembered so a resent batch isn't delivered twice
+# (0 disables); DEDUP_BY_CONTENT also matches entries without an id by content
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "600"))
+DEDUP_BY_CONTENT = os.getenv("DEDUP_BY_CONTENT", "").lower() in ("1", "true")
+# Join short messages for the same chat within a batch into one (up to 4096 chars)
+MERGE_MESSAGES = os.getenv("MERGE_MESSAGES", "").lower() in ("1", "true")
+
+# Edit-in-place delivery: for LIVE_MESSAGE_WINDOW seconds after a message is
+# sent (0 disables), later messages from the same source number to that chat
+# edit it instead; LIVE_MESSAGE_MODE "append" or "replace", LIVE_MESSAGE_CHATS
+# limits it to some chats (comma-separated, empty for all), LIVE_MESSAGE_CACHE
+# caps the messages remembered
+LIVE_MESSAGE_WINDOW = float(os.getenv("LIVE_MESSAGE_WINDOW", "0"))
+LIVE_MESSAGE_MODE = os.getenv("LIVE_MESSAGE_MODE", "append")
+LIVE_MESSAGE_CHATS = os.getenv("LIVE_MESSAGE_CHATS", "")
+LIVE_MESSAGE_CACHE = int(os.getenv("LIVE_MESSAGE_CACHE", "10000"))
+
+# OTP patterns highlighted in SMS texts: names from formatting.OTP_PATTERNS
+# ("digits", "split", "alnum") or regular expressions, separated by ";"
+OTP_PATTERNS = os.getenv("OTP_PATTERNS", ";".join(DEFAULT_OTP_PATTERNS)).split(";")
+
+# Log output: LOG_FORMAT "json" (one object per line) or "text"; LOG_REDACT
+# masks phone numbers and codes in messages; identical warnings beyond
+# LOG_SAMPLE_BURST per minute are dropped and counted (0 keeps all)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_REDACT = os.getenv("LOG_REDACT", "true").lower() in ("1", "true")
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "5"))
+
+# Seconds a chat that Telegram refused (chat not found, bot blocked) has later
+# sends failed without a request; 0 always asks Telegram
+RECIPIENT_TTL = float(os.getenv("RECIPIENT_TTL", "3600"))
+
+# Directory of the delivery audit log (empty disables it), size of one segment
+# file and how many segments are kept before the oldest is deleted
+AUDIT_DIR = os.getenv("AUDIT_DIR")
+AUDIT_SEGMENT_BYTES = int(os.getenv("AUDIT_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+AUDIT_KEEP_SEGMENTS = int(os.getenv("AUDIT_KEEP_SEGMENTS", "64"))
+
+# Serving: TLS files (empty SSL_CERTFILE serves plain HTTP, e.g. behind a proxy),
+# seconds idle connections are kept open, TLS 1.3 session tickets per handshake
+# (0 disables), event loop (auto/asyncio/uvloop), HTTP parser (auto/h11/httptools)
+# and HTTP/2 through hypercorn
+SSL_CERTFILE = os.getenv("SSL_CERTFILE", "cert.crt")
+SSL_KEYFILE = os.getenv("SSL_KEYFILE", "private.key")
+KEEPALIVE_TIMEOUT = float(os.getenv("KEEPALIVE_TIMEOUT", "75"))
+TLS_SESSION_TICKETS = int(os.getenv("TLS_SESSION_TICKETS", "2"))
+SERVER_LOOP = os.getenv("SERVER_LOOP", "auto")
+SERVER_HTTP = os.getenv("SERVER_HTTP", "auto")
+HTTP2 = os.getenv("HTTP2", "").lower() in ("1", "true")
+
+# Uvicorn worker processes; state shared between them lives in STATE_BACKEND
+# ("memory" or "sqlite:///path/state.db")
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+# Whichever worker holds this lock polls Telegram / owns the webhook registration
+# (defaults to a file in the temp dir named after the bot)
+CONSUMER_LOCK = os.getenv("CONSUMER_LOCK")
+
+logger = logging.getLogger(__name__)
+
+
+def consumer_lock_path() -> str:
+    if CONSUMER_LOCK:
+        return CONSUMER_LOCK
+    digest = hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"otp_sync_{digest}.lock")
+
 
-bot = telebot.TeleBot(BOT_TOKEN)
+_bot = None
 
 
-@bot.message_handler(func=lambda message: True)
-def echo_id(message):
-    bot.reply_to(message, f"Your Telegram ID is: {message.from_user.id}")
+def get_bot():
+    """The telebot client for polling, created (and telebot imported) on first use."""
+    global _bot
+    if _bot is None:
+        import telebot
 
+        bot = telebot.TeleBot(BOT_TOKEN)
 
-@app.get("/")
+        @bot.message_handler(func=lambda message: True)
+        def echo_id(message):
+            registry.record(message.chat.id)
+            bot.reply_to(message, echo_text(message.from_user.id))
+
+        _bot = bot
+    return _bot
+
+
+async def start_consumer(app: FastAPI, scheduler: DeliveryScheduler) -> None:
+    """Keep trying for the consumer lock; the winning worker consumes Telegram updates."""
+    while not app.state.owner.try_acquire():
+        await asyncio.sleep(5)
+
+    if BOT_MODE == "webhook":
+        await register_webhook(
+            scheduler, WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_CERT
+        )
+    else:
+        Thread(target=run_bot, daemon=True).start()
+    app.state.consumer = BOT_MODE
+
+
+async def stop_consumer(app: FastAPI, scheduler: DeliveryScheduler) -> None:
+    app.state.consumer_task.cancel()
+    await asyncio.gather(app.state.consumer_task, return_exceptions=True)
+    if app.state.consumer == "webhook":
+        try:
+            await unregister_webhook(scheduler)
+        except Exception as e:
+            logger.warning("Failed to delete webhook", extra={"error": str(e)})
+    elif app.state.consumer == "polling":
+        get_bot().stop_polling()
+    app.state.owner.release()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Configured and checked here rather than at import so tests and tools
+    # can import this module without side effects
+    setup_logging(LOG_LEVEL, LOG_FORMAT == "json", LOG_REDACT, LOG_SAMPLE_BURST)
+    if not BOT_TOKEN:
+        raise ValueError("BOT_TOKEN not found in .env file")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL is required when BOT_MODE=webhook")
+    if WEB_CONCURRENCY > 1 and STATE_BACKEND == "memory":
+        logger.warning("STATE_BACKEND=memory is not shared between workers")
+    backend = create_backend(STATE_BACKEND)
+    sender = TelegramSender(
+        BOT_TOKEN, base_url=TELEGRAM_API_URL, max_connections=SEND_CONCURRENCY, timeout=TELEGRAM_TIMEOUT
+    )
+    breaker = None
+    if BREAKER_FAILURE_RATE > 0:
+        breaker = CircuitBreaker(BREAKER_FAILURE_RATE, BREAKER_MIN_CALLS, BREAKER_WINDOW, BREAKER_OPEN_SECONDS)
+    app.state.breaker = breaker
+    scheduler = DeliveryScheduler(
+        sender,
+        backend=backend,
+        concurrency=SEND_CONCURRENCY,
+        global_rate=GLOBAL_RATE,
+        chat_rate=CHAT_RATE,
+        chat_burst=CHAT_BURST,
+        max_retries=SEND_MAX_RETRIES,
+        max_delay=SEND_MAX_DELAY,
+        metrics=app.state.metrics,
+        breaker=breaker,
+        lane_limits=LANE_CONCURRENCY,
+        lane_max_delay=LANE_MAX_DELAY,
+    )
+    app.state.backend = backend
+    app.state.audit = None
+    if AUDIT_DIR:
+        app.state.audit = AuditLog(AUDIT_DIR, AUDIT_SEGMENT_BYTES, AUDIT_KEEP_SEGMENTS)
+        app.state.audit.start()
+    dedup = DedupIndex(backend, DEDUP_WINDOW, by_content=DEDUP_BY_CONTENT) if DEDUP_WINDOW > 0 else None
+    live = None
+    if LIVE_MESSAGE_WINDOW > 0:
+        chats = [normalize_chat_id(chat) for chat in parse_ids(LIVE_MESSAGE_CHATS)]
+        live = LiveMessages(LIVE_MESSAGE_WINDOW, LIVE_MESSAGE_MODE, LIVE_MESSAGE_CACHE, chats or None)
+    registry.metrics = app.state.metrics
+    app.state.delivery = DeliveryEngine(
+        scheduler,
+        timed(formatter.render, app.state.metrics.format),
+        parse_mode=formatter.parse_mode,
+        dedup=dedup,
+        merge=MERGE_MESSAGES,
+        registry=registry if RECIPIENT_TTL > 0 else None,
+        audit=app.state.audit,
+        lanes=True,
+        live=live,
+        source=formatter.source,
+    )
+    app.state.decryptor = Decryptor(ENCRYPTION_KEY, DECRYPT_WORKERS) if ENCRYPTION_KEY else None
+    app.state.keys = KeyStore(AUTH_KEYS_FILE, AUTH_KEY)
+    app.state.admission = AdmissionControl(
+        ADMISSION_MAX_BATCHES, ADMISSION_PER_KEY, ADMISSION_MAX_SENDS, ADMISSION_TIMEOUT, app.state.metrics
+    )
+    app.state.keys.load()
+    keys_watcher = asyncio.create_task(app.state.keys.watch(AUTH_KEYS_RELOAD)) if AUTH_KEYS_FILE else None
+    app.state.updates = UpdateDispatcher(scheduler, registry)
+
+    app.state.owner = OwnerLock(consumer_lock_path())
+    app.state.consumer = None
+    app.state.consumer_task = None
+    if BOT_MODE in ("polling", "webhook"):
+        app.state.consumer_task = asyncio.create_task(start_consumer(app, scheduler))
+
+    app.state.queue = None
+    if INGEST_MODE == "queue" or QUEUE_PATH or (BREAKER_BUFFER and breaker):
+        queue = DeliveryQueue(QUEUE_PATH or "delivery_queue.db", max_attempts=QUEUE_MAX_ATTEMPTS)
+        app.state.queue = QueueWorkers(queue, app.state.delivery, workers=QUEUE_WORKERS, breaker=breaker)
+        app.state.queue.start()
+
+    metrics = app.state.metrics
+    metrics.gauge("otp_sync_sends_in_flight", "Telegram sends currently in progress.", lambda: scheduler.in_flight)
+    metrics.gauge("otp_sync_sends_waiting", "Sends waiting for a rate-limit slot.", lambda: scheduler.waiting)
+    metrics.gauge(
+        "otp_sync_queue_depth",
+        "Queued deliveries not yet delivered or failed.",
+        lambda: app.state.queue.queue.depth() if app.state.queue else None,
+    )
+    metrics.gauge(
+        "otp_sync_recipients_refused",
+        "Chats whose sends currently fail without a request after Telegram refused them.",
+        registry.refused,
+    )
+    metrics.gauge(
+        "otp_sync_circuit_state",
+        "Telegram circuit breaker: 0 closed, 1 half-open, 2 open.",
+        lambda: CIRCUIT_STATES[breaker.state] if breaker else None,
+    )
+    metrics.gauge(
+        "otp_sync_batches_in_progress",
+        "/receive_data batches admitted and not yet answered.",
+        lambda: app.state.admission.batches.used,
+    )
+    metrics.gauge(
+        "otp_sync_admitted_sends",
+        "(entry, recipient) sends admitted and not yet finished.",
+        lambda: app.state.admission.sends.used,
+    )
+    metrics.gauge(
+        "otp_sync_live_message_edits",
+        "Messages delivered by editing a live message instead of sending a new one.",
+        lambda: live.edits if live else None,
+    )
+    metrics.gauge(
+        "otp_sync_audit_dropped",
+        "Audit records dropped because the writer fell behind or failed.",
+        lambda: app.state.audit.dropped if app.state.audit else None,
+    )
+
+    app.state.ready = True
+    yield
+    app.state.ready = False
+
+    if keys_watcher:
+        keys_watcher.cancel()
+    if app.state.queue:
+        await app.state.queue.stop()
+        app.state.queue.queue.close()
+    if app.state.consumer_task:
+        await stop_consumer(app, scheduler)
+    await app.state.updates.drain()
+    if app.state.audit:
+        await app.state.audit.close()
+    if app.state.decryptor:
+        app.state.decryptor.close()
+    await scheduler.aclose()
+    await backend.close()
+
+
+def is_encrypted(request: Request) -> bool:
+    return request.headers.get("X-Encrypted", "").lower() in ("1", "true")
+
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+def is_ndjson(request: Request) -> bool:
+    content_type = request.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    return content_type in NDJSON_TYPES
+
+
+def wants_ndjson(request: Request) -> bool:
+    accept = request.headers.get("Accept", "")
+    return any(part.split(";")[0].strip().lower() in NDJSON_TYPES for part in accept.split(","))
+
+
+def observe_batch(metrics: Metrics, stream: EntryStream) -> None:
+    metrics.batch_size.observe(stream.count)
+    metrics.parse.observe(stream.elapsed)
+
+
+async def stream_results(
+    delivery: DeliveryEngine, entries: AsyncIterable[Any], stream: EntryStream, metrics: Metrics, ticket: Ticket
+) -> AsyncIterator[bytes]:
+    """One NDJSON line per (index, user_id) as its send completes, then a summary line.
+
+    ``entries`` are those of ``stream`` as prepared for sending. Only
+    counters are kept, so memory doesn't grow with the batch. Each outcome
+    gives its entry's send units back to ``ticket``, the batch's admission.
+    """
+    counts = {"sent": 0, "failed": 0, "duplicate": 0}
+    try:
+        async for origin, status, record in delivery.outcomes(entries):
+            ticket.done(record["index"], origin is None)
+            counts[status] += 1
+            yield (json.dumps({**record, "status": status}, ensure_ascii=False) + "\n").encode()
+        observe_batch(metrics, stream)
+        if stream.error:
+            counts["failed"] += 1
+            line = {"index": stream.count, "error": str(stream.error), "status": "failed"}
+            yield (json.dumps(line) + "\n").encode()
+    except Exception as e:
+        # Headers are already out; the summary line carries the error instead of a 500
+        logger.exception("Unexpected error")
+        yield (json.dumps({"status": "error", "error": f"Internal server error: {str(e)}"}) + "\n").encode()
+        return
+
+    if not counts["failed"]:
+        summary = "success"
+    elif counts["sent"]:
+        summary = "partial_success"
+    else:
+        summary = "failed"
+    yield (json.dumps({
+        "status": summary,
+        "delivered": counts["sent"],
+        "failed": counts["failed"],
+        "duplicate": counts["duplicate"],
+    }) + "\n").encode()
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """Releases the batch's admission ticket when the response ends, also if the client went away."""
+
+    def __init__(self, content: AsyncIterator[bytes], ticket: Ticket, **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.ticket.release()
+
+
+def server_busy(admission: AdmissionControl, failed_messages: List[Dict[str, Any]]) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(admission.retry_after)},
+        content={
+            "error": "Server busy, too many sends in progress",
+            "details": failed_messages
+        }
+    )
+
+
+async def iterate(entries: List[Any]) -> AsyncIterator[Any]:
+    for entry in entries:
+        yield entry
+
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def circuit_wait(request: Request) -> int:
+    """Whole seconds until the Telegram circuit lets sends through again; 0 if it does now."""
+    breaker = request.app.state.breaker
+    return math.ceil(breaker.retry_after()) if breaker else 0
+
+
+def wants_queue(request: Request) -> bool:
+    if request.app.state.queue is None:
+        return False
+    return INGEST_MODE == "queue" or "respond-async" in request.headers.get("Prefer", "")
+
+
+formatter = MessageFormatter(OTP_PATTERNS)
+format_message = formatter.format_message
+# Shared by the delivery engine and the bot's update handlers
+registry = RecipientRegistry(RECIPIENT_TTL)
+
+# Routes live on a router so create_app() can build a fresh app per worker
+router = APIRouter()
+
+
+@router.get("/")
 async def root():
     return {"message": "Hello World"}
 
 
-def extract_otp_codes(text: str) -> str:
-    """Extract OTP codes from text and wrap them in backticks for easy copying."""
-    otp_pattern = r'\b(\d{4,8})\b'
-    
-    def replace_otp(match):
-        return f"`{match.group(1)}`"
-    
-    formatted_text = re.sub(otp_pattern, replace_otp, text)
-    return formatted_text
-
-def extract_last_digits(phone: str, digits: int = 6) -> str:
-    """Extract last N digits from a phone number."""
-    # Remove all non-digit characters
-    digits_only = re.sub(r'\D', '', phone)
-    # Return last N digits
-    return digits_only[-digits:] if len(digits_only) >= digits else digits_only
-
-
-
-def format_message(data: Dict[str, Any]) -> str:
-    """Format the incoming data into a readable Telegram message."""
-    lines = []
-    
-    # Check if it's SMS or Call
-    has_call = bool(data.get("call") and data.get("call", True))
-    has_sms = bool(data.get("sms"))
-    
-    if has_sms:
-        # Format SMS message
-        formatted_sms = extract_otp_codes(data["sms"])
-        lines.append(formatted_sms)
-    elif has_call:
-        # Format Call message with last 6 digits wrapped in backticks
-        from_phone = data.get('from', 'Unknown')
-        to_location = data.get('to', 'Unknown')
-        last_digits = extract_last_digits(from_phone, 6)
-        lines.append(f"📞 {from_phone} (`{last_digits}`), {to_location}")
-    
-    return "\n".join(lines)
-
-
-
-@app.post("/receive_data")
+@router.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and answering, whatever its dependencies do."""
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz(request: Request):
+    """Readiness: 200 once startup finished and the state backend and queue answer.
+
+    Telegram being down doesn't make the instance unready (every instance
+    shares the same Telegram), so the circuit state is only reported.
+    """
+    state = request.app.state
+    checks: Dict[str, Any] = {"started": getattr(state, "ready", False)}
+    if checks["started"]:
+        try:
+            await state.backend.contains("readyz")
+            checks["backend"] = "ok"
+        except Exception as e:
+            checks["backend"] = str(e)
+        if state.queue is not None:
+            try:
+                await asyncio.to_thread(state.queue.queue.depth)
+                checks["queue"] = "ok"
+            except Exception as e:
+                checks["queue"] = str(e)
+        checks["telegram"] = state.breaker.state if state.breaker else "closed"
+        checks["consumer"] = state.consumer or "none"
+    ready = checks["started"] and all(checks.get(name, "ok") == "ok" for name in ("backend", "queue"))
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "checks": checks}
+    )
+
+
+@router.post("/receive_data")
 async def receive_data(request: Request):
-    telegram_available = False
-    
     try:
         # Check auth key
+        metrics = request.app.state.metrics
+        started = time.perf_counter()
         headers = request.headers
-        auth_key = headers.get("X-Auth-Key")
-        if auth_key != AUTH_KEY:
+        device = request.app.state.keys.authenticate(headers.get("X-Auth-Key"))
+        metrics.auth.observe(time.perf_counter() - started)
+        if device is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Invalid auth key"}
             )
+        wait = request.app.state.keys.admit(device)
+        if wait:
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(wait))},
+                content={"error": "Rate limit exceeded for this key"}
+            )
+        max_entries = min(MAX_BATCH_ENTRIES, device.max_batch or MAX_BATCH_ENTRIES)
 
-        # Parse JSON body
-        try:
-            body = await request.json()
-        except json.JSONDecodeError:
+        # Telegram is known to be down: answer now instead of failing every send
+        wait = circuit_wait(request)
+        park = wait > 0 and BREAKER_BUFFER and request.app.state.queue is not None
+        if wait and not park:
             return JSONResponse(
-                status_code=400,
-                content={"error": "Invalid JSON format"}
+                status_code=503,
+                headers={"Retry-After": str(wait)},
+                content={"error": "Telegram is down or unavailable", "retry_after": wait}
             )
-        
-        # Validate that body is a list
-        if not isinstance(body, list):
+
+        decryptor = request.app.state.decryptor
+        if is_encrypted(request) and decryptor is None:
             return JSONResponse(
                 status_code=400,
-                content={"error": "Expected array of message objects"}
+                content={"error": "Encrypted payloads are not enabled"}
             )
-        
-        # Process each message
-        failed_messages = []
-        successful_messages = []
-        
-        for idx, message_data in enumerate(body):
-            # Validate message structure
-            if not isinstance(message_data, dict):
-                failed_messages.append({
-                    "index": idx,
-                    "error": "Invalid message format: expected object"
-                })
-                continue
-            
-            # Extract user IDs from the "ids" field
-            ids_str = message_data.get("ids", "")
-            if not ids_str:
-                failed_messages.append({
-                    "index": idx,
-                    "error": "Missing 'ids' field"
-                })
-                continue
-            
-            user_ids = [id.strip() for id in ids_str.split(",") if id.strip()]
-            
-            if not user_ids:
-                failed_messages.append({
-                    "index": idx,
-                    "error": "No valid user IDs found"
-                })
-                continue
-            
-            # Check that at least SMS or Call is present
-            has_sms = bool(message_data.get("sms"))
-            has_call = bool(message_data.get("call"))
-            
-            if not has_sms and not has_call:
-                failed_messages.append({
-                    "index": idx,
-                    "error": "Either 'sms' or 'call' field is required"
-                })
-                continue
-            
-            # Format the message
-            formatted_message = format_message(message_data)
-            
-            # Send to each user
-            for user_id in user_ids:
+
+        content_length = headers.get("Content-Length", "")
+        if content_length.isdigit() and int(content_length) > MAX_BODY_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"error": f"Request body too large (max {MAX_BODY_BYTES} bytes)"}
+            )
+
+        # Wait for room to deliver the batch; answer 429/503 once its deadline passes
+        admission = request.app.state.admission
+        try:
+            ticket = await admission.admit(device)
+        except Overloaded as e:
+            return JSONResponse(
+                status_code=e.status_code,
+                headers={"Retry-After": str(e.retry_after)},
+                content={"error": str(e), "retry_after": e.retry_after}
+            )
+        # A streamed response releases the ticket itself once it is sent
+        streaming = False
+        try:
+            # Parse the body as it arrives (JSON array or NDJSON), decrypting it first
+            # if the whole batch is encrypted
+            if is_encrypted(request):
                 try:
-                    bot.send_message(
-                        user_id, 
-                        formatted_message,
-                        parse_mode="Markdown"
+                    raw = await read_body(request.stream(), MAX_BODY_BYTES)
+                    body = await decryptor.decrypt_body(raw.decode())
+                except StreamError as e:
+                    return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+                except ValueError:
+                    return JSONResponse(
+                        status_code=400,
+                        content={"error": "Failed to decrypt body"}
                     )
-                    telegram_available = True
-                    successful_messages.append({
-                        "index": idx,
-                        "user_id": user_id
-                    })
-                except Exception as e:
-                    print(f"Failed to send message to user {user_id}: {str(e)}")
-                    failed_messages.append({
-                        "index": idx,
-                        "user_id": user_id,
-                        "error": str(e)
-                    })
-        
-        # If we couldn't send any messages, Telegram might be down
-        if not telegram_available and failed_messages:
-            return JSONResponse(
-                status_code=503,
-                content={
-                    "error": "Telegram is down or unavailable",
-                    "details": failed_messages
+                # Validate that body is a list
+                if not isinstance(body, list):
+                    return JSONResponse(
+                        status_code=400,
+                        content={"error": "Expected array of message objects"}
+                    )
+                if len(body) > max_entries:
+                    return JSONResponse(
+                        status_code=413,
+                        content={"error": f"Too many entries in batch (max {max_entries})"}
+                    )
+                entries = iterate(body)
+            else:
+                parse = iter_ndjson if is_ndjson(request) else iter_json_array
+                entries = parse(request.stream(), MAX_BODY_BYTES, max_entries)
+
+            # The stream times only reading and parsing: decryption and admission come after it
+            stream = EntryStream(entries)
+            try:
+                await stream.start()
+            except StreamError as e:
+                return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+            entries = stream
+
+            # Decrypt entries sent as {"ids": ..., "encrypted": ...} on the process pool
+            if decryptor:
+                entries = decryptor.decrypt_stream(entries)
+            if device.chats is not None:
+                entries = restrict_chats(entries, device)
+            # Entries take send units as they are read, unless the batch is queued
+            # (nothing is sent now) or merged (its sends take them once planned)
+            delivery = request.app.state.delivery
+            queued = park or wants_queue(request)
+            ndjson = wants_ndjson(request)
+            if not queued and (ndjson or not delivery.merge):
+                entries = ticket.entries(entries)
+
+            # Persist the batch and let the background workers deliver it
+            if queued:
+                body = [entry async for entry in entries]
+                observe_batch(metrics, stream)
+                if stream.error:
+                    return JSONResponse(
+                        status_code=stream.error.status_code,
+                        content={"error": str(stream.error)}
+                    )
+                accepted, failed_messages, duplicates = await request.app.state.queue.submit(body)
+                if not accepted and not duplicates:
+                    return JSONResponse(
+                        status_code=400,
+                        content={
+                            "error": "No valid messages in batch",
+                            "details": failed_messages
+                        }
+                    )
+                content = {
+                    "status": "accepted",
+                    "messages": accepted,
+                    "failed": failed_messages
                 }
-            )
+                if duplicates:
+                    content["duplicate"] = duplicates
+                if park:
+                    content["buffered"] = True
+                return JSONResponse(status_code=202, content=content)
+
+            # Stream each result back as soon as its send completes
+            if ndjson:
+                streaming = True
+                return AdmittedStreamingResponse(
+                    stream_results(delivery, entries, stream, metrics, ticket),
+                    ticket,
+                    media_type="application/x-ndjson"
+                )
+
+            # Send entries as they are parsed; results keep the batch order
+            report = await delivery.deliver_stream(entries, ticket.done, ticket.send_unit)
+            observe_batch(metrics, stream)
+            if stream.error:
+                # Entries before the error were already sent; report the rest as one failure
+                report.failed.append({"index": stream.count, "error": str(stream.error)})
+            failed_messages = report.failed
+            successful_messages = report.successful
+
+            # Nothing went out because the server was too busy to take the entries
+            if ticket.rejected and not report.telegram_available:
+                return server_busy(admission, failed_messages)
+
+            # Nothing went out only because Telegram throttled us: ask the client to back off
+            retry_afters = [f.get("retry_after") for f in failed_messages]
+            if not report.telegram_available and retry_afters and all(retry_afters):
+                return JSONResponse(
+                    status_code=429,
+                    headers={"Retry-After": str(math.ceil(max(retry_afters)))},
+                    content={
+                        "error": "Telegram rate limit exceeded",
+                        "details": failed_messages
+                    }
+                )
+
+            # If we couldn't send any messages, Telegram might be down
+            if not report.telegram_available and failed_messages:
+                wait = circuit_wait(request)
+                return JSONResponse(
+                    status_code=503,
+                    headers={"Retry-After": str(wait)} if wait else None,
+                    content={
+                        "error": "Telegram is down or unavailable",
+                        "details": failed_messages
+                    }
+                )
         
-        # Return results
-        if failed_messages:
-            return JSONResponse(
-                status_code=207,
-                content={
+            # Return results; resent entries already delivered are listed, not failed
+            if failed_messages:
+                content = {
                     "status": "partial_success",
                     "successful": successful_messages,
                     "failed": failed_messages
                 }
-            )
-        
-        return JSONResponse(
-            status_code=200,
-            content={
+                if report.duplicate:
+                    content["duplicate"] = report.duplicate
+                return JSONResponse(status_code=207, content=content)
+
+            content = {
                 "status": "success",
                 "delivered": len(successful_messages)
             }
-        )
+            if report.duplicate:
+                content["duplicate"] = report.duplicate
+            return JSONResponse(status_code=200, content=content)
+        finally:
+            if not streaming:
+                ticket.release()
 
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
+        logger.exception("Unexpected error")
         return JSONResponse(
             status_code=500,
             content={"error": f"Internal server error: {str(e)}"}
         )
 
 
+@router.get("/metrics")
+async def metrics_endpoint(request: Request):
+    return PlainTextResponse(
+        request.app.state.metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@router.get("/status/{message_id}")
+async def delivery_status(message_id: str, request: Request):
+    if request.app.state.keys.authenticate(request.headers.get("X-Auth-Key")) is None:
+        return JSONResponse(
+            status_code=401,
+            content={"error": "Invalid auth key"}
+        )
+    if request.app.state.queue is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Delivery queue is not enabled"}
+        )
+
+    status = await asyncio.to_thread(request.app.state.queue.queue.status, message_id)
+    if status is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Unknown message id"}
+        )
+    return status
+
+
+def parse_time(value: str) -> float:
+    """Unix seconds, or an ISO 8601 time (UTC unless it has an offset)."""
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+@router.get("/audit")
+async def audit(
+    request: Request,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    chat_id: Optional[str] = None,
+    limit: int = 1000,
+):
+    device = request.app.state.keys.authenticate(request.headers.get("X-Auth-Key"))
+    if device is None:
+        return JSONResponse(
+            status_code=401,
+            content={"error": "Invalid auth key"}
+        )
+    if request.app.state.audit is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Audit log is not enabled"}
+        )
+    # A key limited to some chats only sees those
+    if device.chats is not None and (chat_id is None or not device.allows(chat_id)):
+        return JSONResponse(
+            status_code=403,
+            content={"error": "chat_id must be one of this key's chats"}
+        )
+    try:
+        start = parse_time(since) if since else 0.0
+        end = parse_time(until) if until else math.inf
+    except ValueError:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "since and until must be unix seconds or ISO 8601 times"}
+        )
+
+    # Include sends still waiting for the background writer
+    await request.app.state.audit.flush()
+    records, truncated = await asyncio.to_thread(
+        request.app.state.audit.query, start, end, chat_id, max(1, min(limit, 10000))
+    )
+    return {"records": [record.to_json() for record in records], "truncated": truncated}
+
+
+@router.post(WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    secret = request.headers.get(SECRET_HEADER, "")
+    if BOT_MODE != "webhook" or not WEBHOOK_SECRET or not hmac.compare_digest(secret, WEBHOOK_SECRET):
+        return JSONResponse(
+            status_code=401,
+            content={"error": "Invalid secret token"}
+        )
+
+    try:
+        update = await request.json()
+    except json.JSONDecodeError:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Invalid JSON format"}
+        )
+
+    # Answer Telegram immediately; the reply is sent in the background
+    request.app.state.updates.dispatch(update)
+    return {"ok": True}
+
+
 def run_bot():
-    bot.infinity_polling()
+    get_bot().infinity_polling()
+
+
+def create_app() -> FastAPI:
+    """App factory; used by multi-worker servers (``uvicorn --factory`` / gunicorn)."""
+    app = FastAPI(lifespan=lifespan)
+    app.state.metrics = Metrics()
+    app.add_middleware(MetricsMiddleware, metrics=app.state.metrics)
+    # Added last so it wraps everything and its ID is set for the whole request
+    app.add_middleware(CorrelationIdMiddleware)
+    app.include_router(router)
+    return app
+
+
+app = create_app()
 
 
 if __name__ == "__main__":
-    # Start Telegram bot in a separate thread
-    bot_thread = Thread(target=run_bot)
-    bot_thread.daemon = True
-    bot_thread.start()
-
-    # Run FastAPI with uvicorn in main thread
-    uvicorn.run(
-        app,
+    from serving import serve
+
+    # Workers > 1 need the import string of the factory
+    serve(
+        "main:create_app",
         host="0.0.0.0",
         port=9374,
-        ssl_keyfile="private.key",
-        ssl_certfile="cert.crt",
+        workers=WEB_CONCURRENCY,
+        certfile=SSL_CERTFILE,
+        keyfile=SSL_KEYFILE,
+        keep_alive=KEEPALIVE_TIMEOUT,
+        session_tickets=TLS_SESSION_TICKETS,
+        loop=SERVER_LOOP,
+        http=SERVER_HTTP,
+        http2=HTTP2,
     )
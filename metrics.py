@@ -0,0 +1,216 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+# Seconds; fixed so observing is a bisect and one list increment
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+_INF = 'le="+Inf"'
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self.samples()
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Gauge(_Metric):
+    """A value read from ``fn`` at scrape time, so the hot path only keeps its own counters."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Optional[float]]):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def samples(self) -> Iterator[str]:
+        value = self.fn()
+        if value is not None:
+            yield f"{self.name} {_number(value)}"
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # One slot per bucket plus +Inf, allocated once
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[Tuple[str, ...], _HistogramChild] = {}
+
+    def labels(self, *labels: str) -> _HistogramChild:
+        """The series for ``labels``; keep it around to observe without a dict lookup."""
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children[labels] = _HistogramChild(self.buckets)
+        return child
+
+    def observe(self, value: float, *labels: str) -> None:
+        self.labels(*labels).observe(value)
+
+    def samples(self) -> Iterator[str]:
+        for labels, child in sorted(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{_number(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            cumulative += child.counts[-1]
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, _INF)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {repr(child.sum)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Metrics:
+    """The service's metrics, rendered in the Prometheus text format by /metrics.
+
+    Each worker process keeps its own; with several workers a scrape sees
+    whichever one answered.
+    """
+
+    def __init__(self):
+        self.requests = Counter(
+            "otp_sync_requests_total", "HTTP requests by route and status code.", ("path", "status")
+        )
+        self.batch_size = Histogram(
+            "otp_sync_batch_entries", "Entries per /receive_data batch.", buckets=BATCH_BUCKETS
+        )
+        self.stage_seconds = Histogram(
+            "otp_sync_stage_seconds",
+            "Seconds per stage: auth, parse (reading and parsing the body), format, send (one Telegram call).",
+            ("stage",),
+        )
+        self.telegram_errors = Counter(
+            "otp_sync_telegram_errors_total",
+            "Failed Telegram API calls by error code (network: no answer).",
+            ("code",),
+        )
+        self.delivery_seconds = Histogram(
+            "otp_sync_delivery_seconds",
+            "Seconds from the start of a send to Telegram accepting it, with rate-limit waits and retries, by lane.",
+            ("lane",),
+        )
+        self.admission_rejected = Counter(
+            "otp_sync_admission_rejected_total",
+            "Batches (key, busy) and entries (sends) refused by admission control.",
+            ("reason",),
+        )
+        self.recipients_short_circuited = Counter(
+            "otp_sync_recipients_short_circuited_total",
+            "Sends failed without a request: the chat was recently refused or can't be a chat.",
+        )
+        self._metrics: Dict[str, _Metric] = {
+            m.name: m
+            for m in (
+                self.requests, self.batch_size, self.stage_seconds, self.telegram_errors, self.delivery_seconds,
+                self.admission_rejected, self.recipients_short_circuited,
+            )
+        }
+        # Hot-path handles: a histogram child per stage, looked up once
+        self.auth = self.stage_seconds.labels("auth")
+        self.parse = self.stage_seconds.labels("parse")
+        self.format = self.stage_seconds.labels("format")
+        self.send = self.stage_seconds.labels("send")
+
+    def gauge(self, name: str, help: str, fn: Callable[[], Optional[float]]) -> None:
+        """Report ``fn()`` as gauge ``name``, replacing an earlier gauge of that name."""
+        self._metrics[name] = Gauge(name, help, fn)
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+
+def timed(fn: Callable, histogram: _HistogramChild) -> Callable:
+    """Wrap ``fn`` so each call's duration is observed in ``histogram``."""
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting responses by route template and status code."""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The route template keeps /status/<id> to one series
+            path = getattr(scope.get("route"), "path", "other")
+            self.metrics.requests.inc(path, str(status))
@@ -0,0 +1,250 @@
+import asyncio
+import random
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from lanes import LANES, PriorityGate, lane_priority
+from state_backend import MemoryBackend, TokenBucket  # noqa: F401 (re-exported)
+from telegram_sender import TelegramAPIError
+
+# Failures where the request never reached Telegram, so resending can't duplicate it
+_RETRYABLE_TRANSPORT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class DeliveryScheduler:
+    """Wraps TelegramSender with per-chat and global rate limits, retries and a concurrency cap.
+
+    Exposes the same ``send_message``/``edit_message_text``/``call``/``aclose`` interface as the sender.
+    Buckets live in ``backend`` so several worker processes can share one budget.
+
+    Each send belongs to a lane (lanes.LANES, most urgent first). Free
+    connections go to the most urgent waiting lane, ``lane_limits`` caps a
+    lane's share of them, and a lower lane only takes global rate tokens that
+    are free right now, and none while a more urgent send waits for one,
+    so OTPs book the next slots. After ``lane_max_delay`` seconds a held
+    back send books its slot like any other.
+    """
+
+    def __init__(
+        self,
+        sender,
+        backend=None,
+        concurrency: int = 16,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_retries: int = 3,
+        max_delay: float = 30.0,
+        backoff_base: float = 0.5,
+        metrics=None,
+        breaker=None,
+        lane_limits: Optional[Dict[str, int]] = None,
+        lane_max_delay: float = 10.0,
+    ):
+        self.sender = sender
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_delay = max_delay
+        self.backoff_base = backoff_base
+        self.gate = PriorityGate(concurrency, lane_limits)
+        self.lane_max_delay = lane_max_delay
+        # Sends per lane waiting for a global rate token (not for their chat's bucket)
+        self.queued: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._dequeued = asyncio.Event()
+        self.waited_seconds = 0.0
+        self.waited_sends = 0
+        self.max_wait = 0.0
+        self.throttled = 0
+        self.retries = 0
+        # Sends waiting for a rate-limit slot / currently talking to Telegram
+        self.waiting = 0
+        self.in_flight = 0
+        self.metrics = metrics
+        # Optional CircuitBreaker; while open, sends raise CircuitOpenError at once
+        self.breaker = breaker
+
+    def _urgent_waiting(self, priority: int) -> bool:
+        return any(self.queued[lane] for lane in LANES[:priority])
+
+    async def _global_turn(self, priority: int) -> float:
+        """Reserve a global token; lower lanes don't book ahead of more urgent sends."""
+        if priority == 0:
+            return await self.backend.reserve("global", self.global_rate, self.global_rate)
+        deadline = time.monotonic() + self.lane_max_delay
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return await self.backend.reserve("global", self.global_rate, self.global_rate)
+            if self._urgent_waiting(priority):
+                dequeued = self._dequeued
+                try:
+                    await asyncio.wait_for(dequeued.wait(), left)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            wait = await self.backend.reserve("global", self.global_rate, self.global_rate, max_wait=0)
+            if wait <= 0:
+                return 0.0
+            self.waiting += 1
+            try:
+                await asyncio.sleep(min(wait, left))
+            finally:
+                self.waiting -= 1
+
+    async def _wait_turn(self, chat_id: str, lane: str) -> None:
+        """Wait for the chat's bucket and a global token.
+
+        Only the wait for the global token counts in ``queued``: a chat
+        throttled on its own bucket doesn't hold back other chats' lanes.
+        """
+        chat_wait = await self.backend.reserve(f"chat:{chat_id}", self.chat_rate, self.chat_burst)
+        started = time.monotonic()
+        self.queued[lane] += 1
+        try:
+            global_wait = await self._global_turn(lane_priority(lane))
+            wait = max(chat_wait - (time.monotonic() - started), global_wait)
+            if wait > 0:
+                self.waited_seconds += wait
+                self.waited_sends += 1
+                self.max_wait = max(self.max_wait, wait)
+            await self._sleep(global_wait)
+        finally:
+            self.queued[lane] -= 1
+            self._dequeued.set()
+            self._dequeued = asyncio.Event()
+        await self._sleep(chat_wait - (time.monotonic() - started))
+
+    async def _sleep(self, wait: float) -> None:
+        if wait <= 0:
+            return
+        self.waiting += 1
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            self.waiting -= 1
+
+    async def _send_once(
+        self, chat_id: str, text: str, parse_mode: Optional[str], lane: str, message_id: Optional[int]
+    ) -> Dict[str, Any]:
+        probe = self.breaker.acquire() if self.breaker else False
+        # Whether Telegram answered, for the breaker; None if the send never finished
+        ok = None
+        try:
+            async with self.gate.slot(lane):
+                self.in_flight += 1
+                start = time.perf_counter()
+                try:
+                    if message_id is None:
+                        result = await self.sender.send_message(chat_id, text, parse_mode=parse_mode)
+                    else:
+                        result = await self.sender.edit_message_text(
+                            chat_id, message_id, text, parse_mode=parse_mode
+                        )
+                    ok = True
+                    return result
+                except TelegramAPIError as e:
+                    ok = e.error_code < 500
+                    if self.metrics:
+                        self.metrics.telegram_errors.inc(str(e.error_code))
+                    raise
+                except httpx.HTTPError:
+                    ok = False
+                    if self.metrics:
+                        self.metrics.telegram_errors.inc("network")
+                    raise
+                finally:
+                    self.in_flight -= 1
+                    if self.metrics:
+                        self.metrics.send.observe(time.perf_counter() - start)
+        finally:
+            if self.breaker:
+                self.breaker.record(ok, probe)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps retries from many batches from landing together
+        return random.uniform(0, min(self.max_delay, self.backoff_base * 2 ** attempt))
+
+    async def send_message(
+        self, chat_id: str, text: str, parse_mode: Optional[str] = None, lane: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return await self._deliver(chat_id, text, parse_mode, lane, None)
+
+    async def edit_message_text(
+        self,
+        chat_id: str,
+        message_id: int,
+        text: str,
+        parse_mode: Optional[str] = None,
+        lane: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Replace the text of the earlier message ``message_id``; limited and retried like a send."""
+        return await self._deliver(chat_id, text, parse_mode, lane, message_id)
+
+    async def _deliver(
+        self,
+        chat_id: str,
+        text: str,
+        parse_mode: Optional[str],
+        lane: Optional[str],
+        message_id: Optional[int],
+    ) -> Dict[str, Any]:
+        lane = LANES[lane_priority(lane)]
+        started = time.perf_counter()
+        result = await self._send_with_retries(chat_id, text, parse_mode, lane, message_id)
+        if self.metrics:
+            self.metrics.delivery_seconds.observe(time.perf_counter() - started, lane)
+        return result
+
+    async def _send_with_retries(
+        self, chat_id: str, text: str, parse_mode: Optional[str], lane: str, message_id: Optional[int]
+    ) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            await self._wait_turn(chat_id, lane)
+            try:
+                return await self._send_once(chat_id, text, parse_mode, lane, message_id)
+            except TelegramAPIError as e:
+                if e.error_code == 429:
+                    self.throttled += 1
+                    retry_after = e.retry_after if e.retry_after is not None else self._backoff(attempt)
+                    if attempt >= self.max_retries or retry_after > self.max_delay:
+                        raise
+                    # The chat's bucket holds this and every other send to it back
+                    await self.backend.block(
+                        f"chat:{chat_id}", self.chat_rate, self.chat_burst, retry_after
+                    )
+                    delay = 0.0
+                elif e.error_code >= 500 and attempt < self.max_retries:
+                    delay = self._backoff(attempt)
+                else:
+                    raise
+            except _RETRYABLE_TRANSPORT_ERRORS:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+
+            attempt += 1
+            self.retries += 1
+            if delay:
+                await asyncio.sleep(delay)
+
+    async def call(self, method: str, files: Optional[Dict[str, Any]] = None, **params: Any) -> Any:
+        async with self.gate.slot(LANES[0]):
+            return await self.sender.call(method, files=files, **params)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "waited_sends": self.waited_sends,
+            "waited_seconds": round(self.waited_seconds, 3),
+            "max_wait_seconds": round(self.max_wait, 3),
+            "throttled": self.throttled,
+            "retries": self.retries,
+        }
+
+    async def aclose(self) -> None:
+        await self.sender.aclose()
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Optional, Tuple
+
+from batch_plan import normalize_chat_id
+from telegram_sender import TelegramAPIError
+
+# Answers that are about the recipient, not the message: repeating the send can't help
+_RECIPIENT_ERRORS = (
+    "chat not found",
+    "user not found",
+    "peer_id_invalid",
+    "bot was blocked",
+    "user is deactivated",
+    "bot can't initiate conversation",
+    "bot was kicked",
+)
+
+
+@lru_cache(maxsize=4096)
+def parse_ids(ids: str) -> Tuple[str, ...]:
+    """Split an entry's comma-separated ``ids``; phones resend the same few strings over and over."""
+    return tuple(user_id.strip() for user_id in ids.split(",") if user_id.strip())
+
+
+def is_recipient_error(exc: Exception) -> bool:
+    if not isinstance(exc, TelegramAPIError) or exc.error_code not in (400, 403):
+        return False
+    description = exc.description.lower()
+    return any(reason in description for reason in _RECIPIENT_ERRORS)
+
+
+class RecipientRegistry:
+    """Chats Telegram recently refused.
+
+    A chat that answered 400 "chat not found" or 403 (blocked, deactivated)
+    is remembered for ``ttl`` seconds; check() then fails its sends at once
+    with the same error instead of asking Telegram again. A chat that writes
+    to the bot is taken off that list. IDs that can't be chats (neither a
+    number nor an @username) are refused without being stored. record() may
+    be called from the bot's polling thread, so the list is locked.
+    """
+
+    def __init__(self, ttl: float = 3600.0, capacity: int = 100000, metrics=None):
+        self.ttl = ttl
+        self.capacity = capacity
+        # chat_id -> (expires, error_code, description)
+        self._refused: "OrderedDict[str, Tuple[float, int, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Sends failed without a request
+        self.short_circuited = 0
+        self.metrics = metrics
+
+    def record(self, chat_id: Any) -> None:
+        """Note that ``chat_id`` interacted with the bot (so it can be written to)."""
+        chat_id = normalize_chat_id(str(chat_id))
+        with self._lock:
+            self._refused.pop(chat_id, None)
+
+    def refuse(self, chat_id: str, error: TelegramAPIError, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        chat_id = normalize_chat_id(chat_id)
+        with self._lock:
+            self._refused[chat_id] = (now + self.ttl, error.error_code, error.description)
+            self._refused.move_to_end(chat_id)
+            if len(self._refused) > self.capacity:
+                self._refused.popitem(last=False)
+
+    def _short_circuit(self, error_code: int, description: str) -> TelegramAPIError:
+        self.short_circuited += 1
+        if self.metrics:
+            self.metrics.recipients_short_circuited.inc()
+        return TelegramAPIError(error_code, description)
+
+    def check(self, chat_id: str, now: Optional[float] = None) -> None:
+        """Raise the cached TelegramAPIError if ``chat_id`` is known to be unreachable."""
+        chat_id = normalize_chat_id(chat_id)
+        if not (chat_id.lstrip("-").isdigit() or chat_id.startswith("@")):
+            raise self._short_circuit(400, "Bad Request: chat not found")
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            refused = self._refused.get(chat_id)
+            if refused is None:
+                return
+            if refused[0] <= now:
+                del self._refused[chat_id]
+                return
+        raise self._short_circuit(refused[1], refused[2])
+
+    def refused(self) -> int:
+        return len(self._refused)
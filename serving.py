@@ -0,0 +1,146 @@
+"""Runs the app with TLS and connection settings tuned for phones that reconnect often.
+
+Mobile networks drop idle connections and phones reconnect for every batch;
+each new connection costs a TLS handshake unless the server keeps it open
+long enough (``keep_alive``) or lets the phone resume its previous session
+(``session_tickets``). HTTP/2 needs hypercorn, uvloop/httptools need those
+packages installed; uvicorn over HTTP/1.1 needs nothing extra.
+"""
+import ssl
+from typing import Optional, Sequence
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+try:
+    from hypercorn.config import Config as _HypercornConfig
+except ImportError:  # HTTP/2 is optional
+    _HypercornConfig = None
+
+LOOPS = ("auto", "asyncio", "uvloop")
+HTTP_IMPLEMENTATIONS = ("auto", "h11", "httptools")
+
+
+def ssl_context(
+    certfile: str,
+    keyfile: Optional[str] = None,
+    session_tickets: int = 2,
+    alpn_protocols: Sequence[str] = ("http/1.1",),
+) -> ssl.SSLContext:
+    """Server context allowing TLS 1.2+ with session resumption.
+
+    ``session_tickets`` is the number of TLS 1.3 tickets sent after a full
+    handshake (one per connection the client may resume); 0 turns tickets off
+    for TLS 1.2 and 1.3, leaving only OpenSSL's in-memory session-ID cache.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    context.num_tickets = session_tickets
+    if session_tickets <= 0:
+        context.options |= ssl.OP_NO_TICKET
+    context.set_alpn_protocols(list(alpn_protocols))
+    return context
+
+
+class TunedConfig(uvicorn.Config):
+    """uvicorn.Config whose TLS context comes from ssl_context()."""
+
+    def __init__(self, *args, session_tickets: int = 2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session_tickets = session_tickets
+
+    def load(self) -> None:
+        super().load()
+        if self.is_ssl:
+            self.ssl = ssl_context(self.ssl_certfile, self.ssl_keyfile, self.session_tickets)
+
+
+if _HypercornConfig is not None:
+
+    class HypercornConfig(_HypercornConfig):
+        """Hypercorn's Config whose TLS context comes from ssl_context()."""
+
+        session_tickets = 2
+
+        def create_ssl_context(self) -> Optional[ssl.SSLContext]:
+            if not self.ssl_enabled:
+                return None
+            return ssl_context(self.certfile, self.keyfile, self.session_tickets, self.alpn_protocols)
+
+
+def _check_installed(module: str, setting: str) -> None:
+    try:
+        __import__(module)
+    except ImportError:
+        raise RuntimeError(f"{setting} needs the {module} package: pip install {module}") from None
+
+
+def serve(
+    app: str = "main:create_app",
+    host: str = "0.0.0.0",
+    port: int = 9374,
+    workers: int = 1,
+    certfile: Optional[str] = "cert.crt",
+    keyfile: Optional[str] = "private.key",
+    keep_alive: float = 75.0,
+    session_tickets: int = 2,
+    loop: str = "auto",
+    http: str = "auto",
+    http2: bool = False,
+) -> None:
+    """Serve the ``app`` factory over TLS (no TLS when ``certfile`` is empty)."""
+    if loop not in LOOPS:
+        raise ValueError(f"SERVER_LOOP must be one of {', '.join(LOOPS)}")
+    if http not in HTTP_IMPLEMENTATIONS:
+        raise ValueError(f"SERVER_HTTP must be one of {', '.join(HTTP_IMPLEMENTATIONS)}")
+    if loop == "uvloop":
+        _check_installed("uvloop", "SERVER_LOOP=uvloop")
+    if http == "httptools":
+        _check_installed("httptools", "SERVER_HTTP=httptools")
+
+    if http2:
+        _check_installed("hypercorn", "HTTP2")
+        _serve_hypercorn(app, host, port, workers, certfile, keyfile, keep_alive, session_tickets, loop)
+        return
+
+    config = TunedConfig(
+        app,
+        factory=True,
+        host=host,
+        port=port,
+        workers=workers,
+        ssl_certfile=certfile or None,
+        ssl_keyfile=keyfile if certfile else None,
+        timeout_keep_alive=int(keep_alive),
+        session_tickets=session_tickets,
+        loop=loop,
+        http=http,
+        # Leave uvicorn's loggers to propagate into the queue the app's lifespan sets up
+        log_config=None,
+    )
+    server = uvicorn.Server(config)
+    # What uvicorn.run does, with our Config subclass
+    if workers > 1:
+        sock = config.bind_socket()
+        Multiprocess(config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+
+
+def _serve_hypercorn(app, host, port, workers, certfile, keyfile, keep_alive, session_tickets, loop) -> None:
+    from hypercorn.run import run
+
+    config = HypercornConfig()
+    config.session_tickets = session_tickets
+    # Hypercorn calls a factory written as "module:factory()"
+    config.application_path = f"{app}()"
+    config.bind = [f"{host}:{port}"]
+    config.workers = workers
+    config.keep_alive_timeout = keep_alive
+    config.alpn_protocols = ["h2", "http/1.1"]
+    config.worker_class = "uvloop" if loop == "uvloop" else "asyncio"
+    if certfile:
+        config.certfile = certfile
+        config.keyfile = keyfile
+    run(config)
@@ -0,0 +1,292 @@
+import asyncio
+import fcntl
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+
+class TokenBucket:
+    """Reservation-style token bucket: callers learn how long to wait instead of polling."""
+
+    def __init__(self, rate: float, capacity: float, now: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+        self.blocked_until = 0.0
+
+    def reserve(self, now: Optional[float] = None, max_wait: float = math.inf) -> float:
+        """Take one token and return the seconds until it may be used.
+
+        If that is more than ``max_wait`` the token is left in the bucket;
+        the caller sees the (too long) wait and may ask again later.
+        """
+        now = time.monotonic() if now is None else now
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        self.tokens -= 1
+        wait = max(-self.tokens / self.rate if self.tokens < 0 else 0.0, self.blocked_until - now)
+        if wait > max_wait:
+            self.tokens += 1
+        return wait
+
+    def block(self, seconds: float, now: Optional[float] = None) -> None:
+        """Hold every later reservation back for ``seconds`` (e.g. a 429 retry_after)."""
+        now = time.monotonic() if now is None else now
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def idle(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity and now >= self.blocked_until
+
+
+class ExpiringSet:
+    """Hash set of keys with per-key expiry, bounded by a ring buffer of insertions.
+
+    Expired keys are dropped from the front of the ring as new ones arrive, so
+    upkeep is O(1) amortized; past ``capacity`` the oldest keys are evicted early.
+    """
+
+    def __init__(self, capacity: int = 100000):
+        self.capacity = capacity
+        self._expires: Dict[str, float] = {}
+        self._ring: Deque[Tuple[float, str]] = deque()
+
+    def _prune(self, now: float) -> None:
+        ring, expires = self._ring, self._expires
+        while ring and (ring[0][0] <= now or len(ring) > self.capacity):
+            stamp, key = ring.popleft()
+            # Only drop the key if this ring slot is its latest insertion
+            if expires.get(key) == stamp:
+                del expires[key]
+
+    def add(self, key: str, ttl: float, now: float, replace: bool = False) -> bool:
+        self._prune(now)
+        expires = self._expires.get(key)
+        if not replace and expires is not None and expires > now:
+            return False
+        self._expires[key] = now + ttl
+        self._ring.append((now + ttl, key))
+        if len(self._ring) > self.capacity:
+            self._prune(now)
+        return True
+
+    def contains(self, key: str, now: float) -> bool:
+        expires = self._expires.get(key)
+        return expires is not None and expires > now
+
+    def discard(self, key: str) -> None:
+        self._expires.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+
+class MemoryBackend:
+    """Per-process state: expiring keys and token buckets in plain dicts.
+
+    Fine for a single worker; with several workers each keeps its own view.
+    """
+
+    shared = False
+
+    def __init__(self, max_buckets: int = 10000, max_keys: int = 100000):
+        self.max_buckets = max_buckets
+        self._keys = ExpiringSet(max_keys)
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    async def add(self, key: str, ttl: float) -> bool:
+        """Store ``key`` for ``ttl`` seconds; False if it is already present."""
+        return self._keys.add(key, ttl, time.monotonic())
+
+    async def set(self, key: str, ttl: float) -> None:
+        """Store ``key`` for ``ttl`` seconds, replacing any earlier expiry."""
+        self._keys.add(key, ttl, time.monotonic(), replace=True)
+
+    async def contains(self, key: str) -> bool:
+        return self._keys.contains(key, time.monotonic())
+
+    async def discard(self, key: str) -> None:
+        self._keys.discard(key)
+
+    def _bucket(self, key: str, rate: float, capacity: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, capacity)
+            if len(self._buckets) > self.max_buckets:
+                now = time.monotonic()
+                for old in list(self._buckets)[: len(self._buckets) - self.max_buckets]:
+                    if self._buckets[old].idle(now):
+                        del self._buckets[old]
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    async def reserve(self, key: str, rate: float, capacity: float, max_wait: float = math.inf) -> float:
+        """Take a token from bucket ``key``; returns the seconds to wait before using it.
+
+        A wait over ``max_wait`` means no token was taken.
+        """
+        return self._bucket(key, rate, capacity).reserve(max_wait=max_wait)
+
+    async def block(self, key: str, rate: float, capacity: float, seconds: float) -> None:
+        self._bucket(key, rate, capacity).block(seconds)
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLiteBackend:
+    """Shares state between worker processes on one box through a SQLite (WAL) file."""
+
+    shared = True
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS expiring_keys (
+                key TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS token_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                blocked_until REAL NOT NULL
+            );
+        """)
+        self._adds = 0
+
+    def _add(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            added = self._conn.execute(
+                "INSERT INTO expiring_keys (key, expires_at) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at "
+                "WHERE expiring_keys.expires_at <= ?",
+                (key, now + ttl, now),
+            ).rowcount == 1
+            self._adds += 1
+            if self._adds % 1024 == 0:
+                self._conn.execute("DELETE FROM expiring_keys WHERE expires_at <= ?", (now,))
+        return added
+
+    def _set(self, key: str, ttl: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO expiring_keys (key, expires_at) VALUES (?, ?)",
+                (key, time.time() + ttl),
+            )
+
+    def _contains(self, key: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM expiring_keys WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row is not None
+
+    def _discard(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM expiring_keys WHERE key = ?", (key,))
+
+    def _update_bucket(
+        self, key: str, rate: float, capacity: float, block: float = 0.0, max_wait: float = math.inf
+    ) -> float:
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so two workers can't both spend a token
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated, blocked_until FROM token_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                bucket = TokenBucket(rate, capacity, now)
+                if row:
+                    bucket.tokens, bucket.updated, bucket.blocked_until = row
+                if block:
+                    bucket.block(block, now)
+                    wait = 0.0
+                else:
+                    wait = bucket.reserve(now, max_wait)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO token_buckets (key, tokens, updated, blocked_until) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, bucket.tokens, bucket.updated, bucket.blocked_until),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    async def add(self, key: str, ttl: float) -> bool:
+        return await asyncio.to_thread(self._add, key, ttl)
+
+    async def set(self, key: str, ttl: float) -> None:
+        await asyncio.to_thread(self._set, key, ttl)
+
+    async def contains(self, key: str) -> bool:
+        return await asyncio.to_thread(self._contains, key)
+
+    async def discard(self, key: str) -> None:
+        await asyncio.to_thread(self._discard, key)
+
+    async def reserve(self, key: str, rate: float, capacity: float, max_wait: float = math.inf) -> float:
+        return await asyncio.to_thread(self._update_bucket, key, rate, capacity, 0.0, max_wait)
+
+    async def block(self, key: str, rate: float, capacity: float, seconds: float) -> None:
+        await asyncio.to_thread(self._update_bucket, key, rate, capacity, seconds)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_backend(url: str):
+    """``memory`` (default) or ``sqlite:///path/to/state.db``."""
+    if url in ("", "memory"):
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported STATE_BACKEND: {url}")
+
+
+class OwnerLock:
+    """Non-blocking flock held for the life of the process.
+
+    Every worker tries to take it; the one that succeeds owns singleton duties
+    such as consuming Telegram updates. The lock is released when that process exits.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def owned(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
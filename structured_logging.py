@@ -0,0 +1,260 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+# Set per request by CorrelationIdMiddleware; tasks started by the request inherit it
+correlation_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("correlation_id", default=None)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_VALID_REQUEST_ID = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+# Extra fields that are identifiers, not message content
+_PLAIN_FIELDS = {"correlation_id", "chat_id", "user_id", "index", "update_id", "code", "path", "suppressed"}
+
+# Phone numbers first (they contain OTP-sized runs), then OTP-like codes
+_PHONE = re.compile(r"\+?[0-9][0-9 ()-]{6,}[0-9]")
+_CODE = re.compile(r"(?<![0-9A-Za-z])[0-9]{4,8}(?![0-9A-Za-z])|(?<![0-9A-Za-z])[0-9]{3}-[0-9]{3}(?![0-9A-Za-z])")
+
+
+def redact(text: str) -> str:
+    """Mask phone numbers (keeping the last two digits) and OTP-like codes."""
+    text = _PHONE.sub(lambda m: "*" * (len(m.group()) - 2) + m.group()[-2:], text)
+    return _CODE.sub(lambda m: "*" * len(m.group()), text)
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the current correlation ID; runs in the logging caller's context."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "correlation_id"):
+            record.correlation_id = correlation_id.get()
+        return True
+
+
+class RepeatFilter(logging.Filter):
+    """Lets ``burst`` identical records through per ``window`` seconds and drops the rest.
+
+    Records are identical when logger, level, message template and ``error``
+    match. The next record let through after a drop carries ``suppressed``.
+    """
+
+    def __init__(self, burst: int = 5, window: float = 60.0, max_keys: int = 10000):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.max_keys = max_keys
+        self._seen: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.levelno, record.msg, getattr(record, "error", None))
+        now = time.monotonic()
+        with self._lock:
+            state = self._seen.get(key)
+            if state is None or now - state[0] >= self.window:
+                if len(self._seen) >= self.max_keys:
+                    self._seen.clear()
+                suppressed = state[2] if state else 0
+                self._seen[key] = [now, 1, 0]
+            elif state[1] < self.burst:
+                state[1] += 1
+                suppressed = 0
+            else:
+                state[2] += 1
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class _RedactingFormatter(logging.Formatter):
+    """Base of the formatters: the message, ``extra`` fields and traceback with values redacted."""
+
+    def __init__(self, redact_values: bool = True):
+        super().__init__()
+        self.redact_values = redact_values
+
+    def _clean(self, key: str, value):
+        if self.redact_values and isinstance(value, str) and key not in _PLAIN_FIELDS:
+            return redact(value)
+        return value
+
+    def _extras(self, record: logging.LogRecord) -> Dict[str, Any]:
+        return {
+            key: self._clean(key, value) for key, value in vars(record).items()
+            if key not in _RECORD_ATTRS and value is not None and key != "exc_text"
+        }
+
+    def _traceback(self, record: logging.LogRecord) -> Optional[str]:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        return self._clean("exc", record.exc_text) if record.exc_text else None
+
+
+class JsonFormatter(_RedactingFormatter):
+    """One JSON object per line: ts, level, logger, msg, correlation_id and any ``extra`` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": self._clean("msg", record.getMessage()),
+            **self._extras(record),
+        }
+        exc = self._traceback(record)
+        if exc:
+            entry["exc"] = exc
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(_RedactingFormatter):
+    """``time level logger [correlation_id] msg`` and the ``extra`` fields as key=value, redacted alike."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        extras = self._extras(record)
+        line = (
+            f"{self.formatTime(record)} {record.levelname} {record.name} "
+            f"[{extras.pop('correlation_id', None)}] {self._clean('msg', record.getMessage())}"
+        )
+        for key, value in extras.items():
+            text = str(value)
+            if not text or any(c.isspace() or c in '"=' for c in text):
+                text = json.dumps(text, ensure_ascii=False)
+            line += f" {key}={text}"
+        exc = self._traceback(record)
+        return f"{line}\n{exc}" if exc else line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never waits: when the queue is full the record is dropped and counted."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike the default, don't run a formatter here: just resolve the
+        # message and traceback so the record can cross threads
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Stdout:
+    """Whatever sys.stdout is at write time (test runners swap it out)."""
+
+    def write(self, text: str) -> int:
+        return sys.stdout.write(text)
+
+    def flush(self) -> None:
+        sys.stdout.flush()
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(
+    level: str = "INFO",
+    json_format: bool = True,
+    redact_values: bool = True,
+    repeat_burst: int = 5,
+    repeat_window: float = 60.0,
+    queue_size: int = 10000,
+    stream=None,
+) -> DroppingQueueHandler:
+    """Route the root logger through a bounded queue to a background writer thread.
+
+    Calls on the event loop only format the record's context and enqueue it;
+    the JSON encoding and the write to ``stream`` (stdout) happen on the
+    listener thread. Calling it again replaces the previous setup.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    else:
+        atexit.register(shutdown_logging)
+
+    output = logging.StreamHandler(stream or _Stdout())
+    output.setFormatter((JsonFormatter if json_format else TextFormatter)(redact_values))
+
+    handler = DroppingQueueHandler(queue.Queue(queue_size))
+    handler.addFilter(ContextFilter())
+    handler.addFilter(RepeatFilter(repeat_burst, repeat_window))
+
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, DroppingQueueHandler)]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return handler
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class CorrelationIdMiddleware:
+    """ASGI middleware giving each request a correlation ID.
+
+    A valid incoming ``X-Request-ID`` is kept, otherwise a new one is made;
+    it is echoed back in the response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                candidate = value.decode("latin-1")
+                if _VALID_REQUEST_ID.fullmatch(candidate):
+                    request_id = candidate
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        token = correlation_id.set(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            correlation_id.reset(token)
@@ -0,0 +1,83 @@
+import json
+import httpx
+from typing import Any, Dict, Optional
+
+TELEGRAM_API_BASE = "https://api.telegram.org"
+
+
+class TelegramAPIError(Exception):
+    """Raised when the Bot API answers with ``ok: false``."""
+
+    def __init__(self, error_code: int, description: str, retry_after: Optional[float] = None):
+        self.error_code = error_code
+        self.description = description
+        self.retry_after = retry_after
+        super().__init__(
+            f"A request to the Telegram API was unsuccessful. "
+            f"Error code: {error_code}. Description: {description}"
+        )
+
+
+class TelegramSender:
+    """Async Bot API client backed by a pooled keep-alive HTTP connection."""
+
+    def __init__(
+        self,
+        token: str,
+        base_url: str = TELEGRAM_API_BASE,
+        max_connections: int = 32,
+        timeout: float = 10.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self._url = f"{base_url.rstrip('/')}/bot{token}"
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            transport=transport,
+        )
+
+    async def call(self, method: str, files: Optional[Dict[str, Any]] = None, **params: Any) -> Any:
+        """Invoke a Bot API method and return its ``result`` field.
+
+        With ``files`` the request is sent as multipart form data (e.g. a webhook certificate).
+        """
+        payload = {key: value for key, value in params.items() if value is not None}
+        if files:
+            form = {
+                key: value if isinstance(value, str) else json.dumps(value)
+                for key, value in payload.items()
+            }
+            response = await self._client.post(f"{self._url}/{method}", data=form, files=files)
+        else:
+            response = await self._client.post(f"{self._url}/{method}", json=payload)
+        try:
+            data = response.json()
+        except ValueError:
+            raise TelegramAPIError(response.status_code, response.text or response.reason_phrase)
+
+        if not data.get("ok"):
+            parameters = data.get("parameters") or {}
+            raise TelegramAPIError(
+                data.get("error_code", response.status_code),
+                data.get("description", "Unknown error"),
+                parameters.get("retry_after"),
+            )
+        return data.get("result")
+
+    async def send_message(
+        self, chat_id: str, text: str, parse_mode: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return await self.call("sendMessage", chat_id=chat_id, text=text, parse_mode=parse_mode)
+
+    async def edit_message_text(
+        self, chat_id: str, message_id: int, text: str, parse_mode: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return await self.call(
+            "editMessageText", chat_id=chat_id, message_id=message_id, text=text, parse_mode=parse_mode
+        )
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
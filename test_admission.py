@@ -0,0 +1,197 @@
+import asyncio
+import os
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from admission import AdmissionControl, Capacity, Overloaded
+from auth import Device, KeyStore
+from delivery import DeliveryEngine, RejectedEntry
+from delivery_queue import DeliveryQueue, QueueWorkers
+from test_auth import KeysFileTestCase, collect, iterate
+from test_delivery import FakeSender
+
+
+class TestCapacity(unittest.IsolatedAsyncioTestCase):
+    async def test_waiters_served_in_order(self):
+        capacity = Capacity(3)
+        self.assertTrue(await capacity.acquire(2))
+        big = asyncio.create_task(capacity.acquire(3))
+        small = asyncio.create_task(capacity.acquire(1))
+        await asyncio.sleep(0)
+        # The single unit left goes to nobody: the big request came first
+        self.assertFalse(small.done())
+        capacity.release(2)
+        self.assertTrue(await big)
+        capacity.release(3)
+        self.assertTrue(await small)
+        self.assertEqual(capacity.used, 1)
+
+    async def test_timeout(self):
+        capacity = Capacity(1)
+        await capacity.acquire()
+        self.assertFalse(await capacity.acquire(1, 0.01))
+        self.assertFalse(await capacity.acquire(1, 0))
+        self.assertEqual(capacity.waiting, 0)
+        capacity.release()
+        self.assertTrue(await capacity.acquire(1, 0))
+
+
+class TestAdmissionControl(unittest.IsolatedAsyncioTestCase):
+    async def test_per_key_cap(self):
+        control = AdmissionControl(max_batches=10, per_key=1, timeout=0.01)
+        ticket = await control.admit(Device("pixel"))
+        with self.assertRaises(Overloaded) as raised:
+            await control.admit(Device("pixel"))
+        self.assertEqual((raised.exception.status_code, raised.exception.retry_after), (429, 1))
+        # Other keys aren't held back, and a key's own limit wins
+        await control.admit(Device("office", max_concurrent=2))
+        await control.admit(Device("office", max_concurrent=2))
+        ticket.release()
+        ticket.release()
+        await control.admit(Device("pixel"))
+        self.assertEqual(control.rejected["key"], 1)
+
+    async def test_server_cap(self):
+        control = AdmissionControl(max_batches=1, timeout=0.05)
+        ticket = await control.admit(Device("a"))
+        waiting = asyncio.create_task(control.admit(Device("b")))
+        await asyncio.sleep(0.01)
+        ticket.release()
+        (await waiting).release()
+        await control.admit(Device("c"))
+        with self.assertRaises(Overloaded) as raised:
+            await control.admit(Device("d"))
+        self.assertEqual(raised.exception.status_code, 503)
+
+    async def test_entries_take_a_unit_per_recipient(self):
+        control = AdmissionControl(max_sends=3, timeout=0.01)
+        ticket = await control.admit(Device("a"))
+        entries = await collect(ticket.entries(iterate([
+            {"ids": "1,2", "sms": "a"}, {"ids": "3", "sms": "b"}, {"ids": "4", "sms": "c"},
+        ])))
+        self.assertEqual(entries[2], RejectedEntry("Server busy, too many sends in progress", 1))
+        self.assertEqual((ticket.rejected, control.sends.used), (1, 3))
+        ticket.done(0)
+        self.assertEqual(control.sends.used, 2)
+        ticket.release()
+        self.assertEqual((control.sends.used, control.batches.used), (0, 0))
+
+    async def test_done_gives_back_what_the_entry_took(self):
+        control = AdmissionControl(max_sends=4, timeout=0.01)
+        ticket = await control.admit(Device("a"))
+        await collect(ticket.entries(iterate([
+            {"ids": "1,2,3"}, {"ids": "4", "sms": "a"}, {"ids": "5", "sms": "b"},
+        ])))
+        self.assertEqual(control.sends.used, 4)
+        # The refused entry's failure doesn't free a unit another send holds
+        ticket.done(2, whole=True)
+        self.assertEqual(control.sends.used, 4)
+        # A validation failure frees every unit of its entry
+        ticket.done(0, whole=True)
+        self.assertEqual(control.sends.used, 1)
+        ticket.done(1)
+        ticket.done(1)
+        self.assertEqual((control.sends.used, ticket.sends), (0, 0))
+
+
+class TestAdmissionEndpoint(KeysFileTestCase):
+    def setUp(self):
+        super().setUp()
+        from fastapi.testclient import TestClient
+        import main
+
+        self.main = main
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.sender = FakeSender()
+        main.app.state.delivery = DeliveryEngine(self.sender, main.format_message)
+        main.app.state.keys = KeyStore(self.path, main.AUTH_KEY)
+        main.app.state.keys.load()
+        self.admission = main.app.state.admission = AdmissionControl(max_batches=2, max_sends=2, timeout=0.05)
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        super().tearDown()
+
+    def post(self, body, **headers):
+        headers = {"X-Auth-Key": self.main.AUTH_KEY, **headers}
+        return self.client.post("/receive_data", headers=headers, json=body)
+
+    def test_releases_after_each_response(self):
+        self.assertEqual(self.post([{"ids": "1,2", "sms": "a"}, {"ids": "3", "sms": "b"}]).status_code, 200)
+        response = self.post([{"ids": "4", "sms": "c"}], Accept="application/x-ndjson")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((self.admission.batches.used, self.admission.sends.used), (0, 0))
+        self.assertEqual(len(self.sender.sent), 4)
+
+    def test_batch_larger_than_send_cap(self):
+        # Units come back as sends finish, so the batch only pauses
+        response = self.post([{"ids": str(i), "sms": "a"} for i in range(5)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.sender.sent), 5)
+
+    def test_invalid_entry_gives_back_all_its_units(self):
+        response = self.post([{"ids": "1,2"}, {"ids": "3,4", "sms": "a"}])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(len(self.sender.sent), 2)
+
+    def test_queued_batch_takes_no_units(self):
+        queue = DeliveryQueue(os.path.join(self.tmp.name, "queue.db"))
+        self.main.app.state.queue = QueueWorkers(queue, self.main.app.state.delivery)
+        response = self.post([{"ids": str(i), "sms": "a"} for i in range(5)], Prefer="respond-async")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((len(response.json()["messages"]), response.json()["failed"]), (5, []))
+        self.assertEqual(queue.depth(), 5)
+        self.assertEqual(self.admission.sends.used, 0)
+
+    def test_merged_batch_takes_units_per_send(self):
+        self.main.app.state.delivery = DeliveryEngine(self.sender, self.main.format_message, merge=True)
+        response = self.post([{"ids": str(i), "sms": "a"} for i in range(5)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.sender.sent), 5)
+        self.assertEqual(self.admission.sends.used, 0)
+
+    def test_merged_batch_without_room(self):
+        self.main.app.state.delivery = DeliveryEngine(self.sender, self.main.format_message, merge=True)
+        self.admission.sends.used = 2
+        response = self.post([{"ids": "1", "sms": "a"}])
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["details"], [
+            {"index": 0, "user_id": "1", "error": "Server busy, too many sends in progress", "retry_after": 1},
+        ])
+
+    def test_server_busy(self):
+        self.admission.batches.used = 2
+        response = self.post([{"ids": "1", "sms": "a"}])
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+    def test_no_room_for_sends(self):
+        self.admission.sends.used = 2
+        parse = self.main.app.state.metrics.parse
+        parsed = parse.sum
+        response = self.post([{"ids": "1", "sms": "a"}])
+        self.assertEqual(response.status_code, 503)
+        # The wait for send units isn't counted as parsing
+        self.assertLess(parse.sum - parsed, 0.04)
+        self.assertEqual(response.json()["details"], [
+            {"index": 0, "error": "Server busy, too many sends in progress", "retry_after": 1},
+        ])
+        self.assertEqual(self.sender.sent, [])
+        self.assertEqual(self.admission.batches.used, 0)
+
+    def test_key_cap(self):
+        self.write([{"name": "pixel", "key": "pixel-key", "max_concurrent": 1}], mtime=2 * 10 ** 18)
+        self.main.app.state.keys.load()
+        self.admission._key_capacity(Device("pixel", max_concurrent=1)).used = 1
+        response = self.post([{"ids": "1", "sms": "a"}], **{"X-Auth-Key": "pixel-key"})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()["retry_after"], 1)
+        self.assertEqual(self.post([{"ids": "1", "sms": "a"}]).status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
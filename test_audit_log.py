@@ -0,0 +1,163 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from audit_log import INDEX_EVERY, RECORD, AuditLog, AuditRecord, chat_key, entry_hash
+from auth import KeyStore
+from delivery import DeliveryEngine
+from test_auth import KeysFileTestCase
+from test_delivery import FakeSender
+
+
+def make_record(ts, chat="1", status="sent"):
+    chat, flags = chat_key(chat)
+    return AuditRecord(ts, chat, 7, 0.25, entry_hash("text"), 0, status, flags)
+
+
+class TestAuditLog(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log = AuditLog(self.tmp.name, segment_bytes=8 + 1000 * RECORD.size)
+
+    async def asyncTearDown(self):
+        await self.log.close()
+        self.tmp.cleanup()
+
+    async def test_round_trip(self):
+        self.log.record("42", "sent", "Code `1234`", latency=0.0125, message_id=99)
+        self.log.record("@Channel", "failed", "x", error_code=403)
+        await self.log.flush()
+        records, truncated = self.log.query()
+        self.assertFalse(truncated)
+        first = records[0].to_json()
+        self.assertEqual(first["chat_id"], "42")
+        self.assertEqual((first["status"], first["message_id"], first["latency_ms"]), ("sent", 99, 12.5))
+        self.assertEqual(first["entry_hash"], entry_hash("Code `1234`").hex())
+        self.assertEqual(records[1].status, "failed")
+        self.assertEqual(records[1].error_code, 403)
+        # Usernames are stored hashed, case-insensitively
+        self.assertEqual(len(self.log.query(chat_id="@channel")[0]), 1)
+
+    async def test_time_range_and_chat(self):
+        batch = [make_record(1000 + i, chat=str(i % 3)) for i in range(2500)]
+        await self._write(batch)
+        # 2500 records across three segments
+        self.assertEqual(len([n for n in os.listdir(self.tmp.name) if n.endswith(".seg")]), 3)
+
+        records, _ = self.log.query(since=1995, until=2005, limit=100)
+        self.assertEqual([r.time for r in records], [float(t) for t in range(1995, 2005)])
+        records, _ = self.log.query(since=1000, until=1010, chat_id="1")
+        self.assertEqual([r.time for r in records], [1001.0, 1004.0, 1007.0])
+
+        records, truncated = self.log.query(limit=INDEX_EVERY)
+        self.assertTrue(truncated)
+        self.assertEqual(len(records), INDEX_EVERY)
+
+    async def test_keeps_newest_segments(self):
+        self.log.keep_segments = 2
+        await self._write([make_record(1000 + i) for i in range(3500)])
+        self.assertEqual(len([n for n in os.listdir(self.tmp.name) if n.endswith(".seg")]), 2)
+        records, _ = self.log.query()
+        # 3500 records filled four segments; the first two are gone
+        self.assertEqual(records[0].time, 3000.0)
+
+    async def test_workers_share_directory(self):
+        other = AuditLog(self.tmp.name)
+        await self._write([make_record(1000 + 2 * i) for i in range(5)])
+        with patch("os.getpid", return_value=1):
+            other._write([make_record(1001 + 2 * i) for i in range(5)])
+        other._file.close()
+        other._index.close()
+        records, truncated = self.log.query(since=1002, limit=6)
+        self.assertEqual([r.time for r in records], [float(t) for t in range(1002, 1008)])
+        self.assertTrue(truncated)
+
+    async def test_drops_when_full(self):
+        self.log.max_pending = 2
+        for _ in range(3):
+            self.log.record("1", "sent", "x")
+        self.assertEqual(self.log.dropped, 1)
+
+    async def test_number_beyond_64_bits_is_hashed(self):
+        self.log.record("123456789012345678901234", "sent", "x")
+        await self.log.flush()
+        self.assertEqual(len(self.log.query(chat_id="123456789012345678901234")[0]), 1)
+        self.assertEqual(self.log.query()[0][0].to_json()["chat_id"][0], "@")
+
+    async def test_writer_survives_unexpected_errors(self):
+        self.log.flush_interval = 0.01
+        self.log.start()
+        with patch.object(self.log, "_write", side_effect=ValueError("boom")):
+            self.log.record("1", "sent", "x")
+            with self.assertLogs("audit_log", "ERROR"):
+                await asyncio.sleep(0.05)
+        self.assertEqual(self.log.dropped, 1)
+        self.log.record("2", "sent", "y")
+        await asyncio.sleep(0.05)
+        self.assertFalse(self.log._task.done())
+        self.assertEqual(self.log.written, 1)
+
+    async def _write(self, batch):
+        await asyncio.to_thread(self.log._write, batch)
+
+
+class TestEngineAudit(unittest.IsolatedAsyncioTestCase):
+    async def test_records_outcomes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            log = AuditLog(tmp)
+            engine = DeliveryEngine(FakeSender(failing={"2"}), lambda data: data["sms"], audit=log)
+            await engine.deliver([{"ids": "1,2", "sms": "a"}])
+            await log.close()
+            records = sorted(log.query()[0], key=lambda r: r.chat)
+        self.assertEqual([(r.chat, r.status, r.message_id, r.error_code) for r in records], [
+            (1, "sent", 1, 0), (2, "failed", 0, 400),
+        ])
+
+
+class TestAuditEndpoint(KeysFileTestCase):
+    def setUp(self):
+        super().setUp()
+        from fastapi.testclient import TestClient
+        import main
+
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        main.app.state.audit = AuditLog(os.path.join(self.tmp.name, "audit"))
+        main.app.state.delivery = DeliveryEngine(FakeSender(), main.format_message, audit=main.app.state.audit)
+        main.app.state.keys = KeyStore(self.path, main.AUTH_KEY)
+        main.app.state.keys.load()
+        self.main = main
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        self.main.app.state.audit = None
+        super().tearDown()
+
+    def get(self, key, **params):
+        return self.client.get("/audit", headers={"X-Auth-Key": key}, params=params)
+
+    def test_query(self):
+        key = self.main.AUTH_KEY
+        self.client.post("/receive_data", headers={"X-Auth-Key": key}, json=[{"ids": "7,8", "sms": "a"}])
+        response = self.get(key, chat_id="8", since="2000-01-01T00:00:00")
+        self.assertEqual(response.status_code, 200)
+        records = response.json()["records"]
+        self.assertEqual([(r["chat_id"], r["status"]) for r in records], [("8", "sent")])
+        self.assertEqual(self.get(key, until="1").json()["records"], [])
+        self.assertEqual(self.get(key, since="yesterday").status_code, 400)
+
+    def test_restricted_key(self):
+        self.assertEqual(self.get("pixel-key").status_code, 403)
+        self.assertEqual(self.get("pixel-key", chat_id="8").status_code, 403)
+        self.assertEqual(self.get("pixel-key", chat_id="7").status_code, 200)
+        self.assertEqual(self.get("wrong").status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
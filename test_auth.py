@@ -0,0 +1,163 @@
+import json
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from auth import Device, KeyStore, hash_key, restrict_chats
+from delivery import DeliveryEngine, RejectedEntry
+from test_delivery import FakeSender
+
+
+async def collect(entries):
+    return [entry async for entry in entries]
+
+
+async def iterate(items):
+    for item in items:
+        yield item
+
+
+class KeysFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "keys.json")
+        self.write([
+            {"name": "pixel", "key": "pixel-key", "chats": ["052504904", "7"], "max_batch": 2},
+            {"name": "hashed", "key_sha256": hash_key("secret"), "rate": 1, "burst": 2},
+        ])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, keys, mtime=None):
+        with open(self.path, "w") as f:
+            json.dump({"keys": keys}, f)
+        if mtime is not None:
+            os.utime(self.path, ns=(mtime, mtime))
+
+
+class TestKeyStore(KeysFileTestCase):
+    def test_authenticate(self):
+        store = KeyStore(self.path, fallback_key="shared")
+        self.assertTrue(store.load())
+        self.assertEqual(store.authenticate("pixel-key").name, "pixel")
+        self.assertEqual(store.authenticate("secret").name, "hashed")
+        self.assertEqual(store.authenticate("shared"), Device("default"))
+        self.assertIsNone(store.authenticate("wrong"))
+        self.assertIsNone(store.authenticate(None))
+        self.assertEqual(len(store), 3)
+
+    def test_allowed_chats_are_normalized(self):
+        store = KeyStore(self.path)
+        store.load()
+        device = store.authenticate("pixel-key")
+        self.assertTrue(device.allows("52504904"))
+        self.assertFalse(device.allows("8"))
+
+    def test_reload_on_change(self):
+        self.write([{"name": "a", "key": "k1"}], mtime=1_000_000_000)
+        store = KeyStore(self.path)
+        store.load()
+        self.assertFalse(store.load())
+
+        self.write([{"name": "b", "key": "k2"}], mtime=2_000_000_000)
+        self.assertTrue(store.load())
+        self.assertIsNone(store.authenticate("k1"))
+        self.assertEqual(store.authenticate("k2").name, "b")
+
+    def test_broken_file_keeps_keys(self):
+        store = KeyStore(self.path)
+        store.load()
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        os.utime(self.path, ns=(3_000_000_000, 3_000_000_000))
+        self.assertFalse(store.load())
+        self.assertEqual(store.authenticate("pixel-key").name, "pixel")
+
+    def test_invalid_entries_keep_keys(self):
+        store = KeyStore(self.path)
+        store.load()
+        for n, keys in enumerate([
+            [{"name": "a", "key": "k1", "max_batch": None}],
+            [{"name": "a", "key": "k1", "rate": [1]}],
+            [{"name": "a", "key": "k1", "chats": "7"}],
+            [{"name": "a", "key_sha256": 5}],
+            # Two keys of one name would share their admission capacity and quotas
+            [{"name": "a", "key": "k1"}, {"name": "a", "key": "k2"}],
+        ]):
+            self.write(keys, mtime=(4 + n) * 10 ** 9)
+            with self.assertLogs("auth", "WARNING"):
+                self.assertFalse(store.load())
+        self.assertEqual(store.authenticate("pixel-key").name, "pixel")
+
+    def test_rate_quota(self):
+        store = KeyStore(self.path)
+        store.load()
+        device = store.authenticate("secret")
+        self.assertEqual(store.admit(device, now=0), 0)
+        self.assertEqual(store.admit(device, now=0), 0)
+        self.assertAlmostEqual(store.admit(device, now=0), 1.0)
+        # A refused batch doesn't push the next slot further out
+        self.assertAlmostEqual(store.admit(device, now=0.5), 0.5)
+        self.assertEqual(store.admit(device, now=1.0), 0)
+
+
+class TestRestrictChats(unittest.IsolatedAsyncioTestCase):
+    async def test_rejects_other_chats(self):
+        device = Device("d", chats=frozenset({"1", "2"}))
+        entries = await collect(restrict_chats(iterate([
+            {"ids": "1,2", "sms": "a"},
+            {"ids": "1,3", "sms": "b"},
+        ]), device))
+        self.assertEqual(entries[0], {"ids": "1,2", "sms": "a"})
+        self.assertEqual(entries[1], RejectedEntry("Chat 3 is not allowed for this key"))
+
+
+class TestDeviceEndpoint(KeysFileTestCase):
+    def setUp(self):
+        super().setUp()
+        from fastapi.testclient import TestClient
+        import main
+
+        self.main = main
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.sender = FakeSender()
+        main.app.state.delivery = DeliveryEngine(self.sender, main.format_message)
+        main.app.state.keys = KeyStore(self.path, main.AUTH_KEY)
+        main.app.state.keys.load()
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        super().tearDown()
+
+    def post(self, key, body):
+        return self.client.post("/receive_data", headers={"X-Auth-Key": key}, json=body)
+
+    def test_allowed_chats(self):
+        response = self.post("pixel-key", [{"ids": "7", "sms": "a"}, {"ids": "8", "sms": "b"}])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()["failed"], [{"index": 1, "error": "Chat 8 is not allowed for this key"}])
+        self.assertEqual(self.sender.sent, [("7", "a")])
+
+    def test_max_batch(self):
+        response = self.post("pixel-key", [{"ids": "7", "sms": str(i)} for i in range(3)])
+        # Entries before the limit are already sent, as with MAX_BATCH_ENTRIES
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()["failed"], [{"index": 2, "error": "Too many entries in batch (max 2)"}])
+
+    def test_rate_limited_key(self):
+        statuses = [self.post("secret", [{"ids": "1", "sms": "a"}]).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_shared_key_still_works(self):
+        self.assertEqual(self.post(self.main.AUTH_KEY, [{"ids": "8", "sms": "a"}]).status_code, 200)
+        self.assertEqual(self.post("wrong", [{"ids": "8", "sms": "a"}]).status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from batch_plan import normalize_chat_id, plan_batch
+from delivery import DeliveryEngine
+from test_delivery import FakeSender
+
+
+def summary(sends):
+    return [(s.chat_id, s.text, [(o.index, o.user_id) for o in s.origins]) for s in sends]
+
+
+class TestPlanBatch(unittest.TestCase):
+    def test_normalize_chat_id(self):
+        self.assertEqual(normalize_chat_id(" 052504904 "), "52504904")
+        self.assertEqual(normalize_chat_id("-100123"), "-100123")
+        self.assertEqual(normalize_chat_id("INVALID_BOT_ID"), "INVALID_BOT_ID")
+
+    def test_identical_texts_are_sent_once(self):
+        sends = plan_batch([
+            (0, ["1", "2", "1"], "a", None),
+            (1, ["01"], "a", None),
+            (2, ["1"], "b", None),
+        ])
+        self.assertEqual(summary(sends), [
+            ("1", "a", [(0, "1"), (0, "1"), (1, "01")]),
+            ("2", "a", [(0, "2")]),
+            ("1", "b", [(2, "1")]),
+        ])
+
+    def test_merge_respects_limit(self):
+        sends = plan_batch([
+            (0, ["1"], "a" * 10, None),
+            (1, ["1"], "b" * 10, None),
+            (2, ["1"], "c" * 10, None),
+            (3, ["2"], "d", None),
+        ], merge=True, limit=22)
+        self.assertEqual(summary(sends), [
+            ("1", "a" * 10 + "\n\n" + "b" * 10, [(0, "1"), (1, "1")]),
+            ("1", "c" * 10, [(2, "1")]),
+            ("2", "d", [(3, "2")]),
+        ])
+
+
+class TestCoalescedDelivery(unittest.IsolatedAsyncioTestCase):
+    async def test_results_fan_out_to_every_origin(self):
+        sender = FakeSender(failing={"bad"})
+        engine = DeliveryEngine(sender, lambda data: data["sms"])
+        report = await engine.deliver([
+            {"ids": "1,1,bad", "sms": "a"},
+            {"sms": "no ids"},
+            {"ids": "1", "sms": "a"},
+        ])
+
+        self.assertEqual(sender.sent, [("1", "a")])
+        self.assertEqual(report.successful, [
+            {"index": 0, "user_id": "1"}, {"index": 0, "user_id": "1"}, {"index": 2, "user_id": "1"},
+        ])
+        self.assertEqual([(f["index"], f.get("user_id")) for f in report.failed], [(0, "bad"), (1, None)])
+
+    async def test_merge(self):
+        sender = FakeSender()
+        engine = DeliveryEngine(sender, lambda data: data["sms"], merge=True)
+        report = await engine.deliver([{"ids": "1", "sms": "a"}, {"ids": "1", "sms": "b"}])
+        self.assertEqual(sender.sent, [("1", "a\n\nb")])
+        self.assertEqual(len(report.successful), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
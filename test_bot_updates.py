@@ -0,0 +1,95 @@
+import json
+import os
+import unittest
+
+import httpx
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from bot_updates import SECRET_HEADER, UpdateDispatcher, handle_update, register_webhook
+from telegram_sender import TelegramSender
+
+UPDATE = {
+    "update_id": 1,
+    "message": {"message_id": 5, "chat": {"id": 42}, "from": {"id": 42}, "text": "hi"},
+}
+
+
+class RecordingSender:
+    def __init__(self):
+        self.calls = []
+
+    async def call(self, method, files=None, **params):
+        self.calls.append((method, params))
+        return True
+
+
+class TestHandleUpdate(unittest.IsolatedAsyncioTestCase):
+    async def test_replies_with_user_id(self):
+        sender = RecordingSender()
+        await handle_update(sender, UPDATE)
+        self.assertEqual(sender.calls, [("sendMessage", {
+            "chat_id": 42, "text": "Your Telegram ID is: 42", "reply_to_message_id": 5,
+        })])
+
+    async def test_ignores_non_messages(self):
+        sender = RecordingSender()
+        await handle_update(sender, {"update_id": 2, "edited_message": {}})
+        self.assertEqual(sender.calls, [])
+
+    async def test_dispatcher_runs_in_background(self):
+        sender = RecordingSender()
+        dispatcher = UpdateDispatcher(sender)
+        dispatcher.dispatch(UPDATE)
+        self.assertEqual(sender.calls, [])
+        await dispatcher.drain()
+        self.assertEqual(len(sender.calls), 1)
+
+    async def test_register_webhook(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={"ok": True, "result": True})
+
+        sender = TelegramSender("123:TEST", transport=httpx.MockTransport(handler))
+        await register_webhook(sender, "https://example.com/telegram/webhook", "s3cret")
+        await sender.aclose()
+
+        self.assertTrue(requests[0].url.path.endswith("/setWebhook"))
+        self.assertEqual(json.loads(requests[0].content)["secret_token"], "s3cret")
+
+
+class TestWebhookEndpoint(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        import main
+
+        self.main = main
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.sender = RecordingSender()
+        main.app.state.updates = UpdateDispatcher(self.sender)
+        self.bot_mode, main.BOT_MODE = main.BOT_MODE, "webhook"
+
+    def tearDown(self):
+        self.main.BOT_MODE = self.bot_mode
+        self.client.__exit__(None, None, None)
+
+    def test_rejects_bad_secret(self):
+        response = self.client.post("/telegram/webhook", json=UPDATE, headers={SECRET_HEADER: "nope"})
+        self.assertEqual(response.status_code, 401)
+
+    def test_accepts_update(self):
+        response = self.client.post(
+            "/telegram/webhook", json=UPDATE, headers={SECRET_HEADER: self.main.WEBHOOK_SECRET}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.client.portal.call(self.main.app.state.updates.drain)
+        self.assertEqual(self.sender.calls[0][0], "sendMessage")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,11 @@
 # Unit tests
+import base64
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 import dotenv
 
-from aes256cipher import AES256Cipher
+from aes256cipher import AES256Cipher, KeyCache
 
 
 class TestAES256Cipher(unittest.TestCase):
@@ -55,5 +58,89 @@ Received on SIM: 1
         self.assertEqual(original_text, decrypted)
 
 
+class TestKeyCache(unittest.TestCase):
+    def test_lru_eviction_zeroizes(self):
+        cache = KeyCache(maxsize=2)
+        cache.put(b"s", b"salt1", b"k" * 32)
+        held = cache._entries[cache._cache_key(b"s", b"salt1")][0]
+        cache.put(b"s", b"salt2", b"k" * 32)
+        cache.put(b"s", b"salt3", b"k" * 32)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(b"s", b"salt1"))
+        self.assertEqual(held, bytearray(32))
+
+    def test_ttl_expiry(self):
+        cache = KeyCache(ttl=0.01)
+        cache.put(b"s", b"salt", b"k" * 32)
+        self.assertEqual(cache.get(b"s", b"salt"), b"k" * 32)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(b"s", b"salt"))
+
+    def test_keyed_by_secret(self):
+        cache = KeyCache()
+        cache.put(b"s1", b"salt", b"k" * 32)
+        self.assertIsNone(cache.get(b"s2", b"salt"))
+
+    def test_session_reuses_salt(self):
+        cache = KeyCache()
+        cipher = AES256Cipher("secret", key_cache=cache, session_ttl=60)
+        first = base64.b64decode(cipher.encrypt("one"))
+        second = base64.b64decode(cipher.encrypt("two"))
+        self.assertEqual(first[:16], second[:16])
+        self.assertNotEqual(first[16:28], second[16:28])
+        self.assertEqual(len(cache), 1)
+
+        cipher.end_session()
+        self.assertEqual(len(cache), 0)
+
+    def test_wire_compatible_without_cache(self):
+        sender = AES256Cipher("secret", key_cache=KeyCache(), session_ttl=60)
+        receiver = AES256Cipher("secret", key_cache=None)
+        for text in ("one", "验证码是828627"):
+            self.assertEqual(receiver.decrypt(sender.encrypt(text)), text)
+
+
+
+class TestBatchAPI(unittest.TestCase):
+    def setUp(self):
+        self.cipher = AES256Cipher("secret", key_cache=KeyCache())
+        self.texts = ["one", "", "验证码是828627", "x" * 5000]
+
+    def test_round_trip(self):
+        tokens = list(self.cipher.encrypt_many(self.texts))
+        self.assertEqual(list(self.cipher.decrypt_many(tokens)), self.texts)
+        # Same wire format as the single-item calls, both ways
+        self.assertEqual([self.cipher.decrypt(t) for t in tokens], self.texts)
+        singles = [self.cipher.encrypt(t) for t in self.texts]
+        self.assertEqual(list(AES256Cipher("secret", key_cache=None).decrypt_many(singles)), self.texts)
+
+    def test_one_salt_per_call(self):
+        tokens = [base64.b64decode(t) for t in self.cipher.encrypt_many(self.texts)]
+        self.assertEqual({t[:16] for t in tokens}, {tokens[0][:16]})
+        self.assertEqual(len({t[16:28] for t in tokens}), len(tokens))
+
+    def test_lazy(self):
+        def texts():
+            yield "one"
+            raise AssertionError("read too far")
+
+        self.assertIsNotNone(next(self.cipher.encrypt_many(texts())))
+
+    def test_thread_pool_keeps_order(self):
+        texts = [str(i) for i in range(200)]
+        with ThreadPoolExecutor(4) as executor:
+            tokens = list(self.cipher.encrypt_many(texts, executor=executor, prefetch=8))
+            self.assertEqual(list(self.cipher.decrypt_many(tokens, executor=executor, prefetch=8)), texts)
+
+    def test_errors(self):
+        tokens = [self.cipher.encrypt("ok"), AES256Cipher("other").encrypt("no"), "AAAA"]
+        results = list(self.cipher.decrypt_many(tokens, return_exceptions=True))
+        self.assertEqual(results[0], "ok")
+        self.assertIsInstance(results[1], Exception)
+        self.assertIsInstance(results[2], ValueError)
+        with self.assertRaises(Exception):
+            list(self.cipher.decrypt_many(tokens))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,158 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import httpx
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from delivery import DeliveryEngine
+from delivery_queue import DeliveryQueue, QueueWorkers
+from rate_limiter import DeliveryScheduler
+from telegram_sender import TelegramAPIError
+from test_delivery import FakeSender
+from test_rate_limiter import ScriptedSender
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, window=10, open_seconds=5, clock=self.clock)
+
+    def fail(self, times=1):
+        for _ in range(times):
+            self.breaker.record(False, self.breaker.acquire())
+
+    def test_opens_on_failure_rate(self):
+        self.breaker.record(True)
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CLOSED)  # 3 calls, below min_calls
+        self.fail()
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError) as error:
+            self.breaker.acquire()
+        self.assertEqual(error.exception.retry_after, 5)
+
+    def test_old_failures_leave_the_window(self):
+        self.fail(3)
+        self.clock.now = 11
+        self.breaker.record(True)
+        self.fail()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_probe_closes(self):
+        self.fail(4)
+        self.clock.now = 5
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        probe = self.breaker.acquire()
+        self.assertTrue(probe)
+        # Only one probe at a time
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.acquire()
+        self.breaker.record(True, probe)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertFalse(self.breaker.acquire())
+
+    def test_failed_probe_reopens(self):
+        self.fail(4)
+        self.clock.now = 5
+        self.breaker.record(False, self.breaker.acquire())
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.retry_after(), 5)
+
+    def test_cancelled_probe_frees_its_slot(self):
+        self.fail(4)
+        self.clock.now = 5
+        self.breaker.record(None, self.breaker.acquire())
+        self.assertTrue(self.breaker.acquire())
+
+
+class TestSchedulerBreaker(unittest.IsolatedAsyncioTestCase):
+    async def test_outage_fails_fast(self):
+        errors = [TelegramAPIError(502, "Bad Gateway")] * 2 + [httpx.ConnectError("down")] * 2
+        sender = ScriptedSender(errors)
+        breaker = CircuitBreaker(min_calls=4, open_seconds=60)
+        scheduler = DeliveryScheduler(sender, max_retries=0, breaker=breaker)
+
+        for _ in range(4):
+            with self.assertRaises((TelegramAPIError, httpx.HTTPError)):
+                await scheduler.send_message("1", "hi")
+        with self.assertRaises(CircuitOpenError):
+            await scheduler.send_message("1", "hi")
+        self.assertEqual(sender.calls, 4)
+
+    async def test_client_errors_are_not_outages(self):
+        sender = ScriptedSender([TelegramAPIError(400, "Bad Request: chat not found")] * 4)
+        breaker = CircuitBreaker(min_calls=4)
+        scheduler = DeliveryScheduler(sender, breaker=breaker)
+        for _ in range(4):
+            with self.assertRaises(TelegramAPIError):
+                await scheduler.send_message("1", "hi")
+        self.assertEqual(breaker.state, CLOSED)
+
+
+class TestQueueRelease(unittest.TestCase):
+    def test_release_keeps_attempts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = DeliveryQueue(os.path.join(tmp, "queue.db"))
+            queue.enqueue([("m1", 0, ["1"], "hi")])
+            seq, _, _, attempts, _ = queue.claim()
+            queue.release(seq, 0)
+            self.assertEqual(queue.claim()[3], attempts)
+            queue.close()
+
+
+class TestCircuitEndpoint(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        import main
+
+        self.main = main
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.sender = FakeSender()
+        main.app.state.delivery = DeliveryEngine(self.sender, main.format_message)
+        self.breaker = main.app.state.breaker = CircuitBreaker(min_calls=1, open_seconds=30)
+        self.breaker.record(False)
+        self.headers = {"X-Auth-Key": main.AUTH_KEY}
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+
+    def test_open_circuit_fails_fast(self):
+        response = self.client.post("/receive_data", headers=self.headers, json=[{"ids": "1", "sms": "hi"}])
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "30")
+        self.assertEqual(self.sender.sent, [])
+
+    def test_open_circuit_buffers_in_queue(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = DeliveryQueue(os.path.join(tmp, "queue.db"))
+            self.main.app.state.queue = QueueWorkers(queue, self.main.app.state.delivery, breaker=self.breaker)
+            try:
+                with mock.patch.object(self.main, "BREAKER_BUFFER", True):
+                    response = self.client.post(
+                        "/receive_data", headers=self.headers, json=[{"ids": "1", "sms": "hi"}]
+                    )
+            finally:
+                self.main.app.state.queue = None
+                queue.close()
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(response.json()["buffered"])
+        self.assertEqual(self.sender.sent, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from dedup import DedupIndex, entry_fingerprint
+from delivery import DeliveryEngine
+from state_backend import ExpiringSet, MemoryBackend
+from test_delivery import FakeSender
+
+
+class TestEntryFingerprint(unittest.TestCase):
+    def test_client_id(self):
+        a = entry_fingerprint({"id": "abc", "sms": "one"}, ["1"])
+        self.assertEqual(a, entry_fingerprint({"id": "abc", "sms": "one"}, ["2"]))
+        self.assertNotEqual(a, entry_fingerprint({"id": "abcd", "sms": "one"}, ["1"]))
+        # Another phone's entry 5 is another message
+        self.assertNotEqual(a, entry_fingerprint({"id": "abc", "sms": "two"}, ["1"]))
+
+    def test_content_hash_ignores_id_order(self):
+        a = entry_fingerprint({"ids": "1,2", "sms": "Code 123456"}, ["1", "2"])
+        b = entry_fingerprint({"ids": "2,1", "sms": "Code 123456"}, ["2", "1"])
+        c = entry_fingerprint({"ids": "1,2", "sms": "Code 654321"}, ["1", "2"])
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, c)
+
+
+class TestExpiringSet(unittest.TestCase):
+    def test_expiry_and_capacity(self):
+        keys = ExpiringSet(capacity=2)
+        self.assertTrue(keys.add("a", 10, now=0))
+        self.assertFalse(keys.add("a", 10, now=1))
+        self.assertTrue(keys.add("a", 10, now=11))
+        keys.add("b", 10, now=11)
+        keys.add("c", 10, now=11)
+        self.assertFalse(keys.contains("a", now=12))
+        self.assertEqual(len(keys), 2)
+
+
+class TestDedupEngine(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.sender = FakeSender(failing={"bad"})
+        self.dedup = DedupIndex(MemoryBackend(), window=60, by_content=False)
+        self.engine = DeliveryEngine(self.sender, lambda data: data["sms"], dedup=self.dedup)
+
+    async def test_resent_entry_is_duplicate(self):
+        body = [{"id": "m1", "ids": "1,2", "sms": "a"}]
+        first = await self.engine.deliver(body)
+        second = await self.engine.deliver(body)
+
+        self.assertEqual(len(first.successful), 2)
+        self.assertEqual(second.successful, [])
+        self.assertEqual(second.failed, [])
+        self.assertEqual(second.duplicate, [{"index": 0, "user_id": "1"}, {"index": 0, "user_id": "2"}])
+        self.assertEqual(len(self.sender.sent), 2)
+
+    async def test_concurrent_copies_send_once(self):
+        body = [{"id": "m1", "ids": "1", "sms": "a"}]
+        await asyncio.gather(self.engine.deliver(body), self.engine.deliver(body))
+        self.assertEqual(self.sender.sent, [("1", "a")])
+
+    async def test_failed_send_can_be_retried(self):
+        body = [{"id": "m1", "ids": "bad", "sms": "a"}]
+        await self.engine.deliver(body)
+        report = await self.engine.deliver(body)
+        self.assertEqual(len(report.failed), 1)
+        self.assertEqual(report.duplicate, [])
+
+    async def test_entries_without_id_are_not_matched(self):
+        body = [{"ids": "1,1", "sms": "a"}]
+        await self.engine.deliver(body)
+        report = await self.engine.deliver(body)
+        self.assertEqual(len(report.successful), 2)
+        self.assertEqual(len(self.sender.sent), 2)
+
+    async def test_merged_message_leaves_out_duplicates(self):
+        self.engine.merge = True
+        await self.engine.deliver([{"id": "m1", "ids": "1", "sms": "a"}])
+        report = await self.engine.deliver([
+            {"id": "m1", "ids": "1", "sms": "a"}, {"id": "m2", "ids": "1", "sms": "b"},
+        ])
+        self.assertEqual(report.duplicate, [{"index": 0, "user_id": "1"}])
+        self.assertEqual(self.sender.sent, [("1", "a"), ("1", "b")])
+
+    async def test_by_content(self):
+        self.dedup.by_content = True
+        await self.engine.deliver([{"ids": "1", "sms": "a"}])
+        report = await self.engine.deliver([{"ids": "1", "sms": "a"}])
+        self.assertEqual(report.duplicate, [{"index": 0, "user_id": "1"}])
+
+
+class TestDedupEndpoint(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        import main
+
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.sender = FakeSender()
+        main.app.state.delivery = DeliveryEngine(
+            self.sender, main.format_message, dedup=DedupIndex(MemoryBackend(), window=60)
+        )
+        self.headers = {"X-Auth-Key": main.AUTH_KEY}
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+
+    def test_resend_reports_duplicate(self):
+        body = [{"id": "m1", "ids": "1", "sms": "Code 123456"}]
+        self.client.post("/receive_data", headers=self.headers, json=body)
+        response = self.client.post("/receive_data", headers=self.headers, json=body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            "status": "success", "delivered": 0, "duplicate": [{"index": 0, "user_id": "1"}],
+        })
+        self.assertEqual(len(self.sender.sent), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
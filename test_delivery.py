@@ -0,0 +1,170 @@
+import asyncio
+import json
+import os
+import unittest
+
+import httpx
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from delivery import DeliveryEngine
+from rate_limiter import DeliveryScheduler
+from telegram_sender import TelegramAPIError, TelegramSender
+
+
+class FakeSender:
+    """Stands in for TelegramSender; fails for chat IDs listed in ``failing``."""
+
+    def __init__(self, failing=(), delay=0.0):
+        self.failing = set(failing)
+        self.delay = delay
+        self.sent = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if chat_id in self.failing:
+                raise TelegramAPIError(400, "Bad Request: chat not found")
+            self.sent.append((chat_id, text))
+            return {"message_id": len(self.sent)}
+        finally:
+            self.in_flight -= 1
+
+    async def aclose(self):
+        pass
+
+
+class TestDeliveryEngine(unittest.IsolatedAsyncioTestCase):
+    async def test_fan_out_is_bounded(self):
+        sender = FakeSender(delay=0.01)
+        scheduler = DeliveryScheduler(sender, concurrency=3, global_rate=1000, chat_burst=10)
+        engine = DeliveryEngine(scheduler, lambda data: data["sms"])
+        body = [{"ids": "1,2,3,4", "sms": f"code {i}"} for i in range(5)]
+
+        report = await engine.deliver(body)
+
+        self.assertEqual(len(report.successful), 20)
+        self.assertEqual(report.failed, [])
+        self.assertEqual(sender.max_in_flight, 3)
+
+    async def test_results_keep_batch_order(self):
+        sender = FakeSender(failing={"bad"})
+        engine = DeliveryEngine(sender, lambda data: data["sms"])
+        body = [
+            {"ids": "1, bad", "sms": "a"},
+            {"sms": "no ids"},
+            {"ids": "2", "sms": "b"},
+        ]
+
+        report = await engine.deliver(body)
+
+        self.assertTrue(report.telegram_available)
+        self.assertEqual(report.successful, [
+            {"index": 0, "user_id": "1"},
+            {"index": 2, "user_id": "2"},
+        ])
+        self.assertEqual([f["index"] for f in report.failed], [0, 1])
+        self.assertIn("chat not found", report.failed[0]["error"])
+        self.assertEqual(report.failed[1]["error"], "Missing 'ids' field")
+
+
+class TestTelegramSender(unittest.IsolatedAsyncioTestCase):
+    async def test_api_error_is_raised(self):
+        def handler(request):
+            return httpx.Response(429, json={
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 3",
+                "parameters": {"retry_after": 3},
+            })
+
+        sender = TelegramSender("123:TEST", transport=httpx.MockTransport(handler))
+        with self.assertRaises(TelegramAPIError) as ctx:
+            await sender.send_message("1", "hi")
+        await sender.aclose()
+
+        self.assertEqual(ctx.exception.error_code, 429)
+        self.assertEqual(ctx.exception.retry_after, 3)
+
+    async def test_send_message_payload(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={"ok": True, "result": {"message_id": 7}})
+
+        sender = TelegramSender("123:TEST", transport=httpx.MockTransport(handler))
+        result = await sender.send_message("42", "hello", parse_mode="Markdown")
+        await sender.aclose()
+
+        self.assertEqual(result, {"message_id": 7})
+        self.assertTrue(requests[0].url.path.endswith("/bot123:TEST/sendMessage"))
+        self.assertEqual(json.loads(requests[0].content), {
+            "chat_id": "42", "text": "hello", "parse_mode": "Markdown",
+        })
+
+
+class TestReceiveDataEndpoint(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        import main
+
+        self.main = main
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.sender = FakeSender(failing={"INVALID_BOT_ID"})
+        main.app.state.delivery = DeliveryEngine(self.sender, main.format_message)
+        self.headers = {"X-Auth-Key": main.AUTH_KEY}
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+
+    def test_success(self):
+        response = self.client.post("/receive_data", headers=self.headers, json=[
+            {"ids": "1,2", "sms": "Code 123456"},
+            {"ids": "3", "call": True, "from": "+861234567890", "to": "SIM 1"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"status": "success", "delivered": 3})
+
+    def test_partial_success(self):
+        response = self.client.post("/receive_data", headers=self.headers, json=[
+            {"ids": "1,INVALID_BOT_ID", "sms": "Code 555555"},
+        ])
+        self.assertEqual(response.status_code, 207)
+        data = response.json()
+        self.assertEqual(data["successful"], [{"index": 0, "user_id": "1"}])
+        self.assertIn("chat not found", data["failed"][0]["error"])
+
+    def test_nothing_delivered(self):
+        response = self.client.post("/receive_data", headers=self.headers, json=[
+            {"sms": "No ids field"},
+        ])
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Missing 'ids' field", response.json()["details"][0]["error"])
+
+    def test_throttled(self):
+        class ThrottledSender(FakeSender):
+            async def send_message(self, chat_id, text, parse_mode=None):
+                raise TelegramAPIError(429, "Too Many Requests: retry after 7", retry_after=7)
+
+        self.main.app.state.delivery = DeliveryEngine(ThrottledSender(), self.main.format_message)
+        response = self.client.post("/receive_data", headers=self.headers, json=[
+            {"ids": "1", "sms": "Code 123456"},
+        ])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "7")
+
+    def test_invalid_auth_key(self):
+        response = self.client.post("/receive_data", headers={"X-Auth-Key": "nope"}, json=[])
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from audit_log import AuditLog
+from dedup import DedupIndex
+from delivery import DeliveryEngine
+from delivery_queue import DeliveryQueue, QueueWorkers
+from state_backend import MemoryBackend
+from test_delivery import FakeSender
+
+
+class TestDeliveryQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "queue.db")
+        self.queue = DeliveryQueue(self.path, max_attempts=2, retry_delay=0, lease=60)
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmp.cleanup()
+
+    def test_claim_and_status(self):
+        self.queue.enqueue([("m1", 0, ["1", "2"], "hello")])
+        self.assertEqual(self.queue.depth(), 2)
+
+        seq, user_id, text, attempts, _ = self.queue.claim()
+        self.assertEqual((user_id, text, attempts), ("1", "hello", 1))
+        self.queue.mark_delivered(seq)
+
+        status = self.queue.status("m1")
+        self.assertEqual(status["status"], "pending")
+        self.assertEqual(status["deliveries"][0]["status"], "delivered")
+        self.assertIsNone(self.queue.status("unknown"))
+
+    def test_retry_until_max_attempts(self):
+        self.queue.enqueue([("m1", 0, ["1"], "hello")])
+
+        seq, _, _, attempts, _ = self.queue.claim()
+        self.queue.mark_failed(seq, "timeout", attempts, retry=True)
+        self.assertEqual(self.queue.status("m1")["status"], "pending")
+
+        seq, _, _, attempts, _ = self.queue.claim()
+        self.assertEqual(attempts, 2)
+        self.queue.mark_failed(seq, "timeout", attempts, retry=True)
+        self.assertEqual(self.queue.status("m1")["status"], "failed")
+        self.assertIsNone(self.queue.claim())
+
+    def test_survives_restart(self):
+        self.queue.lease = 0
+        self.queue.enqueue([("m1", 0, ["1"], "hello")])
+        self.assertIsNotNone(self.queue.claim())
+        self.queue.close()
+
+        # A send that was in flight when the process died is retried once its lease ends
+        self.queue = DeliveryQueue(self.path)
+        self.assertEqual(self.queue.status("m1")["deliveries"][0]["status"], "sending")
+        self.assertEqual(self.queue.claim()[3], 2)
+
+    def test_urgent_lanes_claimed_first(self):
+        self.queue.enqueue([
+            ("m1", 0, ["1"], "call", "call"),
+            ("m2", 1, ["1"], "note", "sms"),
+            ("m3", 2, ["1"], "code", "otp"),
+            ("m4", 3, ["1"], "old client"),
+        ])
+        claimed = [self.queue.claim()[2:] for _ in range(4)]
+        self.assertEqual(claimed, [
+            ("code", 1, "otp"), ("old client", 1, None), ("note", 1, "sms"), ("call", 1, "call"),
+        ])
+
+    def test_leased_rows_are_not_shared(self):
+        other = DeliveryQueue(self.path)
+        self.queue.enqueue([("m1", 0, ["1"], "hello")])
+        self.assertIsNotNone(other.claim())
+        self.assertIsNone(self.queue.claim())
+        other.close()
+
+
+class TestQueueWorkers(unittest.IsolatedAsyncioTestCase):
+    async def test_workers_drain_queue(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = DeliveryQueue(os.path.join(tmp, "queue.db"))
+            sender = FakeSender(failing={"bad"})
+            workers = QueueWorkers(queue, DeliveryEngine(sender, lambda data: data["sms"]), workers=2)
+            workers.start()
+
+            accepted, failed, _ = await workers.submit([
+                {"ids": "1,bad", "sms": "a"},
+                {"sms": "no ids"},
+            ])
+            self.assertEqual([a["index"] for a in accepted], [0])
+            self.assertEqual(failed[0]["error"], "Missing 'ids' field")
+
+            for _ in range(100):
+                if queue.depth() == 0:
+                    break
+                await asyncio.sleep(0.01)
+            await workers.stop()
+
+            status = queue.status(accepted[0]["id"])
+            queue.close()
+        self.assertEqual(status["status"], "partial")
+        self.assertEqual(sender.sent, [("1", "a")])
+        # "chat not found" is permanent, so it isn't retried
+        self.assertEqual(status["deliveries"][1]["attempts"], 1)
+
+    async def test_failed_rows_give_up_their_dedup_key(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = DeliveryQueue(os.path.join(tmp, "queue.db"))
+            dedup = DedupIndex(MemoryBackend(), window=60)
+            engine = DeliveryEngine(FakeSender(failing={"bad"}), lambda data: data["sms"], dedup=dedup)
+            workers = QueueWorkers(queue, engine)
+            entry = {"id": "e1", "ids": "1,bad", "sms": "a"}
+
+            await workers.submit([entry])
+            # Nothing is sent yet, so a resend still counts as a duplicate
+            self.assertEqual(len((await workers.submit([entry]))[2]), 2)
+            workers.start()
+            for _ in range(100):
+                if queue.depth() == 0:
+                    break
+                await asyncio.sleep(0.01)
+            await workers.stop()
+
+            accepted, _, duplicate = await workers.submit([entry])
+            queue.close()
+        self.assertEqual(duplicate, [{"index": 0, "user_id": "1"}])
+        self.assertEqual(len(accepted), 1)
+
+    async def test_outcomes_are_audited(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = DeliveryQueue(os.path.join(tmp, "queue.db"))
+            log = AuditLog(os.path.join(tmp, "audit"))
+            dedup = DedupIndex(MemoryBackend(), window=60)
+            engine = DeliveryEngine(FakeSender(failing={"2"}), lambda data: data["sms"], audit=log, dedup=dedup)
+            workers = QueueWorkers(queue, engine)
+            workers.start()
+
+            await workers.submit([{"id": "e1", "ids": "1,2", "sms": "a"}])
+            await workers.submit([{"id": "e1", "ids": "1", "sms": "a"}])
+            for _ in range(100):
+                if queue.depth() == 0:
+                    break
+                await asyncio.sleep(0.01)
+            await workers.stop()
+            queue.close()
+            await log.close()
+            records = sorted(log.query()[0], key=lambda r: (r.chat, r.status))
+        self.assertEqual([(r.chat, r.status, r.message_id, r.error_code) for r in records], [
+            (1, "duplicate", 0, 0), (1, "sent", 1, 0), (2, "failed", 0, 400),
+        ])
+
+
+
+class TestQueuedIngest(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        import main
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.sender = FakeSender()
+        engine = DeliveryEngine(self.sender, main.format_message)
+        queue = DeliveryQueue(os.path.join(self.tmp.name, "queue.db"))
+        main.app.state.delivery = engine
+        main.app.state.queue = QueueWorkers(queue, engine)
+        self.headers = {"X-Auth-Key": main.AUTH_KEY, "Prefer": "respond-async"}
+
+    def tearDown(self):
+        import main
+
+        self.client.__exit__(None, None, None)
+        main.app.state.queue.queue.close()
+        self.tmp.cleanup()
+
+    def test_accepted_and_status(self):
+        response = self.client.post("/receive_data", headers=self.headers, json=[
+            {"ids": "1", "sms": "Code 123456"},
+        ])
+        self.assertEqual(response.status_code, 202)
+        message_id = response.json()["messages"][0]["id"]
+
+        response = self.client.get(f"/status/{message_id}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "pending")
+
+    def test_invalid_batch(self):
+        response = self.client.post("/receive_data", headers=self.headers, json=[{"sms": "x"}])
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
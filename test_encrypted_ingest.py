@@ -0,0 +1,98 @@
+import json
+import os
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from aes256cipher import AES256Cipher
+from delivery import DeliveryEngine, RejectedEntry
+from encrypted_ingest import Decryptor, merge_plaintext
+from test_delivery import FakeSender
+
+SECRET = "test-secret"
+
+
+class TestMergePlaintext(unittest.TestCase):
+    def test_json_object_overrides_envelope(self):
+        entry = {"ids": "1", "encrypted": "..."}
+        merged = merge_plaintext(entry, json.dumps({"call": True, "from": "+100"}))
+        self.assertEqual(merged, {"ids": "1", "call": True, "from": "+100"})
+
+    def test_plain_text_becomes_sms(self):
+        merged = merge_plaintext({"ids": "1", "encrypted": "..."}, "验证码是828627")
+        self.assertEqual(merged, {"ids": "1", "sms": "验证码是828627"})
+
+
+class TestDecryptor(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.cipher = AES256Cipher(SECRET)
+        self.decryptor = Decryptor(SECRET, workers=2)
+
+    async def asyncTearDown(self):
+        self.decryptor.close()
+
+    async def test_decrypt_entries_reports_failures_in_place(self):
+        body = [
+            {"ids": "1", "encrypted": self.cipher.encrypt("Code 123456")},
+            {"ids": "2", "sms": "plain"},
+            {"ids": "3", "encrypted": AES256Cipher("other").encrypt("x")},
+            {"ids": "4", "encrypted": self.cipher.encrypt(json.dumps({"sms": "Code 654321"}))},
+        ]
+
+        result = await self.decryptor.decrypt_entries(body)
+
+        self.assertEqual(result[0], {"ids": "1", "sms": "Code 123456"})
+        self.assertIs(result[1], body[1])
+        self.assertIsInstance(result[2], RejectedEntry)
+        self.assertEqual(result[3], {"ids": "4", "sms": "Code 654321"})
+
+    async def test_decrypt_body(self):
+        batch = [{"ids": "1", "sms": "hi"}]
+        self.assertEqual(await self.decryptor.decrypt_body(self.cipher.encrypt(json.dumps(batch))), batch)
+        with self.assertRaises(ValueError):
+            await self.decryptor.decrypt_body("not base64 ciphertext")
+
+
+class TestEncryptedEndpoint(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        import main
+
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.sender = FakeSender()
+        main.app.state.delivery = DeliveryEngine(self.sender, main.format_message)
+        main.app.state.decryptor.close()
+        main.app.state.decryptor = Decryptor(SECRET, workers=2)
+        self.cipher = AES256Cipher(SECRET)
+        self.headers = {"X-Auth-Key": main.AUTH_KEY}
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+
+    def test_encrypted_entries(self):
+        response = self.client.post("/receive_data", headers=self.headers, json=[
+            {"ids": "1", "encrypted": self.cipher.encrypt("Code 123456")},
+            {"ids": "2", "encrypted": "garbage"},
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()["failed"], [
+            {"index": 1, "error": "Failed to decrypt message"},
+        ])
+        self.assertEqual(self.sender.sent, [("1", "Code `123456`")])
+
+    def test_encrypted_body(self):
+        token = self.cipher.encrypt(json.dumps([{"ids": "1", "sms": "hello"}]))
+        headers = dict(self.headers, **{"X-Encrypted": "true", "Content-Type": "text/plain"})
+        response = self.client.post("/receive_data", headers=headers, content=token)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post("/receive_data", headers=headers, content="garbage")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"], "Failed to decrypt body")
+
+
+if __name__ == "__main__":
+    unittest.main()
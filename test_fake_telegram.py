@@ -0,0 +1,69 @@
+import random
+import unittest
+
+import httpx
+
+from fake_telegram import FakeTelegramConfig, create_fake_telegram
+from load_test import make_batch, percentile
+from telegram_sender import TelegramAPIError, TelegramSender
+
+
+class TestFakeTelegram(unittest.IsolatedAsyncioTestCase):
+    def sender(self, app):
+        return TelegramSender("123:TEST", base_url="http://fake", transport=httpx.ASGITransport(app=app))
+
+    async def test_send_message(self):
+        app = create_fake_telegram()
+        sender = self.sender(app)
+        first = await sender.send_message("42", "hi")
+        second = await sender.send_message("42", "again")
+        await sender.aclose()
+
+        self.assertEqual(first["chat"]["id"], 42)
+        self.assertEqual(second["message_id"], first["message_id"] + 1)
+        self.assertEqual(list(app.state.sent), [("42", "hi"), ("42", "again")])
+
+    async def test_injected_errors(self):
+        sender = self.sender(create_fake_telegram(FakeTelegramConfig(flood_rate=1.0, retry_after=3)))
+        with self.assertRaises(TelegramAPIError) as error:
+            await sender.send_message("42", "hi")
+        self.assertEqual((error.exception.error_code, error.exception.retry_after), (429, 3))
+
+        sender = self.sender(create_fake_telegram(FakeTelegramConfig(error_rate=1.0)))
+        with self.assertRaises(TelegramAPIError) as error:
+            await sender.send_message("42", "hi")
+        self.assertEqual(error.exception.error_code, 502)
+        await sender.aclose()
+
+    async def test_chat_not_found_and_stats(self):
+        app = create_fake_telegram()
+        sender = self.sender(app)
+        with self.assertRaises(TelegramAPIError):
+            await sender.send_message("not-a-chat", "hi")
+        await sender.send_message("1", "hi")
+        await sender.aclose()
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://fake") as client:
+            stats = (await client.get("/stats")).json()
+        self.assertEqual(stats, {"calls": 2, "by_outcome": {"sendMessage:400": 1, "sendMessage:200": 1}})
+
+
+class TestLoadTest(unittest.TestCase):
+    def test_batches(self):
+        batch = make_batch(random.Random(1), 200, ["1", "2", "3"])
+        self.assertEqual(len(batch), 200)
+        self.assertTrue(any("call" in entry for entry in batch))
+        self.assertTrue(any("验证码" in entry.get("sms", "") for entry in batch))
+        self.assertTrue(any("," in entry["ids"] for entry in batch))
+        # Same seed, same batches
+        self.assertEqual(batch, make_batch(random.Random(1), 200, ["1", "2", "3"]))
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
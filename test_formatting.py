@@ -0,0 +1,69 @@
+import unittest
+
+from formatting import MessageFormatter, escape_markdown, extract_last_digits
+
+
+class TestMessageFormatter(unittest.TestCase):
+    def setUp(self):
+        self.formatter = MessageFormatter()
+
+    def test_wraps_codes(self):
+        self.assertEqual(
+            self.formatter.format_message({"sms": "First code: 1234, second code: 567890"}),
+            "First code: `1234`, second code: `567890`",
+        )
+
+    def test_escapes_markdown(self):
+        self.assertEqual(
+            self.formatter.format_message({"sms": "Use code 4821 at my_site.com [*]"}),
+            "Use code `4821` at my\\_site\\.com \\[\\*\\]",
+        )
+
+    def test_cjk_adjacent_code(self):
+        self.assertEqual(self.formatter.format_sms("验证码是828627，5分钟内有效"), "验证码是`828627`，5分钟内有效")
+
+    def test_split_code(self):
+        # Escaped characters stay literal inside `code`, so the copy reads 123-456
+        self.assertEqual(self.formatter.format_sms("Code 123-456."), "Code `123\\-456`\\.")
+
+    def test_ignores_longer_numbers_and_words(self):
+        self.assertEqual(self.formatter.format_sms("abc1234 1234567890"), "abc1234 1234567890")
+
+    def test_alnum_and_custom_patterns(self):
+        formatter = MessageFormatter(["alnum", r"G\\-[0-9]{6}"])
+        self.assertEqual(formatter.format_sms("A7K9Q2 or G-123456"), "`A7K9Q2` or `G\\-123456`")
+        self.assertEqual(MessageFormatter([]).format_sms("1234!"), "1234\\!")
+
+    def test_call(self):
+        self.assertEqual(
+            self.formatter.format_message({"call": True, "from": "+861234567890", "to": "SIM 1"}),
+            "📞 \\+861234567890 \\(`567890`\\), SIM 1",
+        )
+
+    def test_sms_takes_priority(self):
+        self.assertEqual(self.formatter.format_message({"sms": "hi", "call": True}), "hi")
+        self.assertEqual(self.formatter.format_message({}), "")
+
+    def test_render(self):
+        self.assertEqual(self.formatter.render({"sms": "Code: 4821"}), ("Code: `4821`", "otp"))
+        self.assertEqual(self.formatter.render({"sms": "验证码是828627"})[1], "otp")
+        self.assertEqual(self.formatter.render({"sms": "See you at 5"}), ("See you at 5", "sms"))
+        call = {"call": True, "from": "+861234567890"}
+        self.assertEqual(self.formatter.render(call), (self.formatter.format_message(call), "call"))
+        self.assertEqual(MessageFormatter([]).render({"sms": "Code: 4821"}), ("Code: 4821", "sms"))
+
+    def test_source(self):
+        source = self.formatter.source
+        self.assertEqual(source({"from": "+1 (555) 010-0100"}), source({"from": "15550100100"}))
+        self.assertEqual(source({"from": " Google2FA "}), "google2fa")
+        self.assertNotEqual(source({"from": "BANK1"}), source({"from": "SHOP1"}))
+        self.assertIsNone(source({}))
+
+    def test_helpers(self):
+        self.assertEqual(escape_markdown("a.b"), "a\\.b")
+        self.assertEqual(extract_last_digits("+79991234567"), "234567")
+        self.assertEqual(extract_last_digits("12345"), "12345")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from delivery import DeliveryEngine
+from json_stream import EntryStream, StreamError, iter_json_array, iter_ndjson
+from test_delivery import FakeSender
+
+BATCH = [{"ids": "1", "sms": "验证码是828627"}, {"ids": "2", "sms": "x"}, 123, "s", [1, 2], True]
+
+
+async def chunked(data, size):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def collect(parse, data, size=1, **limits):
+    return [value async for value in parse(chunked(data, size), **limits)]
+
+
+class TestIterJsonArray(unittest.IsolatedAsyncioTestCase):
+    async def test_any_chunking(self):
+        data = json.dumps(BATCH).encode()
+        for size in (1, 2, 7, len(data)):
+            self.assertEqual(await collect(iter_json_array, data, size), BATCH)
+        self.assertEqual(await collect(iter_json_array, b" [ ] "), [])
+
+    async def test_errors(self):
+        cases = {
+            b"": "Invalid JSON format",
+            b"nope": "Invalid JSON format",
+            b'{"ids": "1"}': "Expected array of message objects",
+            b"[1,]": "Invalid JSON format",
+            b"[1 2]": "Invalid JSON format",
+            b"[12": "Invalid JSON format",
+            b"[{}]x": "Invalid JSON format",
+        }
+        for data, message in cases.items():
+            with self.subTest(data=data), self.assertRaisesRegex(StreamError, message):
+                await collect(iter_json_array, data)
+
+    async def test_limits(self):
+        data = json.dumps(BATCH).encode()
+        with self.assertRaises(StreamError) as caught:
+            await collect(iter_json_array, data, 5, max_entries=2)
+        self.assertEqual(caught.exception.status_code, 413)
+        with self.assertRaisesRegex(StreamError, "too large"):
+            await collect(iter_json_array, data, 5, max_bytes=10)
+
+
+class TestIterNdjson(unittest.IsolatedAsyncioTestCase):
+    async def test_lines(self):
+        data = b'{"a": 1}\n\n{"b": 2}'
+        self.assertEqual(await collect(iter_ndjson, data, 3), [{"a": 1}, {"b": 2}])
+        with self.assertRaises(StreamError):
+            await collect(iter_ndjson, b'{"a": 1}\nnope\n')
+
+
+class TestEntryStream(unittest.IsolatedAsyncioTestCase):
+    async def test_error_after_start_ends_iteration(self):
+        stream = EntryStream(iter_json_array(chunked(b'[{"a": 1}, {"b": 2}, oops]', 4)))
+        await stream.start()
+        self.assertEqual([entry async for entry in stream], [{"a": 1}, {"b": 2}])
+        self.assertEqual(stream.count, 2)
+        self.assertEqual(str(stream.error), "Invalid JSON format")
+
+
+class TestStreamedDelivery(unittest.IsolatedAsyncioTestCase):
+    async def test_sends_before_body_ends(self):
+        sender = FakeSender()
+        engine = DeliveryEngine(sender, lambda data: data["sms"])
+        arrived = asyncio.Event()
+
+        async def entries():
+            yield {"ids": "1", "sms": "a"}
+            await arrived.wait()
+            yield {"ids": "2,1", "sms": "a"}
+
+        outcomes = engine.outcomes(entries())
+        first = await outcomes.__anext__()
+        self.assertEqual(first[1:], ("sent", {"index": 0, "user_id": "1"}))
+        arrived.set()
+        rest = [outcome[1:] async for outcome in outcomes]
+        self.assertEqual(sorted(r["user_id"] for _, r in rest), ["1", "2"])
+        # The repeated (chat 1, "a") reused the first send
+        self.assertEqual(sender.sent, [("1", "a"), ("2", "a")])
+
+
+class TestStreamingEndpoint(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        import main
+
+        self.main = main
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.sender = FakeSender()
+        main.app.state.delivery = DeliveryEngine(self.sender, main.format_message)
+        self.headers = {"X-Auth-Key": main.AUTH_KEY}
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+
+    def post(self, content, **headers):
+        return self.client.post("/receive_data", headers=dict(self.headers, **headers), content=content)
+
+    def test_ndjson(self):
+        body = '{"ids": "1", "sms": "Code 123456"}\n{"ids": "2", "sms": "hi"}\n'
+        response = self.post(body, **{"Content-Type": "application/x-ndjson"})
+        self.assertEqual(response.json(), {"status": "success", "delivered": 2})
+
+    def test_invalid_json(self):
+        response = self.post("not json", **{"Content-Type": "application/json"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "Invalid JSON format"})
+        response = self.post('{"ids": "1"}', **{"Content-Type": "application/json"})
+        self.assertEqual(response.json(), {"error": "Expected array of message objects"})
+
+    def test_truncated_after_first_entry(self):
+        response = self.post('[{"ids": "1", "sms": "a"}, {"ids": "2"', **{"Content-Type": "application/json"})
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()["failed"], [{"index": 1, "error": "Invalid JSON format"}])
+        self.assertEqual(self.sender.sent, [("1", "a")])
+
+    def test_ndjson_response(self):
+        self.sender.failing = {"bad"}
+        response = self.post(
+            '[{"ids": "1,bad", "sms": "a"}, {"sms": "no ids"}]', Accept="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        for line in lines[:-1]:
+            line.pop("error", None)
+        self.assertCountEqual(lines[:-1], [
+            {"index": 0, "user_id": "1", "status": "sent"},
+            {"index": 0, "user_id": "bad", "status": "failed"},
+            {"index": 1, "status": "failed"},
+        ])
+        self.assertEqual(lines[-1], {"status": "partial_success", "delivered": 1, "failed": 2, "duplicate": 0})
+
+    def test_limits(self):
+        max_entries, self.main.MAX_BATCH_ENTRIES = self.main.MAX_BATCH_ENTRIES, 1
+        try:
+            response = self.post('[{"ids": "1", "sms": "a"}]')
+            self.assertEqual(response.status_code, 200)
+            response = self.post('[{"ids": "1", "sms": "a"}, {"ids": "2", "sms": "b"}]')
+            self.assertEqual(response.json()["failed"][-1]["error"], "Too many entries in batch (max 1)")
+        finally:
+            self.main.MAX_BATCH_ENTRIES = max_entries
+
+        max_bytes, self.main.MAX_BODY_BYTES = self.main.MAX_BODY_BYTES, 10
+        try:
+            response = self.post('[{"ids": "1", "sms": "a"}]')
+            self.assertEqual(response.status_code, 413)
+        finally:
+            self.main.MAX_BODY_BYTES = max_bytes
+
+
+if __name__ == "__main__":
+    unittest.main()
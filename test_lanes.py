@@ -0,0 +1,138 @@
+import asyncio
+import time
+import unittest
+
+from delivery import DeliveryEngine
+from formatting import MessageFormatter
+from lanes import PriorityGate, parse_lane_limits
+from metrics import Metrics
+from rate_limiter import DeliveryScheduler
+from test_rate_limiter import ScriptedSender
+
+
+class LaneSender:
+    """Records the lane each message was sent on."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None, lane=None):
+        self.sent.append((chat_id, text, lane))
+        return {"message_id": len(self.sent)}
+
+
+class TestPriorityGate(unittest.IsolatedAsyncioTestCase):
+    async def test_urgent_lane_first(self):
+        gate = PriorityGate(1)
+        order = []
+        await gate.acquire("sms")
+
+        async def run(lane, name):
+            async with gate.slot(lane):
+                order.append(name)
+
+        tasks = [asyncio.create_task(run(lane, name)) for lane, name in [
+            ("call", "call1"), ("sms", "sms1"), ("otp", "otp1"), ("call", "call2"), ("otp", "otp2"),
+        ]]
+        await asyncio.sleep(0)
+        gate.release("sms")
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, ["otp1", "otp2", "sms1", "call1", "call2"])
+
+    async def test_lane_limit(self):
+        gate = PriorityGate(4, {"call": 1})
+        await gate.acquire("call")
+        waiting = asyncio.create_task(gate.acquire("call"))
+        await asyncio.sleep(0)
+        self.assertFalse(waiting.done())
+        # Other lanes still get the free slots
+        await asyncio.wait_for(gate.acquire("otp"), 1)
+        gate.release("call")
+        await asyncio.wait_for(waiting, 1)
+        self.assertEqual(gate.active["call"], 1)
+
+    async def test_cancelled_waiter_gives_up_its_place(self):
+        gate = PriorityGate(1)
+        await gate.acquire("otp")
+        waiting = asyncio.create_task(gate.acquire("otp"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        gate.release("otp")
+        await asyncio.wait_for(gate.acquire("call"), 1)
+
+    def test_parse_limits(self):
+        self.assertEqual(parse_lane_limits("sms=8, call=4,"), {"sms": 8, "call": 4})
+        with self.assertRaises(ValueError):
+            parse_lane_limits("fax=1")
+
+
+class TestSchedulerLanes(unittest.IsolatedAsyncioTestCase):
+    async def test_otp_overtakes_queued_calls(self):
+        sender = LaneSender()
+        # 20 sends/s: the first 20 calls use the burst, the other 10 wait their turn
+        scheduler = DeliveryScheduler(sender, global_rate=20, chat_rate=1000, chat_burst=1000)
+        calls = [asyncio.create_task(scheduler.send_message(str(i), "call", lane="call")) for i in range(30)]
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        await scheduler.send_message("99", "otp", lane="otp")
+        # Booked the next slot instead of queueing behind ten calls (~0.5 s)
+        self.assertLess(time.monotonic() - started, 0.15)
+        await asyncio.gather(*calls)
+        self.assertEqual(len(sender.sent), 31)
+
+    async def test_lower_lanes_wait_at_most_max_delay(self):
+        scheduler = DeliveryScheduler(LaneSender(), global_rate=1000, lane_max_delay=0.05)
+        scheduler.queued["otp"] += 1  # an OTP that never gets its turn
+        started = time.monotonic()
+        await scheduler.send_message("1", "call", lane="call")
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+    async def test_throttled_chat_doesnt_hold_back_other_chats(self):
+        sender = LaneSender()
+        scheduler = DeliveryScheduler(sender, global_rate=1000, chat_rate=1, chat_burst=1, lane_max_delay=5)
+        await scheduler.send_message("1", "otp", lane="otp")
+        # The second OTP to chat 1 sleeps on its own bucket for a second
+        otp = asyncio.create_task(scheduler.send_message("1", "otp", lane="otp"))
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        await scheduler.send_message("2", "sms", lane="sms")
+        self.assertLess(time.monotonic() - started, 0.2)
+        await otp
+
+    async def test_lane_latency_metric(self):
+        metrics = Metrics()
+        scheduler = DeliveryScheduler(ScriptedSender(), metrics=metrics)
+        await scheduler.send_message("1", "hi", lane="sms")
+        await scheduler.send_message("1", "hi")
+        self.assertIn('otp_sync_delivery_seconds_count{lane="sms"} 1', metrics.render())
+        self.assertIn('otp_sync_delivery_seconds_count{lane="otp"} 1', metrics.render())
+
+
+class TestEngineLanes(unittest.IsolatedAsyncioTestCase):
+    async def test_lanes_passed_to_sender(self):
+        formatter = MessageFormatter()
+        sender = LaneSender()
+        engine = DeliveryEngine(sender, formatter.render, lanes=True)
+        await engine.deliver([
+            {"ids": "1", "sms": "Your code is 123456"},
+            {"ids": "2", "sms": "Hello"},
+            {"ids": "3", "call": True, "from": "+1555", "to": "SIM 1"},
+        ])
+        self.assertEqual(sorted((chat, lane) for chat, _, lane in sender.sent), [
+            ("1", "otp"), ("2", "sms"), ("3", "call"),
+        ])
+
+    async def test_merged_message_takes_most_urgent_lane(self):
+        formatter = MessageFormatter()
+        sender = LaneSender()
+        engine = DeliveryEngine(sender, formatter.render, merge=True, lanes=True)
+        await engine.deliver([
+            {"ids": "1", "call": True, "from": "+1555", "to": "SIM 1"},
+            {"ids": "1", "sms": "Code 4821"},
+        ])
+        self.assertEqual([lane for _, _, lane in sender.sent], ["otp"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import unittest
+
+from delivery import DeliveryEngine
+from formatting import MessageFormatter
+from live_messages import LiveMessages
+from rate_limiter import DeliveryScheduler
+from telegram_sender import TelegramAPIError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class EditingSender:
+    """Keeps the text of every message; ``edit_errors`` are raised by the next edits."""
+
+    def __init__(self):
+        self.messages = {}
+        self.calls = []
+        self.edit_errors = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.calls.append(("send", chat_id))
+        message_id = len(self.messages) + 1
+        self.messages[message_id] = (chat_id, text)
+        return {"message_id": message_id}
+
+    async def edit_message_text(self, chat_id, message_id, text, parse_mode=None):
+        self.calls.append(("edit", chat_id))
+        if self.edit_errors:
+            raise self.edit_errors.pop(0)
+        self.messages[message_id] = (chat_id, text)
+        return {"message_id": message_id}
+
+    async def aclose(self):
+        pass
+
+
+def call(number):
+    return {"ids": "1", "call": True, "from": number, "to": "SIM 1"}
+
+
+def sms(number, text):
+    return {"ids": "1", "sms": text, "from": number}
+
+
+class TestLiveMessages(unittest.TestCase):
+    def test_window(self):
+        clock = Clock()
+        live = LiveMessages(60, clock=clock)
+        live.remember(("1", "555"), 7, "a")
+        clock.now += 59
+        self.assertEqual(live.get(("1", "555")).message_id, 7)
+        clock.now += 1
+        self.assertIsNone(live.get(("1", "555")))
+        self.assertEqual(len(live), 0)
+
+    def test_least_recently_used_dropped(self):
+        live = LiveMessages(60, max_entries=2)
+        live.remember(("1", "a"), 1, "a")
+        live.remember(("1", "b"), 2, "b")
+        live.get(("1", "a"))
+        live.remember(("1", "c"), 3, "c")
+        self.assertIsNone(live.get(("1", "b")))
+        self.assertIsNotNone(live.get(("1", "a")))
+
+    def test_compose(self):
+        live = LiveMessages(60, limit=10)
+        live.remember(("1", "a"), 1, "1234")
+        message = live.get(("1", "a"))
+        self.assertEqual(live.compose(message, "5678"), "1234\n\n5678")
+        self.assertIsNone(live.compose(message, "56789"))
+        live.mode = "replace"
+        self.assertEqual(live.compose(message, "56789"), "56789")
+        with self.assertRaises(ValueError):
+            LiveMessages(60, mode="prepend")
+
+
+class TestEngineLiveMessages(unittest.IsolatedAsyncioTestCase):
+    def engine(self, sender, **options):
+        formatter = MessageFormatter()
+        self.live = LiveMessages(60, **options)
+        return DeliveryEngine(sender, formatter.format_message, live=self.live, source=formatter.source)
+
+    async def test_call_then_sms_edits_one_message(self):
+        sender = EditingSender()
+        engine = self.engine(sender)
+        await engine.deliver([call("+1 555 0100")])
+        report = await engine.deliver([sms("15550100", "Code 4821"), sms("999", "Code 1111")])
+        self.assertEqual(len(report.successful), 2)
+        self.assertEqual(sender.calls, [("send", "1"), ("edit", "1"), ("send", "1")])
+        self.assertEqual(sender.messages[1][1], "📞 \\+1 555 0100 \\(`550100`\\), SIM 1\n\nCode `4821`")
+        self.assertEqual(self.live.edits, 1)
+
+    async def test_entries_of_one_batch_take_turns(self):
+        sender = EditingSender()
+        engine = self.engine(sender, mode="replace")
+        await engine.deliver([
+            sms("555", "Code 1111"), sms("555", "Code 2222"), {"ids": "1", "sms": "Code 3333"},
+        ])
+        self.assertEqual(sorted(sender.calls), [("edit", "1"), ("send", "1"), ("send", "1")])
+        self.assertIn(("1", "Code `2222`"), sender.messages.values())
+
+    async def test_alphanumeric_senders_kept_apart(self):
+        sender = EditingSender()
+        engine = self.engine(sender)
+        await engine.deliver([sms("BANK1", "a")])
+        await engine.deliver([sms("SHOP1", "b")])
+        self.assertEqual(sender.calls, [("send", "1"), ("send", "1")])
+
+    async def test_only_listed_chats(self):
+        sender = EditingSender()
+        engine = self.engine(sender, chats=["2"])
+        await engine.deliver([sms("555", "a"), sms("555", "b")])
+        self.assertEqual(sender.calls, [("send", "1"), ("send", "1")])
+
+    async def test_deleted_message_is_sent_again(self):
+        sender = EditingSender()
+        engine = self.engine(sender)
+        await engine.deliver([sms("555", "a")])
+        sender.edit_errors.append(TelegramAPIError(400, "Bad Request: message to edit not found"))
+        await engine.deliver([sms("555", "b")])
+        await engine.deliver([sms("555", "c")])
+        self.assertEqual(sender.calls, [("send", "1"), ("edit", "1"), ("send", "1"), ("edit", "1")])
+        self.assertEqual(sender.messages[2], ("1", "b\n\nc"))
+
+    async def test_unchanged_text_counts_as_sent(self):
+        sender = EditingSender()
+        engine = self.engine(sender, mode="replace")
+        await engine.deliver([sms("555", "a")])
+        sender.edit_errors.append(TelegramAPIError(400, "Bad Request: message is not modified"))
+        report = await engine.deliver([sms("555", "a")])
+        self.assertEqual(len(report.successful), 1)
+        self.assertEqual(len(sender.messages), 1)
+
+    async def test_edits_go_through_scheduler(self):
+        sender = EditingSender()
+        scheduler = DeliveryScheduler(sender, max_retries=1, backoff_base=0.001)
+        engine = self.engine(scheduler)
+        await engine.deliver([sms("555", "a")])
+        sender.edit_errors.append(TelegramAPIError(502, "Bad Gateway"))
+        await engine.deliver([sms("555", "b")])
+        self.assertEqual(sender.calls, [("send", "1"), ("edit", "1"), ("edit", "1")])
+        self.assertEqual(scheduler.retries, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
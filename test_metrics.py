@@ -0,0 +1,76 @@
+import os
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from delivery import DeliveryEngine
+from metrics import Counter, Histogram, Metrics, timed
+from rate_limiter import DeliveryScheduler
+from telegram_sender import TelegramAPIError
+from test_delivery import FakeSender
+from test_rate_limiter import ScriptedSender
+
+
+class TestInstruments(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("h", "help", ("stage",), buckets=(0.1, 1))
+        child = histogram.labels("send")
+        for value in (0.05, 0.1, 0.5, 3):
+            child.observe(value)
+        self.assertEqual(list(histogram.render())[2:], [
+            'h_bucket{stage="send",le="0.1"} 2',
+            'h_bucket{stage="send",le="1"} 3',
+            'h_bucket{stage="send",le="+Inf"} 4',
+            'h_sum{stage="send"} 3.65',
+            'h_count{stage="send"} 4',
+        ])
+
+    def test_counter(self):
+        counter = Counter("c_total", "help", ("code",))
+        counter.inc("429")
+        counter.inc("429")
+        self.assertEqual(list(counter.render())[1:], ["# TYPE c_total counter", 'c_total{code="429"} 2'])
+
+    def test_timed(self):
+        metrics = Metrics()
+        self.assertEqual(timed(str.upper, metrics.format)("a"), "A")
+        self.assertEqual(metrics.format.counts[-1] + sum(metrics.format.counts[:-1]), 1)
+
+
+class TestSchedulerMetrics(unittest.IsolatedAsyncioTestCase):
+    async def test_errors_by_code(self):
+        metrics = Metrics()
+        sender = ScriptedSender([TelegramAPIError(400, "Bad Request: chat not found")])
+        scheduler = DeliveryScheduler(sender, metrics=metrics)
+        with self.assertRaises(TelegramAPIError):
+            await scheduler.send_message("1", "hi")
+        self.assertEqual(metrics.telegram_errors.value("400"), 1)
+        self.assertEqual(sum(metrics.send.counts), 1)
+        self.assertEqual(scheduler.in_flight, 0)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    def test_scrape(self):
+        from fastapi.testclient import TestClient
+        import main
+
+        with TestClient(main.app) as client:
+            main.app.state.delivery = DeliveryEngine(FakeSender(), main.format_message)
+            headers = {"X-Auth-Key": main.AUTH_KEY}
+            client.post("/receive_data", headers=headers, json=[{"ids": "1,2", "sms": "Code 123456"}])
+            client.post("/receive_data", headers={"X-Auth-Key": "nope"}, json=[])
+            response = client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        text = response.text
+        self.assertIn('otp_sync_requests_total{path="/receive_data",status="200"}', text)
+        self.assertIn('otp_sync_requests_total{path="/receive_data",status="401"}', text)
+        self.assertIn('otp_sync_batch_entries_bucket{le="1"}', text)
+        self.assertIn('otp_sync_stage_seconds_count{stage="auth"}', text)
+        self.assertIn("otp_sync_sends_in_flight 0", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
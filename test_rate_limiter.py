@@ -0,0 +1,92 @@
+import unittest
+
+import httpx
+
+from rate_limiter import DeliveryScheduler, TokenBucket
+from telegram_sender import TelegramAPIError
+
+
+class ScriptedSender:
+    """Raises the queued errors in order, then succeeds."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"message_id": self.calls}
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=2, capacity=2)
+        now = bucket.updated
+        self.assertEqual(bucket.reserve(now), 0)
+        self.assertEqual(bucket.reserve(now), 0)
+        self.assertAlmostEqual(bucket.reserve(now), 0.5)
+        self.assertAlmostEqual(bucket.reserve(now), 1.0)
+
+    def test_block(self):
+        bucket = TokenBucket(rate=10, capacity=10)
+        now = bucket.updated
+        bucket.block(3, now)
+        self.assertAlmostEqual(bucket.reserve(now), 3)
+        self.assertFalse(bucket.idle(now + 1))
+        self.assertTrue(bucket.idle(now + 4))
+
+
+class TestDeliveryScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_retries_after_429(self):
+        sender = ScriptedSender([TelegramAPIError(429, "Too Many Requests", retry_after=0.05)])
+        scheduler = DeliveryScheduler(sender)
+
+        result = await scheduler.send_message("1", "hi")
+
+        self.assertEqual(result, {"message_id": 2})
+        stats = scheduler.stats()
+        self.assertEqual(stats["throttled"], 1)
+        self.assertEqual(stats["retries"], 1)
+        self.assertGreaterEqual(stats["max_wait_seconds"], 0.04)
+
+    async def test_long_retry_after_is_not_waited(self):
+        sender = ScriptedSender([TelegramAPIError(429, "Too Many Requests", retry_after=60)])
+        scheduler = DeliveryScheduler(sender, max_delay=30)
+
+        with self.assertRaises(TelegramAPIError):
+            await scheduler.send_message("1", "hi")
+        self.assertEqual(sender.calls, 1)
+
+    async def test_server_errors_back_off(self):
+        sender = ScriptedSender([
+            TelegramAPIError(502, "Bad Gateway"),
+            httpx.ConnectError("refused"),
+        ])
+        scheduler = DeliveryScheduler(sender, backoff_base=0.01)
+
+        await scheduler.send_message("1", "hi")
+        self.assertEqual(sender.calls, 3)
+
+    async def test_client_errors_are_not_retried(self):
+        sender = ScriptedSender([TelegramAPIError(400, "Bad Request: chat not found")])
+        scheduler = DeliveryScheduler(sender)
+
+        with self.assertRaises(TelegramAPIError):
+            await scheduler.send_message("1", "hi")
+        self.assertEqual(sender.calls, 1)
+
+    async def test_chat_limit_smooths_bursts(self):
+        sender = ScriptedSender()
+        scheduler = DeliveryScheduler(sender, chat_rate=100, chat_burst=1)
+
+        for _ in range(3):
+            await scheduler.send_message("1", "hi")
+        await scheduler.send_message("2", "hi")
+
+        self.assertEqual(scheduler.stats()["waited_sends"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
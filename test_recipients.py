@@ -0,0 +1,91 @@
+import os
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from bot_updates import handle_update
+from delivery import DeliveryEngine
+from metrics import Metrics
+from recipients import RecipientRegistry, is_recipient_error, parse_ids
+from telegram_sender import TelegramAPIError
+from test_delivery import FakeSender
+
+
+class CallRecorder:
+    async def call(self, method, **params):
+        return True
+
+
+class TestParseIds(unittest.TestCase):
+    def test_split_and_cache(self):
+        parse_ids.cache_clear()
+        self.assertEqual(parse_ids(" 1, 2,,3 "), ("1", "2", "3"))
+        self.assertEqual(parse_ids(" 1, 2,,3 "), ("1", "2", "3"))
+        self.assertEqual(parse_ids.cache_info().hits, 1)
+
+
+class TestRecipientRegistry(unittest.TestCase):
+    def test_refused_until_ttl(self):
+        registry = RecipientRegistry(ttl=60)
+        registry.refuse("052504904", TelegramAPIError(403, "Forbidden: bot was blocked by the user"), now=0)
+        with self.assertRaises(TelegramAPIError) as error:
+            registry.check("52504904", now=30)
+        self.assertEqual(error.exception.error_code, 403)
+        registry.check("52504904", now=60)
+        self.assertEqual(registry.refused(), 0)
+
+    def test_interaction_clears_refusal(self):
+        registry = RecipientRegistry()
+        registry.refuse("7", TelegramAPIError(400, "Bad Request: chat not found"))
+        registry.record(7)
+        registry.check("7")
+        self.assertEqual(registry.refused(), 0)
+
+    def test_ids_that_cannot_be_chats(self):
+        metrics = Metrics()
+        registry = RecipientRegistry(metrics=metrics)
+        with self.assertRaises(TelegramAPIError):
+            registry.check("INVALID_BOT_ID")
+        registry.check("@channel")
+        registry.check("-1001234567890")
+        self.assertIn("otp_sync_recipients_short_circuited_total 1", metrics.render())
+
+    def test_recipient_errors(self):
+        self.assertTrue(is_recipient_error(TelegramAPIError(400, "Bad Request: chat not found")))
+        self.assertTrue(is_recipient_error(TelegramAPIError(403, "Forbidden: user is deactivated")))
+        self.assertFalse(is_recipient_error(TelegramAPIError(400, "Bad Request: can't parse entities")))
+        self.assertFalse(is_recipient_error(TelegramAPIError(502, "Bad Gateway")))
+
+
+class TestEngineWithRegistry(unittest.IsolatedAsyncioTestCase):
+    async def test_known_bad_chats_skip_telegram(self):
+        sender = FakeSender(failing={"13"})
+        calls = []
+        send_message = sender.send_message
+
+        async def counting(chat_id, text, parse_mode=None):
+            calls.append(chat_id)
+            return await send_message(chat_id, text, parse_mode)
+
+        sender.send_message = counting
+        engine = DeliveryEngine(sender, lambda data: data["sms"], registry=RecipientRegistry())
+
+        first = await engine.deliver([{"ids": "13,INVALID_BOT_ID,1", "sms": "a"}])
+        second = await engine.deliver([{"ids": "13,1", "sms": "b"}])
+
+        self.assertEqual(calls, ["13", "1", "1"])
+        self.assertEqual([f["user_id"] for f in first.failed], ["13", "INVALID_BOT_ID"])
+        self.assertIn("chat not found", second.failed[0]["error"])
+
+    async def test_update_records_chat(self):
+        registry = RecipientRegistry()
+        registry.refuse("42", TelegramAPIError(403, "Forbidden: bot was blocked by the user"))
+        update = {"update_id": 1, "message": {"message_id": 5, "chat": {"id": 42}, "from": {"id": 42}}}
+        await handle_update(CallRecorder(), update, registry)
+        registry.check("42")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import ssl
+import tempfile
+import unittest
+
+from bench_tls import write_certificate
+from serving import TunedConfig, serve, ssl_context
+
+
+class TestServing(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.certfile, self.keyfile = write_certificate(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_ssl_context(self):
+        context = ssl_context(self.certfile, self.keyfile, session_tickets=3)
+        self.assertEqual(context.num_tickets, 3)
+        self.assertEqual(context.minimum_version, ssl.TLSVersion.TLSv1_2)
+        self.assertFalse(context.options & ssl.OP_NO_TICKET)
+
+        context = ssl_context(self.certfile, self.keyfile, session_tickets=0)
+        self.assertTrue(context.options & ssl.OP_NO_TICKET)
+
+    def test_config_uses_tuned_context(self):
+        config = TunedConfig(
+            "bench_tls:create_bench_app", factory=True, ssl_certfile=self.certfile,
+            ssl_keyfile=self.keyfile, session_tickets=0, timeout_keep_alive=75,
+        )
+        config.load()
+        self.assertTrue(config.ssl.options & ssl.OP_NO_TICKET)
+        self.assertEqual(config.timeout_keep_alive, 75)
+
+    def test_rejects_unknown_settings(self):
+        with self.assertRaises(ValueError):
+            serve(loop="trio")
+        with self.assertRaises(ValueError):
+            serve(http="h3")
+
+
+if __name__ == "__main__":
+    unittest.main()
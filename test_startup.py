@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_python(code, **env):
+    environ = {k: v for k, v in os.environ.items() if k != "BOT_TOKEN"}
+    environ.update(env)
+    return subprocess.run(
+        [sys.executable, "-c", code], cwd=HERE, env=environ, capture_output=True, text=True, timeout=60
+    )
+
+
+class TestLazyImport(unittest.TestCase):
+    def test_import_without_token(self):
+        result = run_python(
+            "import logging, sys, threading, main; "
+            "print(main.format_message({'sms': 'code 1234'})); "
+            "print(sorted(m for m in ('telebot', 'cryptography', 'uvicorn') if m in sys.modules)); "
+            "print(threading.active_count(), logging.getLogger().handlers)",
+            BOT_MODE="webhook",
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        # No logging thread or handlers, and no check of the webhook settings yet
+        self.assertEqual(result.stdout.splitlines(), ["code `1234`", "[]", "1 []"])
+
+    def test_startup_needs_webhook_url(self):
+        result = run_python(
+            "from fastapi.testclient import TestClient; import main\n"
+            "with TestClient(main.create_app()): pass",
+            BOT_TOKEN="123:TEST", BOT_MODE="webhook", WEBHOOK_URL="",
+        )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("WEBHOOK_URL is required", result.stderr)
+
+    def test_startup_needs_token(self):
+        result = run_python(
+            "from fastapi.testclient import TestClient; import main\n"
+            "with TestClient(main.create_app()): pass"
+        )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("BOT_TOKEN not found", result.stderr)
+
+
+class TestHealthEndpoints(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        import main
+
+        self.app = main.create_app()
+        self.client = TestClient(self.app)
+
+    def test_not_ready_before_startup(self):
+        self.assertEqual(self.client.get("/healthz").status_code, 200)
+        response = self.client.get("/readyz")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {"status": "not_ready", "checks": {"started": False}})
+
+    def test_ready(self):
+        with self.client:
+            response = self.client.get("/readyz")
+        self.assertEqual(response.status_code, 200)
+        checks = response.json()["checks"]
+        self.assertEqual(checks["backend"], "ok")
+        self.assertEqual(checks["telegram"], "closed")
+        self.assertEqual(checks["consumer"], "none")
+
+    def test_backend_failure(self):
+        with self.client:
+            async def broken(key):
+                raise OSError("disk I/O error")
+
+            self.app.state.backend.contains = broken
+            response = self.client.get("/readyz")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["checks"]["backend"], "disk I/O error")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from rate_limiter import DeliveryScheduler
+from state_backend import MemoryBackend, OwnerLock, SQLiteBackend, create_backend
+from test_rate_limiter import ScriptedSender
+
+
+class BackendContract:
+    """Behaviour every STATE_BACKEND must share."""
+
+    async def test_add_is_set_if_absent(self):
+        self.assertTrue(await self.backend.add("k", 60))
+        self.assertFalse(await self.backend.add("k", 60))
+        self.assertTrue(await self.backend.contains("k"))
+        await self.backend.discard("k")
+        self.assertFalse(await self.backend.contains("k"))
+
+    async def test_keys_expire(self):
+        self.assertTrue(await self.backend.add("k", 0.01))
+        await asyncio.sleep(0.02)
+        self.assertFalse(await self.backend.contains("k"))
+        self.assertTrue(await self.backend.add("k", 60))
+
+    async def test_reserve_and_block(self):
+        self.assertEqual(await self.backend.reserve("b", 1, 1), 0)
+        self.assertGreater(await self.backend.reserve("b", 1, 1), 0.9)
+        await self.backend.block("c", 1, 5, 10)
+        self.assertGreater(await self.backend.reserve("c", 1, 5), 9)
+
+
+class TestMemoryBackend(BackendContract, unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.backend = MemoryBackend()
+
+
+class TestSQLiteBackend(BackendContract, unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "state.db")
+        self.backend = create_backend(f"sqlite:///{self.path}")
+
+    async def asyncTearDown(self):
+        await self.backend.close()
+        self.tmp.cleanup()
+
+    async def test_buckets_are_shared(self):
+        other = SQLiteBackend(self.path)
+        self.assertEqual(await self.backend.reserve("global", 1, 1), 0)
+        self.assertGreater(await other.reserve("global", 1, 1), 0.9)
+        await other.close()
+
+    async def test_scheduler_uses_backend(self):
+        scheduler = DeliveryScheduler(ScriptedSender(), backend=self.backend, chat_rate=100, chat_burst=1)
+        await scheduler.send_message("1", "hi")
+        await scheduler.send_message("1", "hi")
+        self.assertEqual(scheduler.stats()["waited_sends"], 1)
+
+
+class TestOwnerLock(unittest.TestCase):
+    def test_single_owner(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "consumer.lock")
+            first, second = OwnerLock(path), OwnerLock(path)
+            self.assertTrue(first.try_acquire())
+            self.assertFalse(second.try_acquire())
+            first.release()
+            self.assertTrue(second.try_acquire())
+            second.release()
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_backend("redis://localhost")
+
+
+if __name__ == "__main__":
+    unittest.main()
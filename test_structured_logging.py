@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import queue
+import sys
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
+
+from structured_logging import (
+    ContextFilter,
+    DroppingQueueHandler,
+    JsonFormatter,
+    RepeatFilter,
+    TextFormatter,
+    correlation_id,
+    redact,
+)
+
+
+def make_record(msg="Failed to send message", level=logging.WARNING, **extra):
+    return logging.makeLogRecord(
+        {"name": "delivery", "levelno": level, "levelname": logging.getLevelName(level), "msg": msg, **extra}
+    )
+
+
+class TestRedact(unittest.TestCase):
+    def test_codes_and_phones(self):
+        self.assertEqual(redact("Your code is 828627"), "Your code is ******")
+        self.assertEqual(redact("Code 123-456 expires"), "Code ******* expires")
+        self.assertEqual(redact("call from +1 (555) 010-9999"), "call from " + "*" * 15 + "99")
+
+    def test_leaves_short_numbers(self):
+        self.assertEqual(redact("Error code: 429, retry after 7"), "Error code: 429, retry after 7")
+
+
+class TestJsonFormatter(unittest.TestCase):
+    def test_fields(self):
+        record = make_record(chat_id="123456789", error="Bad Request: code 828627", correlation_id="req-1")
+        line = json.loads(JsonFormatter().format(record))
+        self.assertEqual(line["level"], "warning")
+        self.assertEqual(line["logger"], "delivery")
+        self.assertEqual(line["msg"], "Failed to send message")
+        self.assertEqual(line["chat_id"], "123456789")
+        self.assertEqual(line["error"], "Bad Request: code ******")
+        self.assertEqual(line["correlation_id"], "req-1")
+
+    def test_no_redaction(self):
+        record = make_record(error="code 828627")
+        self.assertEqual(json.loads(JsonFormatter(redact_values=False).format(record))["error"], "code 828627")
+
+
+class TestTextFormatter(unittest.TestCase):
+    def test_extras_redacted(self):
+        record = make_record(
+            "Code 828627 for +1 555 010 9999", chat_id="123456789", error="code 4821", correlation_id="req-1"
+        )
+        line = TextFormatter().format(record)
+        self.assertTrue(line.endswith(
+            'WARNING delivery [req-1] Code ****** for *************99 chat_id=123456789 error="code ****"'
+        ), line)
+
+    def test_no_redaction(self):
+        self.assertIn("error=4821", TextFormatter(redact_values=False).format(make_record(error="4821")))
+
+
+class TestRepeatFilter(unittest.TestCase):
+    def test_burst_then_suppressed(self):
+        repeat = RepeatFilter(burst=2, window=60)
+        passed = [repeat.filter(make_record(error="timeout")) for _ in range(5)]
+        self.assertEqual(passed, [True, True, False, False, False])
+        # A different error is counted separately
+        self.assertTrue(repeat.filter(make_record(error="chat not found")))
+
+    def test_suppressed_count_after_window(self):
+        repeat = RepeatFilter(burst=1, window=60)
+        for _ in range(3):
+            repeat.filter(make_record())
+        repeat.window = 0  # the window has passed
+        record = make_record()
+        self.assertTrue(repeat.filter(record))
+        self.assertEqual(record.suppressed, 2)
+
+    def test_info_not_sampled(self):
+        repeat = RepeatFilter(burst=1)
+        self.assertTrue(all(repeat.filter(make_record(level=logging.INFO)) for _ in range(3)))
+
+
+class TestQueueHandler(unittest.TestCase):
+    def test_drops_when_full(self):
+        handler = DroppingQueueHandler(queue.Queue(2))
+        for _ in range(5):
+            handler.handle(make_record())
+        self.assertEqual(handler.queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 3)
+
+    def test_record_carries_context_and_traceback(self):
+        handler = DroppingQueueHandler(queue.Queue())
+        handler.addFilter(ContextFilter())
+        token = correlation_id.set("req-2")
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            record = make_record("Unexpected error %s", args=("x",), exc_info=sys.exc_info())
+            handler.handle(record)
+        finally:
+            correlation_id.reset(token)
+        queued = handler.queue.get_nowait()
+        self.assertEqual(queued.msg, "Unexpected error x")
+        self.assertIsNone(queued.exc_info)
+        line = json.loads(JsonFormatter().format(queued))
+        self.assertEqual(line["correlation_id"], "req-2")
+        self.assertIn("RuntimeError: boom", line["exc"])
+
+
+class TestCorrelationId(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        import main
+        from test_delivery import FakeSender
+        from delivery import DeliveryEngine
+
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.sender = FakeSender(failing={"bad"})
+        main.app.state.delivery = DeliveryEngine(self.sender, main.format_message)
+        self.headers = {"X-Auth-Key": main.AUTH_KEY}
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+
+    def test_request_id_in_response_and_logs(self):
+        records = []
+        capture = logging.Handler()
+        capture.addFilter(ContextFilter())
+        capture.emit = records.append
+        logger = logging.getLogger("delivery")
+        logger.addHandler(capture)
+        try:
+            response = self.client.post(
+                "/receive_data", headers={**self.headers, "X-Request-ID": "abc-123"},
+                json=[{"ids": "bad", "sms": "Code 123456"}],
+            )
+        finally:
+            logger.removeHandler(capture)
+
+        self.assertEqual(response.headers["X-Request-ID"], "abc-123")
+        self.assertEqual([r.correlation_id for r in records], ["abc-123"])
+        self.assertEqual(records[0].chat_id, "bad")
+
+    def test_generated_request_id(self):
+        response = self.client.post("/receive_data", headers={**self.headers, "X-Request-ID": "bad id!"}, json=[])
+        self.assertRegex(response.headers["X-Request-ID"], r"^[0-9a-f]{16}$")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,37 +1,12 @@
+import os
 import unittest
-from unittest.mock import patch, MagicMock
-import json
-import re
 
+# main needs no bot token to import; set one anyway like the other tests
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("AUTH_KEY", "test-auth-key")
+os.environ.setdefault("BOT_MODE", "off")
 
-def extract_otp_codes(text: str) -> str:
-    """Extract OTP codes from text and wrap them in backticks for easy copying."""
-    otp_pattern = r'\b(\d{4,8})\b'
-    
-    def replace_otp(match):
-        return f"`{match.group(1)}`"
-    
-    formatted_text = re.sub(otp_pattern, replace_otp, text)
-    return formatted_text
-
-
-def format_message(data: dict) -> str:
-    """Format the incoming data into a readable Telegram message."""
-    lines = []
-    
-    # Check if it's SMS or Call
-    has_call = bool(data.get("call") and data.get("call", True))
-    has_sms = bool(data.get("sms"))
-    
-    if has_sms:
-        # Format SMS message
-        formatted_sms = extract_otp_codes(data["sms"])
-        lines.append(formatted_sms)
-    elif has_call:
-        # Format Call message
-        lines.append(f"📞 {data.get('from', 'Unknown')}, {data.get('to', 'Unknown')}")
-    
-    return "\n".join(lines)
+from main import format_message
 
 
 class TestTestWebhook(unittest.TestCase):
@@ -55,7 +30,7 @@ class TestTestWebhook(unittest.TestCase):
             "to": "SIM 1"
         }
         msg = format_message(entry)
-        self.assertIn("📞 +861234567890, SIM 1", msg)
+        self.assertIn("📞 \\+861234567890 \\(`567890`\\), SIM 1", msg)
 
     def test_invalid_no_content(self):
         """Test that empty message is returned when neither SMS nor call provided."""